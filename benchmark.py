@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import resource
+import subprocess
+from optparse import OptionParser
+from datetime import datetime
+from ConfigParser import ConfigParser
+
+__all__ = ["KINDS", "benchmark_config", "run_benchmark", "compare"]
+
+DAXGEN_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# The workflows that are benchmarked: the base config, whether it is
+# synthetic, and the dimension that is swept to get the number of points.
+# daxgenQ sweeps charges (one generated PSF per charge) for up to
+# MAX_CHARGES charges and temperatures for the rest.
+KINDS = {
+    "daxgen": ("test.cfg", False, "temperatures"),
+    "synthetic": ("test.cfg", True, "temperatures"),
+    "daxgenQ": ("testQ.cfg", False, "charges"),
+}
+
+MAX_CHARGES = 100
+
+DEFAULT_SIZES = "1,10,100,1000,10000"
+
+# The phases of the generator's profile shown in the table, besides the
+# template rendering time: (column, phase)
+SUMMARY_PHASES = [
+    ("configs", "generate_point_configs"),
+    ("psf", "generate_psf"),
+    ("dax_build", "generate_pipeline"),
+    ("xml_write", "dax_write"),
+    ("replica_catalog", "generate_replica_catalog"),
+]
+
+def benchmark_config(kind, points, path):
+    "Write the config for a 'kind' workflow with 'points' sweep points to 'path'"
+    cfg, synthetic, dimension = KINDS[kind]
+    config = ConfigParser()
+    config.read(os.path.join(DAXGEN_DIR, cfg))
+    for option in ("temperature", "temperatures", "charge", "charges"):
+        config.remove_option("simulation", option)
+
+    if dimension == "charges":
+        charges = min(points, MAX_CHARGES)
+        temperatures = max(1, points // charges)
+        config.set("simulation", "charges", ",".join(str(30 + i) for i in range(charges)))
+    else:
+        config.set("simulation", "charge", "42")
+        temperatures = points
+    config.set("simulation", "temperatures", ",".join("%.1f" % (200 + 0.1 * i) for i in range(temperatures)))
+
+    f = open(path, "w")
+    try:
+        config.write(f)
+    finally:
+        f.close()
+
+def directory_usage(path):
+    "Return (files, bytes) under 'path'"
+    files = 0
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def summary_phases(phases):
+    "Return the phases shown in the table: {name: seconds}"
+    summary = {
+        "render": sum(seconds for name, seconds in phases.items() if name.startswith("format_template:")),
+    }
+    for name, phase in SUMMARY_PHASES:
+        if phase in phases:
+            summary[name] = phases[phase]
+    return summary
+
+def run_child(kind, points, workdir, daxgen_args):
+    """Generate one workflow in this process with the generator's profiling
+    enabled and return its measurements. The workflow is written to
+    workdir/run; synthetic input mocks go to workdir/inputs."""
+    import daxgen
+
+    cfg = os.path.join(workdir, "bench.cfg")
+    outdir = os.path.join(workdir, "run")
+    benchmark_config(kind, points, cfg)
+    args = ["--profile"] + list(daxgen_args)
+    if KINDS[kind][1]:
+        args.append("--synthetic")
+        os.makedirs(os.path.join(workdir, "inputs"))
+    os.chdir(workdir)
+
+    sys.argv = ["daxgen.py"] + args + [cfg, outdir]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    start = time.time()
+    try:
+        daxgen.main()
+    finally:
+        sys.stdout = stdout
+    wall = time.time() - start
+
+    f = open(os.path.join(outdir, "profile.json"))
+    try:
+        profile = json.load(f)
+    finally:
+        f.close()
+    os.unlink(os.path.join(outdir, "profile.json"))
+
+    files, size = directory_usage(outdir)
+    return {
+        "kind": kind,
+        "points": points,
+        "wall": wall,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "files": files,
+        "bytes": size,
+        "bytes_written": profile["bytes_written"],
+        "files_written": profile["files_written"],
+        "phases": dict((name, p["seconds"]) for name, p in profile["phases"].items())
+    }
+
+def run_benchmark(kind, points, daxgen_args=(), repeat=1):
+    """Generate a 'kind' workflow with 'points' points in a fresh process
+    'repeat' times and return the measurements of the fastest run"""
+    best = None
+    for i in range(repeat):
+        workdir = tempfile.mkdtemp(prefix="sns-bench-")
+        try:
+            cmd = [sys.executable, os.path.realpath(__file__), "--child", kind, str(points), workdir]
+            cmd.extend(daxgen_args)
+            start = time.time()
+            output = subprocess.check_output(cmd)
+            result = json.loads(output.splitlines()[-1])
+            result["process_wall"] = time.time() - start
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if best is None or result["wall"] < best["wall"]:
+            best = result
+    return best
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """Return a list of regression messages for the 'results' that are more
+    than 'tolerance' (a fraction) slower or bigger than in 'baseline'. Times
+    below 'min_seconds' are not compared, as they are mostly noise."""
+    previous = dict(((r["kind"], r["points"]), r) for r in baseline["results"])
+    regressions = []
+    for r in results:
+        old = previous.get((r["kind"], r["points"]))
+        if old is None:
+            continue
+        checks = [("wall", r["wall"], old["wall"], True),
+            ("max_rss_kb", r["max_rss_kb"], old["max_rss_kb"], False),
+            ("bytes", r["bytes"], old["bytes"], False)]
+        for phase, seconds in sorted(r["phases"].items()):
+            if phase in old["phases"]:
+                checks.append(("phase " + phase, seconds, old["phases"][phase], True))
+        for name, new, base, is_time in checks:
+            if is_time and max(new, base) < min_seconds:
+                continue
+            if new > base * (1 + tolerance):
+                regressions.append("%s %d points: %s %.4g -> %.4g (%+.0f%%)" % (
+                    r["kind"], r["points"], name, base, new, 100.0 * (new - base) / base if base else 100))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=DAXGEN_DIR,
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        kind, points, workdir = sys.argv[2:5]
+        result = run_child(kind, int(points), workdir, sys.argv[5:])
+        print json.dumps(result, sort_keys=True)
+        return
+
+    parser = OptionParser(usage="%prog [options] [-- DAXGEN_OPTIONS]")
+    parser.add_option("-k", "--kinds", action="store", dest="kinds", default="daxgen,synthetic,daxgenQ",
+        help="Comma-separated workflows to generate: %s [default: %%default]" % ", ".join(sorted(KINDS)))
+    parser.add_option("-s", "--sizes", action="store", dest="sizes", default=DEFAULT_SIZES,
+        help="Comma-separated numbers of sweep points [default: %default]")
+    parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat", default=1,
+        help="Runs per size; the fastest is reported [default: %default]")
+    parser.add_option("-o", "--output", action="store", dest="output", default=None,
+        help="Write the results to this JSON file")
+    parser.add_option("-b", "--baseline", action="store", dest="baseline", default=None,
+        help="Compare with the results in this JSON file and exit with status 1 on regressions")
+    parser.add_option("-t", "--tolerance", action="store", type="float", dest="tolerance", default=0.2,
+        help="Fraction by which a result may exceed the baseline [default: %default]")
+    options, args = parser.parse_args()
+
+    kinds = [k.strip() for k in options.kinds.split(",") if k.strip()]
+    for kind in kinds:
+        if kind not in KINDS:
+            parser.error("Unknown kind: %s" % kind)
+    sizes = [int(s) for s in options.sizes.split(",") if s.strip()]
+
+    results = []
+    print "%-10s %7s %9s %10s %8s %12s  %s" % ("kind", "points", "wall (s)", "RSS (MB)", "files", "bytes", "phases (s)")
+    for kind in kinds:
+        for points in sizes:
+            r = run_benchmark(kind, points, args, options.repeat)
+            results.append(r)
+            print "%-10s %7d %9.3f %10.1f %8d %12d  %s" % (kind, points, r["wall"], r["max_rss_kb"] / 1024.0,
+                r["files"], r["bytes"], " ".join("%s=%.3f" % p for p in sorted(summary_phases(r["phases"]).items())))
+            sys.stdout.flush()
+
+    report = {
+        "created": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "host": socket.gethostname(),
+        "python": sys.version.split()[0],
+        "revision": git_revision(),
+        "daxgen_options": args,
+        "results": results
+    }
+    if options.output:
+        f = open(options.output, "w")
+        try:
+            json.dump(report, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    if options.baseline:
+        f = open(options.baseline)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        regressions = compare(results, baseline, options.tolerance)
+        for message in regressions:
+            print "REGRESSION: %s" % message
+        if regressions:
+            sys.exit(1)
+        print "No regressions against %s" % options.baseline
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import hashlib
+import tempfile
+from profiling import PROFILE
+
+__all__ = ["ContentStore"]
+
+class ContentStore(object):
+    """A directory of files named by the SHA-256 digest of their contents.
+
+    Each distinct blob is stored once as root/<first two hex digits>/<digest>.
+    Writes go through a temporary file and a rename, so several processes
+    can share a store.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        "Return the path of the blob with 'digest'"
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        "Store 'data' if it is not already present and return its digest"
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=dirname)
+        f = os.fdopen(fd, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+        PROFILE.wrote(len(data))
+        return digest
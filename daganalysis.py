@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+import sys
+from optparse import OptionParser
+
+__all__ = ["file_edges", "reachable", "transitive_reduction", "validate", "critical_path", "analyze_dax"]
+
+def describe(job):
+    "Return a name for 'job' (a DAX3 Job or an estimator SimJob) in messages"
+    return getattr(job, "node_label", None) or getattr(job, "label", None) or str(job)
+
+def file_edges(jobs, files):
+    """Return the (producer, consumer) edges between 'jobs' that follow from
+    the files they use, in job order. 'files(job)' returns the names of the
+    (inputs, outputs) of a job. A file with more than one producer is an
+    error."""
+    uses = [(job, files(job)) for job in jobs]
+    producer = {}
+    for job, (inputs, outputs) in uses:
+        for name in outputs:
+            other = producer.setdefault(name, job)
+            if other is not job:
+                raise Exception("%s is written by both %s and %s" % (name, describe(other), describe(job)))
+
+    edges = []
+    seen = set()
+    for job, (inputs, outputs) in uses:
+        for name in sorted(inputs):
+            parent = producer.get(name)
+            if parent is None or parent is job or (parent, job) in seen:
+                continue
+            seen.add((parent, job))
+            edges.append((parent, job))
+    return edges
+
+def children_of(edges):
+    children = {}
+    for parent, child in edges:
+        children.setdefault(parent, []).append(child)
+    return children
+
+def reachable(edges):
+    """Return {job: set of jobs reachable from it} for the jobs with
+    children in 'edges'. A cycle is an error."""
+    children = children_of(edges)
+    result = {}
+    visiting = set()
+
+    def visit(job):
+        if job in result:
+            return result[job]
+        if job in visiting:
+            raise Exception("The workflow has a cycle through %s" % describe(job))
+        visiting.add(job)
+        below = set()
+        for child in children.get(job, ()):
+            below.add(child)
+            below.update(visit(child))
+        visiting.discard(job)
+        result[job] = below
+        return below
+
+    for job in children:
+        visit(job)
+    return result
+
+def transitive_reduction(edges):
+    """Return the 'edges' that are not implied by the others, i.e. the
+    smallest set of edges with the same ordering, in their original order"""
+    children = children_of(edges)
+    below = reachable(edges)
+    result = []
+    for parent, child in edges:
+        if not any(child in below.get(other, ()) for other in children[parent] if other is not child):
+            result.append((parent, child))
+    return result
+
+def validate(declared, derived):
+    """Compare the 'declared' edges of a workflow with the edges 'derived'
+    from its files. Return (missing, overconstrained, redundant):
+
+    missing: derived edges not implied by the declared ones, so a job could
+        start before an input is written
+    overconstrained: declared edges not implied by the derived ones, so a
+        job waits for a job whose outputs it does not read
+    redundant: declared edges implied by other declared edges
+    """
+    declared_below = reachable(declared)
+    derived_below = reachable(derived)
+    missing = [(p, c) for p, c in derived if c not in declared_below.get(p, ())]
+    overconstrained = [(p, c) for p, c in declared if c not in derived_below.get(p, ())]
+    minimal = set(transitive_reduction(declared))
+    redundant = [e for e in declared if e not in minimal]
+    return missing, overconstrained, redundant
+
+def critical_path(jobs, edges, weight):
+    """Return the length and the jobs of the longest chain of 'jobs' along
+    'edges', where each job takes 'weight(job)'"""
+    parents = {}
+    for parent, child in edges:
+        parents.setdefault(child, []).append(parent)
+    finish = {}
+    via = {}
+
+    # Iterative depth-first search, so that long chains do not hit the
+    # recursion limit
+    for job in jobs:
+        stack = [job]
+        while stack:
+            top = stack[-1]
+            if top in finish:
+                stack.pop()
+                continue
+            pending = [p for p in parents.get(top, ()) if p not in finish]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            before = max(parents.get(top, ()), key=lambda p: finish[p]) if top in parents else None
+            finish[top] = (finish[before] if before is not None else 0) + weight(top)
+            via[top] = before
+
+    if not finish:
+        return 0, []
+    job = max(jobs, key=lambda j: finish[j])
+    length = finish[job]
+    path = []
+    while job is not None:
+        path.append(job)
+        job = via[job]
+    return length, path[::-1]
+
+def sim_files(job):
+    "Return the (inputs, outputs) of an estimator SimJob"
+    return ([name for name, link in job.uses if link in ("input", "inout")],
+        [name for name, link in job.uses if link in ("output", "inout")])
+
+def analyze_dax(path):
+    """Check the dependencies of the DAX in 'path' against its files and
+    return a dict with the jobs, the declared, derived and minimal edges, the
+    result of validate() and the critical path by maxwalltime"""
+    from estimator import load_dax
+
+    jobs = load_dax(path)
+    declared = [(p, job) for job in jobs for p in sorted(job.parents, key=lambda j: j.id)]
+    derived = file_edges(jobs, sim_files)
+    minimal = transitive_reduction(derived)
+    missing, overconstrained, redundant = validate(declared, derived)
+    return {
+        "jobs": jobs,
+        "declared": declared,
+        "derived": derived,
+        "minimal": minimal,
+        "missing": missing,
+        "overconstrained": overconstrained,
+        "redundant": redundant,
+        "critical_path": critical_path(jobs, minimal, lambda job: job.walltime)
+    }
+
+def main():
+    parser = OptionParser(usage="%prog [options] DAXFILE")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
+        help="List every problem edge instead of the first few")
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Specify DAXFILE")
+
+    result = analyze_dax(args[0])
+    print "%d jobs, %d declared edges, %d derived from files, %d after transitive reduction" % (
+        len(result["jobs"]), len(result["declared"]), len(result["derived"]), len(result["minimal"]))
+
+    for key, description in [("missing", "Missing edges (a job reads a file before it is written)"),
+            ("overconstrained", "Over-constrained edges (a job waits for a job whose outputs it does not read)"),
+            ("redundant", "Redundant edges (implied by other edges)")]:
+        edges = result[key]
+        if not edges:
+            continue
+        print "%s: %d" % (description, len(edges))
+        for parent, child in edges if options.verbose else edges[:10]:
+            print "  %s -> %s" % (describe(parent), describe(child))
+        if len(edges) > 10 and not options.verbose:
+            print "  ..."
+
+    length, path = result["critical_path"]
+    print "Critical path: %.0f minutes of maxwalltime over %d jobs: %s" % (
+        length, len(path), " -> ".join(describe(job) for job in path))
+
+    if result["missing"]:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,176 +1,674 @@
 #!/usr/bin/env python
 import sys
-import string
 import os
+import cProfile
 import shutil
+import json
+import multiprocessing
+from optparse import OptionParser
 from datetime import datetime
 from ConfigParser import ConfigParser
 from Pegasus.DAX3 import ADAG, Job, File, Link
 from kegparametersfactory import KegParametersFactory
+from sweep import ParameterSweep, DIMENSIONS, warm_start_order
+from daxwriter import StreamingADAG
+from templatecache import TemplateRegistry
+from contentstore import ContentStore
+from manifest import Manifest, digest, hash_config, hash_directory
+from jobsizing import JobSizer
+from estimator import Estimator, dcd_size, dcdpack_size, fqt_size, rms_size
+from retention import RetentionPolicy
+from daganalysis import file_edges, transitive_reduction
+from fqtstore import write_index
+from memo import MemoCache, KEYS_FILE, job_key, output_key
+from hashcache import HashCache
+from profiling import PROFILE
+import psfgen
 
 DAXGEN_DIR = os.path.dirname(os.path.realpath(__file__))
 TEMPLATE_DIR = os.path.join(DAXGEN_DIR, "templates")
 
-def format_template(name, outfile, **kwargs):
-    "This fills in the values for the template called 'name' and writes it to 'outfile'"
-    templatefile = os.path.join(TEMPLATE_DIR, name)
-    template = open(templatefile).read()
-    formatter = string.Formatter()
-    data = formatter.format(template, **kwargs)
-    f = open(outfile, "w")
-    try:
-        f.write(data)
-    finally:
-        f.close()
+# Templates are read and compiled once per process
+TEMPLATES = TemplateRegistry(TEMPLATE_DIR)
+
+DEFAULT_HASH_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "sns-workflow", "hashes.json")
+
+# Values of the NAMD configs that differ between sweep points. When config
+# files are deduplicated they are passed to NAMD in SNS_<NAME> environment
+# variables, so one config file serves every point.
+NAMD_ENVIRONMENT = ["temperature", "pressure", "charge", "structure",
+    "inputname", "outputname", "timesteps"]
+
+# The workflow that config generation worker processes render points for
+_worker_workflow = None
+
+def _init_worker(workflow):
+    global _worker_workflow
+    _worker_workflow = workflow
+    # Forked workers start with a copy of the parent's counts
+    PROFILE.reset()
+
+def _generate_point_configs(point):
+    """Generate the config files for 'point' in a worker and return them with
+    the replica and manifest entries the worker created"""
+    workflow = _worker_workflow
+    workflow.replicas = {}
+    workflow.manifest.files = {}
+    workflow.manifest.points = {}
+    configs = workflow.generate_point_configs(point)
+    return (point, configs, workflow.replicas, workflow.manifest.files, workflow.manifest.points,
+        PROFILE.take())
+
+def template_digests(hashes):
+    "Return the digest of every template, looked up in the HashCache 'hashes'"
+    paths = [os.path.join(TEMPLATE_DIR, name) for name in sorted(os.listdir(TEMPLATE_DIR))]
+    files = hashes.lookup([path for path in paths if os.path.isfile(path)])
+    return dict((os.path.basename(path), checksum) for path, (size, checksum) in files.items())
+
+def split_range(n, parts):
+    "Return (start, stop) for each of 'parts' contiguous, nearly equal slices of range(n)"
+    result = []
+    start = 0
+    for k in range(parts):
+        stop = start + n // parts + (1 if k < n % parts else 0)
+        result.append((start, stop))
+        start = stop
+    return result
+
+def job_files(job):
+    "Return the names of the (inputs, outputs) of a DAX3 job"
+    return ([u.name for u in job.used if u.link == Link.INPUT],
+        [u.name for u in job.used if u.link == Link.OUTPUT])
+
+def restart_files(outputname):
+    """Return the restart files NAMD writes for 'outputname' (coordinates,
+    extended system and velocities), which the templates read back as
+    {inputname}.restart.*"""
+    return [File("%s.restart.%s" % (outputname, ext)) for ext in ("coor", "xsc", "vel")]
+
+# The config key prefix and keg output label of each kind of sassena job
+SASSENA_CONFIGS = {"inc": "incoherent", "coh": "coherent"}
+SASSENA_OUTPUTS = {"inc": "fqt_incoherent", "coh": "fqt_coherent"}
 
 class RefinementWorkflow(object):
-    def __init__(self, outdir, config, is_synthetic_workflow):
-        "'outdir' is the directory where the workflow is written, and 'config' is a ConfigParser object"
+    def __init__(self, outdir, config, is_synthetic_workflow, streaming=False, jobs=1, incremental=False,
+            seed=None, hashes=None, templates=None, keg_distributions=None, count_atoms=None):
+        """'outdir' is the directory where the workflow is written, and 'config' is a ConfigParser object.
+        If 'streaming' is True the DAX is written one pipeline at a time instead of being built in memory.
+        'jobs' is the number of processes used to generate the config files. If 'incremental' is True,
+        files recorded in the manifest of a previous run in 'outdir' are only rewritten if they changed.
+        'seed' seeds the random values of a synthetic workflow, so the same seed gives the same workflow.
+        A long-lived caller can pass the HashCache 'hashes' to use instead of loading hash_cache, and
+        the digests of the templates it already has in 'templates' (see template_digests()), the dict
+        'keg_distributions' that keeps the keg distributions parsed for this config and seed (see
+        KegParametersFactory), and a 'count_atoms' function that caches psfgen.count_atoms()."""
         self.outdir = outdir
         self.config = config
+        self.streaming = streaming
+        self.jobs = jobs
         self.daxfile = os.path.join(self.outdir, "dax.xml")
         self.replicas = {}
+        self.point_replicas = None
+        self.point_changed = False
+        self.pipeline_jobs = None
+
+        # The sweep points (temperature x charge x pressure x production_steps)
+        self.sweep = ParameterSweep(self.config)
 
         # Get all the values from the config file
-        self.temperatures = [x.strip() for x in self.getconf("temperatures").split(",")]
         self.equilibrate_steps = self.getconf("equilibrate_steps")
-        self.production_steps = self.getconf("production_steps")
         self.equilibrate_output = self.getconf("equilibrate_output")
         self.production_output = self.getconf("production_output")
-        self.pressure = self.getconf("pressure")
-        self.charge = self.getconf("charge")
-        self.structure = self.getconf("structure")
         self.coordinates = self.getconf("coordinates")
         self.parameters = self.getconf("parameters")
         self.topfile = self.getconf("topfile")
         self.extended_system = self.getconf("extended_system")
         self.sassena_db = self.getconf("sassena_db")
 
+        # Equilibration can start from the restart files of the neighbouring
+        # temperature instead of the cold start coordinates, for fewer steps
+        # (equilibrate_warm_steps). Each chain of points is at most
+        # equilibrate_chain_length long (0: no limit).
+        self.eq_seeds = None
+        self.eq_chained = set()
+        self.eq_jobs = {}
+        if self.config.has_option("simulation", "equilibrate_chain") and \
+                self.config.getboolean("simulation", "equilibrate_chain"):
+            self.eq_order, self.eq_seeds = warm_start_order(self.sweep.points(),
+                int(self.getconf("equilibrate_chain_length", default="0")))
+            self.eq_chained = set(self.eq_seeds.values())
+            self.equilibrate_warm_steps = self.getconf("equilibrate_warm_steps",
+                default=str(int(self.equilibrate_steps) // 4))
+
+        # Production can be split into segments that are chained through
+        # their restart files, so each job is shorter
+        self.segments = int(self.getconf("production_segments", default="1"))
+        if self.segments < 1:
+            raise Exception("production_segments must be at least 1")
+
+        # The q vector scan and orientation averaging of the sassena jobs. The
+        # scan can be split over sassena_q_shards jobs and the orientation
+        # vectors over sassena_orientation_shards jobs; sassenamerge.py then
+        # combines their signal files into one
+        self.sassena_scan = {
+            "qfrom": self.getconf("sassena_qfrom", default="0.1"),
+            "qto": self.getconf("sassena_qto", default="1.0"),
+            "qpoints": self.getconf("sassena_qpoints", default="100"),
+            "resolution": self.getconf("sassena_resolution", default="500"),
+            "seed": self.getconf("sassena_seed", default="5")
+        }
+        self.sassena_shards = self.split_sassena_scan(
+            int(self.getconf("sassena_q_shards", default="1")),
+            int(self.getconf("sassena_orientation_shards", default="1")))
+
+        # The trajectory is fitted by cpptraj, or by rmsfit.py, which needs no
+        # config file and can use several processes
+        self.ptraj_engine = self.getconf("ptraj_engine", default="cpptraj")
+        if self.ptraj_engine not in ("cpptraj", "rmsfit"):
+            raise Exception("Invalid ptraj_engine: %s" % self.ptraj_engine)
+
+        # Trajectories of these classes are compressed by dcdpack.py, and the
+        # packed file is staged out instead of the DCD. The sassena jobs can
+        # read a copy unpacked from the packed file, so that only the packed
+        # file moves if they run at another site.
+        self.compress = [kind.strip() for kind in self.getconf("compress_trajectories", default="").split(",")
+            if kind.strip()]
+        for kind in self.compress:
+            if kind not in ("prod_dcd", "ptraj_dcd"):
+                raise Exception("Invalid trajectory in compress_trajectories: %s" % kind)
+        self.decompress_for_sassena = (self.config.has_option("simulation", "decompress_for_sassena") and
+            self.config.getboolean("simulation", "decompress_for_sassena"))
+        if self.decompress_for_sassena and "ptraj_dcd" not in self.compress:
+            raise Exception("decompress_for_sassena needs ptraj_dcd in compress_trajectories")
+
+        # Collect the signal files of the whole sweep into one HDF5 store
+        self.aggregate_fqt = (self.config.has_option("simulation", "aggregate_fqt") and
+            self.config.getboolean("simulation", "aggregate_fqt"))
+
+        # Jobs whose outputs an earlier workflow recorded in the memo_cache
+        # directory (see memo.py) are left out, and their outputs are taken
+        # from the cache. Jobs are identified by the content of their inputs:
+        # generated files by their digest, workflow inputs by the digest of
+        # the file in input_dir, and the outputs of other jobs by the key of
+        # the job that writes them.
+        self.memo = None
+        if self.config.has_option("simulation", "memo_cache"):
+            self.memo = MemoCache(self.getconf("memo_cache"))
+        self.memo_outputs = {}
+        self.memo_inputs = {}
+        # The ids of the jobs left out, of those that only fed jobs that were
+        # left out, and the files that the jobs left out would have written
+        self.memo_pruned = set()
+        self.memo_unneeded = set()
+        self.unproduced = set()
+
+        # Store generated config files by content so that identical files
+        # become a single replica and a single stage-in transfer
+        self.deduplicate = (self.config.has_option("simulation", "deduplicate") and
+            self.config.getboolean("simulation", "deduplicate"))
+        if self.config.has_option("simulation", "content_store"):
+            self.store = ContentStore(os.path.abspath(self.getconf("content_store")))
+        else:
+            self.store = ContentStore(os.path.join(self.outdir, "store"))
+
+        # Short ptraj jobs can be bundled into pegasus-mpi-cluster jobs
+        # instead of each going through the queue
+        self.clustering = self.getconf("clustering", default="none")
+        if self.clustering not in ("none", "label", "horizontal"):
+            raise Exception("Invalid clustering: %s" % self.clustering)
+        self.cluster_size = int(self.getconf("cluster_size", default="32"))
+        self.cluster_cores = int(self.getconf("cluster_cores", default=str(self.cluster_size)))
+
+        # When the charge is swept a PSF file is generated for each charge,
+        # otherwise the structure comes from the inputs dir
+        self.generate_structures = self.sweep.is_swept("charge")
+        if self.generate_structures:
+            self.structure = None
+        else:
+            self.structure = self.getconf("structure")
+        self.structures = {}
+
+        # Job sizes can be predicted from the runtimes of past workflows in
+        # sizing_history instead of taken from the *_cores/*_maxwalltime keys
+        self.sizer = None
+        self.natoms = None
+        count_atoms = count_atoms or psfgen.count_atoms
+        if not is_synthetic_workflow:
+            if self.generate_structures:
+                self.natoms = count_atoms(os.path.join(TEMPLATE_DIR, "charge.xml"))
+            elif os.path.isfile(os.path.join(DAXGEN_DIR, "inputs", self.structure)):
+                self.natoms = count_atoms(os.path.join(DAXGEN_DIR, "inputs", self.structure))
+            if self.config.has_option("simulation", "sizing_history"):
+                self.sizer = JobSizer.from_history(self.getconf("sizing_history"),
+                    margin=float(self.getconf("sizing_margin", default="0.25")),
+                    max_walltime=int(self.getconf("sizing_max_walltime", default="0")) or None,
+                    cores_per_node=int(self.getconf("cores_per_node", default="24")),
+                    max_cores=int(self.getconf("sizing_max_cores", default="0")) or None)
+                for stage in sorted(self.sizer.models):
+                    print "Sizing model: %s" % self.sizer.models[stage]
+
+        # What is staged out, kept or discarded of each class of output
+        self.retention = RetentionPolicy(self.config)
+
         self.incoherent_db = "database/db-neutron-incoherent.xml"
         self.coherent_db = "database/db-neutron-coherent.xml"
 
+        # The workflow inputs are read from input_dir (the --input-dir of
+        # plan.sh). A synthetic workflow writes its mock inputs there.
+        self.input_dir = self.getconf("input_dir",
+            default="inputs" if is_synthetic_workflow else os.path.join(DAXGEN_DIR, "inputs"))
+
         self.is_synthetic_workflow = is_synthetic_workflow
         # if synthetic workflow we do not have database dir
         if self.is_synthetic_workflow:
             self.incoherent_db = "db-neutron-incoherent.xml"
             self.coherent_db = "db-neutron-coherent.xml"
-            self.keg_params = KegParametersFactory(self.config)
+            self.keg_params = KegParametersFactory(self.config, seed=seed, size=len(self.sweep),
+                distributions=keg_distributions)
+            print "Synthetic workflow seed: %d" % self.keg_params.seed
+
+            input_files = [ "coordinates", "parameters", "topfile",
+                "extended_system", "sassena_db" ]
+            if not self.generate_structures:
+                input_files.insert(0, "structure")
 
             # mocking input files
-            for input_file in [ "structure", "coordinates", "parameters",
-                "topfile", "extended_system", "sassena_db" ]:
+            if not os.path.isdir(self.input_dir):
+                os.makedirs(self.input_dir)
+            for input_file in input_files:
                 self.__dict__[input_file] = input_file + "_mock"
-                mock_path = os.path.join("inputs", input_file + "_mock")
+                mock_path = os.path.join(self.input_dir, input_file + "_mock")
                 self.keg_params.generate_input_file(input_file, mock_path)
 
-    def getconf(self, name, section="simulation"):
+        # The workflow inputs found in input_dir are registered in the
+        # replica catalog. With rc_checksums every replica gets its size and
+        # SHA-256 checksum; the digests of files that were not generated by
+        # this run are cached in hash_cache by path, modification time and
+        # size, and computed by rc_threads threads.
+        self.rc_checksums = (self.config.has_option("simulation", "rc_checksums") and
+            self.config.getboolean("simulation", "rc_checksums"))
+        self.hashes = hashes
+        if self.hashes is None:
+            self.hashes = HashCache(self.getconf("hash_cache", default=DEFAULT_HASH_CACHE),
+                threads=int(self.getconf("rc_threads", default="4")))
+
+        # The manifest records what is generated so that a later run can skip
+        # the points and files whose inputs have not changed. The sweep
+        # options are left out of the shared settings because each point's
+        # own values are part of its key.
+        self.manifest_file = os.path.join(self.outdir, "manifest.json")
+        self.previous = None
+        if incremental:
+            self.previous = Manifest.load(self.manifest_file)
+        sweep_options = set(option for d in DIMENSIONS for option in d[1:])
+        sweep_options.add("sweep")
+        settings = hash_config(self.config, exclude=sweep_options,
+            extra=[self.is_synthetic_workflow, self.deduplicate])
+        self.manifest = Manifest(settings, templates or hash_directory(TEMPLATE_DIR))
+
+    def split_sassena_scan(self, q_shards, orientation_shards):
+        """Return the template values of each sassena shard: the q points of
+        the scan are split into 'q_shards' contiguous ranges, and the
+        orientation vectors of each range into 'orientation_shards' sets with
+        different seeds. Each shard also has the 'work' fraction of the whole
+        scan it computes."""
+        scan = self.sassena_scan
+        qpoints = int(scan["qpoints"])
+        resolution = int(scan["resolution"])
+        if q_shards < 1 or q_shards > qpoints:
+            raise Exception("sassena_q_shards must be between 1 and sassena_qpoints")
+        if orientation_shards < 1 or orientation_shards > resolution:
+            raise Exception("sassena_orientation_shards must be between 1 and sassena_resolution")
+        if q_shards == 1 and orientation_shards == 1:
+            return [dict(scan, work=1.0)]
+
+        qfrom = float(scan["qfrom"])
+        step = (float(scan["qto"]) - qfrom) / (qpoints - 1) if qpoints > 1 else 0.0
+        shards = []
+        for start, stop in split_range(qpoints, q_shards):
+            for j, (first, last) in enumerate(split_range(resolution, orientation_shards)):
+                shards.append({
+                    "qfrom": "%.10g" % (qfrom + start * step),
+                    "qto": "%.10g" % (qfrom + (stop - 1) * step),
+                    "qpoints": str(stop - start),
+                    "resolution": str(last - first),
+                    "seed": str(int(scan["seed"]) + j),
+                    "work": float(stop - start) * (last - first) / (qpoints * resolution)
+                })
+        return shards
+
+    def getconf(self, name, section="simulation", default=None):
+        if default is not None and not self.config.has_option(section, name):
+            return default
         return self.config.get(section, name)
 
     def add_replica(self, name, path):
         "Add a replica entry to the replica catalog for the workflow"
         url = "file://%s" % path
         self.replicas[name] = url
+        if self.point_replicas is not None:
+            self.point_replicas[name] = url
 
+    def write_file(self, name, data):
+        """Write 'data' to the file 'name' in the output directory and return
+        its path. An incremental run leaves the file alone if it already has
+        the same content."""
+        path = os.path.join(self.outdir, name)
+        h = digest(data)
+        if self.previous is None or self.previous.files.get(name) != h or not os.path.isfile(path):
+            f = open(path, "w")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            PROFILE.wrote(len(data))
+            self.point_changed = True
+        self.manifest.files[name] = h
+        return path
+
+    def register_inputs(self):
+        "Add the workflow inputs that are in the input directory to the replica catalog"
+        for f in [self.coordinates_file, self.parameters_file, self.extended_system_file, self.topfile_file,
+                File(self.sassena_db)] + ([] if self.generate_structures else [File(self.structure)]):
+            path = os.path.join(self.input_dir, f.name)
+            if f.name not in self.replicas and os.path.isfile(path):
+                self.add_replica(f.name, os.path.abspath(path))
+
+    @PROFILE.timed()
     def generate_replica_catalog(self):
-        "Write the replica catalog for this workflow to a file"
+        """Write the replica catalog for this workflow to a file. With
+        rc_checksums each entry has the size and SHA-256 checksum of the
+        file: generated files have the digest they were written with, and
+        the others are hashed unless the hash cache has them."""
+        self.register_inputs()
+        paths = dict((name, url[len("file://"):]) for name, url in self.replicas.items())
+        files = {}
+        if self.rc_checksums:
+            known = dict((paths[name], self.manifest.files[name]) for name in paths if name in self.manifest.files)
+            with PROFILE.phase("rc_checksums"):
+                files = self.hashes.lookup(sorted(set(paths.values())), known)
+        # Also keeps the digests of the inputs hashed for the memo cache
+        self.hashes.save()
+
         path = os.path.join(self.outdir, "rc.txt")
         f = open(path, "w")
         try:
-            for name, url in self.replicas.items():
-                f.write('%-30s %-100s pool="local"\n' % (name, url))
+            for name, url in sorted(self.replicas.items()):
+                if paths[name] in files:
+                    size, checksum = files[paths[name]]
+                    f.write('%-30s %-100s pool="local" checksum.type="sha256" checksum.value="%s" size="%d"\n' % (
+                        name, url, checksum, size))
+                else:
+                    f.write('%-30s %-100s pool="local"\n' % (name, url))
+            PROFILE.wrote(f.tell())
         finally:
             f.close()
 
-    def generate_eq_conf(self, temperature):
-        "Generate an equilibrate configuration file for 'temperature'"
-        name = "equilibrate_%s.conf" % temperature
-        path = os.path.join(self.outdir, name)
+    @PROFILE.timed()
+    def generate_psf(self, charge):
+        "Generate a psf file for 'charge' and return its name"
+        name = "Q%s.psf" % charge
+        if name in self.structures:
+            return name
+        kw = {
+            "charge": "%10.6f" % (0.01 * float(charge)),
+            "charge2": "%10.6f" % (-0.02 * float(charge))
+        }
+        # Only the charge column differs between variants, so patch it in place
+        psf = psfgen.load(os.path.join(TEMPLATE_DIR, "charge.xml"))
+        path = self.write_file(name, psf.render(**kw))
+        self.add_replica(name, path)
+        self.structures[name] = path
+        return name
+
+    def structure_for(self, point):
+        "Return the name of the structure file used by sweep 'point'"
+        if self.generate_structures:
+            return self.generate_psf(point.charge)
+        return self.structure
+
+    def write_config(self, template, name, **kw):
+        """Render 'template' with 'kw' as the config file 'name' and return the
+        logical name that jobs should use for it. When deduplicating, the file
+        is stored by content and shared by every pipeline that renders the
+        same bytes."""
+        with PROFILE.phase("format_template:%s" % template):
+            data = TEMPLATES.render(template, **kw)
+        if not self.deduplicate:
+            path = self.write_file(name, data)
+            self.add_replica(name, path)
+            return name
+
+        with PROFILE.phase("content_store"):
+            h = self.store.put(data)
+        stem, ext = os.path.splitext(name)
+        lfn = "%s-%s%s" % (stem.split("_")[0], h[:16], ext)
+        if self.previous is None or lfn not in self.previous.files:
+            self.point_changed = True
+        self.manifest.files[lfn] = h
+        self.add_replica(lfn, self.store.path(h))
+        return lfn
+
+    def namd_environment(self, kw):
+        """When deduplicating, replace the per-point values in the NAMD config
+        values 'kw' with references to environment variables, and return the
+        variables that the job has to set"""
+        env = {}
+        if self.deduplicate:
+            for key in NAMD_ENVIRONMENT:
+                if key in kw:
+                    var = "SNS_%s" % key.upper()
+                    env[var] = str(kw[key])
+                    kw[key] = "$env(%s)" % var
+        return env
+
+    @PROFILE.timed()
+    def generate_eq_conf(self, point, structure):
+        """Generate an equilibrate configuration file for sweep 'point' and
+        return its logical name and the environment the job needs"""
+        name = "equilibrate_%s.conf" % point.tag
+        seed = self.eq_seeds.get(point.tag) if self.eq_seeds is not None else None
         kw = {
-            "temperature": temperature,
-            "pressure": self.pressure,
-            "charge": self.charge,
-            "structure": self.structure,
+            "temperature": point.temperature,
+            "pressure": point.pressure,
+            "charge": point.charge,
+            "structure": structure,
             "coordinates": self.coordinates,
             "parameters": self.parameters,
-            "outputname": "equilibrate_%s" % temperature,
+            "outputname": "equilibrate_%s" % point.tag,
             "extended_system": self.extended_system,
             "timesteps": self.equilibrate_steps,
             "timeoutput": self.equilibrate_output
         }
-        format_template("equilibrate.conf", path, **kw)
-        self.add_replica(name, path)
-
-    def generate_prod_conf(self, temperature):
-        "Generate a production configuration file for 'temperature'"
-        name = "production_%s.conf" % temperature
-        path = os.path.join(self.outdir, name)
+        if seed is not None:
+            kw["inputname"] = "equilibrate_%s" % seed
+            kw["timesteps"] = self.equilibrate_warm_steps
+            env = self.namd_environment(kw)
+            return self.write_config("equilibrate_warm.conf", name, **kw), env
+        env = self.namd_environment(kw)
+        return self.write_config("equilibrate.conf", name, **kw), env
+
+    @PROFILE.timed()
+    def generate_prod_conf(self, point, structure, segment=None, firststep=0, steps=None):
+        """Generate a production configuration file for sweep 'point', or for
+        production 'segment' (counting from 1) of it, which runs 'steps' steps
+        from 'firststep'. Return its logical name and the environment the job
+        needs."""
+        if segment is None:
+            name = "production_%s.conf" % point.tag
+            inputname = "equilibrate_%s" % point.tag
+            outputname = "production_%s" % point.tag
+        else:
+            name = "production_%s_seg%d.conf" % (point.tag, segment)
+            if segment == 1:
+                inputname = "equilibrate_%s" % point.tag
+            else:
+                inputname = "production_%s_seg%d" % (point.tag, segment - 1)
+            outputname = "production_%s_seg%d" % (point.tag, segment)
         kw = {
-            "temperature": temperature,
-            "pressure": self.pressure,
-            "charge": self.charge,
-            "structure": self.structure,
+            "temperature": point.temperature,
+            "pressure": point.pressure,
+            "charge": point.charge,
+            "structure": structure,
             "coordinates": self.coordinates,
             "parameters": self.parameters,
-            "inputname": "equilibrate_%s" % temperature,
-            "outputname": "production_%s" % temperature,
-            "timesteps": self.production_steps,
-            "timeoutput": self.production_output
+            "inputname": inputname,
+            "outputname": outputname,
+            "timesteps": steps or point.production_steps,
+            "timeoutput": self.production_output,
+            "firsttimestep": firststep
         }
-        format_template("production.conf", path, **kw)
-        self.add_replica(name, path)
-
-    def generate_ptraj_conf(self, temperature):
-        "Generate a ptraj configuration file for 'temperature'"
-        name = "ptraj_%s.conf" % temperature
-        path = os.path.join(self.outdir, name)
+        env = self.namd_environment(kw)
+        return self.write_config("production.conf", name, **kw), env
+
+    def production_segments(self, point):
+        """Return (first step, steps) for each production segment of sweep
+        'point'. Segments run whole multiples of production_output steps, so
+        every frame of the trajectory is written by exactly one segment."""
+        output = int(self.production_output)
+        frames = int(point.production_steps) // output
+        if frames < self.segments:
+            raise Exception("production_steps = %s is too short for %d segments of %d-step outputs" % (
+                point.production_steps, self.segments, output))
+        result = []
+        first = 0
+        for k in range(self.segments):
+            steps = (frames // self.segments + (1 if k < frames % self.segments else 0)) * output
+            result.append((first, steps))
+            first += steps
+        return result
+
+    @PROFILE.timed()
+    def generate_ptraj_conf(self, point):
+        "Generate a ptraj configuration file for sweep 'point'"
+        name = "ptraj_%s.conf" % point.tag
         kw = {
-            "trajectory_input": "production_%s.dcd" % temperature,
-            "trajectory_fit": "ptraj_%s.fit" % temperature,
-            "trajectory_output": "ptraj_%s.dcd" % temperature
+            "trajectory_input": "production_%s.dcd" % point.tag,
+            "trajectory_fit": "ptraj_%s.fit" % point.tag,
+            "trajectory_output": "ptraj_%s.dcd" % point.tag
         }
-        format_template("rms2first.ptraj", path, **kw)
-        self.add_replica(name, path)
-
-    def generate_incoherent_conf(self, temperature):
-        "Generate a sassena incoherent config file for 'temperature'"
-        name = "sassenaInc_%s.xml" % temperature
-        path = os.path.join(self.outdir, name)
+        return self.write_config("rms2first.ptraj", name, **kw)
+
+    def sassena_trajectory(self, point):
+        "Return the name of the trajectory the sassena jobs of 'point' read"
+        if self.decompress_for_sassena:
+            return "ptraj_%s_unpacked.dcd" % point.tag
+        return "ptraj_%s.dcd" % point.tag
+
+    @PROFILE.timed()
+    def generate_incoherent_conf(self, point, shard=None):
+        """Generate a sassena incoherent config file for sweep 'point', or for
+        its sassena shard number 'shard'"""
+        suffix = point.tag if shard is None else "%s_shard%d" % (point.tag, shard)
         kw = {
             "coordinates": self.coordinates,
-            "trajectory": "ptraj_%s.dcd" % temperature,
-            "output": "fqt_inc_%s.hd5" % temperature,
+            "trajectory": self.sassena_trajectory(point),
+            "output": "fqt_inc_%s.hd5" % suffix,
             "database": self.incoherent_db
         }
-        format_template("sassenaInc.xml", path, **kw)
-        self.add_replica(name, path)
-
-    def generate_coherent_conf(self, temperature):
-        "Generate a sassena coherent config file for 'temperature'"
-        name = "sassenaCoh_%s.xml" % temperature
-        path = os.path.join(self.outdir, name)
+        kw.update(self.sassena_shards[shard or 0])
+        del kw["work"]
+        return self.write_config("sassenaInc.xml", "sassenaInc_%s.xml" % suffix, **kw)
+
+    @PROFILE.timed()
+    def generate_coherent_conf(self, point, shard=None):
+        """Generate a sassena coherent config file for sweep 'point', or for
+        its sassena shard number 'shard'"""
+        suffix = point.tag if shard is None else "%s_shard%d" % (point.tag, shard)
         kw = {
             "coordinates": self.coordinates,
-            "trajectory": "ptraj_%s.dcd" % temperature,
-            "output": "fqt_coh_%s.hd5" % temperature,
+            "trajectory": self.sassena_trajectory(point),
+            "output": "fqt_coh_%s.hd5" % suffix,
             "database": self.coherent_db
         }
-        format_template("sassenaCoh.xml", path, **kw)
-        self.add_replica(name, path)
-
+        kw.update(self.sassena_shards[shard or 0])
+        del kw["work"]
+        return self.write_config("sassenaCoh.xml", "sassenaCoh_%s.xml" % suffix, **kw)
+
+    @PROFILE.timed()
+    def generate_point_configs(self, point):
+        """Generate the psf and configuration files for the pipeline of sweep
+        'point' and return a dict with the logical names the jobs should use"""
+        structure = self.structure_for(point)
+        key = self.manifest.point_key(point,
+            extra=[self.eq_seeds[point.tag]] if self.eq_seeds is not None else ())
+
+        previous = self.reusable_point(point, key)
+        if previous is not None:
+            self.replicas.update(previous["replicas"])
+            for name in previous["replicas"]:
+                self.manifest.files[name] = self.previous.files[name]
+            self.manifest.points[point.tag] = dict(previous, status="unchanged")
+            return dict(previous["configs"], structure=structure)
+
+        self.point_replicas = {}
+        self.point_changed = False
+
+        configs = {}
+        configs["eq_conf"], configs["eq_env"] = self.generate_eq_conf(point, structure)
+        if self.segments == 1:
+            configs["prod_conf"], configs["prod_env"] = self.generate_prod_conf(point, structure)
+        else:
+            configs["prod_segments"] = []
+            for k, (first, steps) in enumerate(self.production_segments(point)):
+                conf, env = self.generate_prod_conf(point, structure, k + 1, first, steps)
+                configs["prod_segments"].append({"conf": conf, "env": env, "first": first, "steps": steps})
+        if self.ptraj_engine == "cpptraj":
+            configs["ptraj_conf"] = self.generate_ptraj_conf(point)
+        if len(self.sassena_shards) == 1:
+            configs["incoherent_conf"] = self.generate_incoherent_conf(point)
+            configs["coherent_conf"] = self.generate_coherent_conf(point)
+        else:
+            shards = range(len(self.sassena_shards))
+            configs["incoherent_shards"] = [self.generate_incoherent_conf(point, k) for k in shards]
+            configs["coherent_shards"] = [self.generate_coherent_conf(point, k) for k in shards]
+
+        if self.previous is None or point.tag not in self.previous.points:
+            status = "new"
+        elif self.point_changed:
+            status = "changed"
+        else:
+            status = "unchanged"
+        self.manifest.points[point.tag] = {
+            "key": key,
+            "configs": configs,
+            "replicas": self.point_replicas,
+            "status": status
+        }
+        self.point_replicas = None
+
+        return dict(configs, structure=structure)
+
+    def reusable_point(self, point, key):
+        """Return the previous manifest entry of 'point' if its files were
+        generated from the same inputs and are all still there"""
+        if self.previous is None:
+            return None
+        entry = self.previous.points.get(point.tag)
+        if entry is None or entry["key"] != key:
+            return None
+        for name, url in entry["replicas"].items():
+            if name not in self.previous.files or not os.path.isfile(url[len("file://"):]):
+                return None
+        return entry
+
+    @PROFILE.timed()
     def generate_dax(self):
         "Generate a workflow (DAX, config files, and replica catalog)"
         ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-        dax = ADAG("refinement-%s" % ts)
+        if self.streaming:
+            dax = StreamingADAG("refinement-%s" % ts, self.daxfile)
+        else:
+            dax = ADAG("refinement-%s" % ts)
 
         # These are all the global input files for the workflow
-        structure = File(self.structure)
-        coordinates = File(self.coordinates)
-        parameters = File(self.parameters)
-        extended_system = File(self.extended_system)
-        topfile = File(self.topfile)
+        self.coordinates_file = File(self.coordinates)
+        self.parameters_file = File(self.parameters)
+        self.extended_system_file = File(self.extended_system)
+        self.topfile_file = File(self.topfile)
+        self.incoherent_db_file = File(self.incoherent_db)
+        self.coherent_db_file = File(self.coherent_db)
         sassena_db = File(self.sassena_db)
-        incoherent_db = File(self.incoherent_db)
-        coherent_db = File(self.coherent_db)
 
         # This job untars the sassena db and makes it available to the other
         # jobs in the workflow
@@ -180,219 +678,702 @@ class RefinementWorkflow(object):
             untarjob.addArguments("-p", "-xzvf", sassena_db.name)
             untarjob.addArguments("-a", "tar")
 
-            for output_file in [ "incoherent_db", "coherent_db" ]:
-                untarjob.addArguments(self.keg_params.output_file("tar", output_file, eval(output_file).name))
+            for label, output_file in [ ("incoherent_db", self.incoherent_db_file), ("coherent_db", self.coherent_db_file) ]:
+                untarjob.addArguments(self.keg_params.output_file("tar", label, output_file.name))
 
             self.keg_params.add_keg_params(untarjob)
         else:
             untarjob.addArguments("-xzvf", sassena_db)
 
         untarjob.uses(sassena_db, link=Link.INPUT)
-        untarjob.uses(incoherent_db, link=Link.OUTPUT, transfer=False)
-        untarjob.uses(coherent_db, link=Link.OUTPUT, transfer=False)
+        untarjob.uses(self.incoherent_db_file, link=Link.OUTPUT, transfer=False)
+        untarjob.uses(self.coherent_db_file, link=Link.OUTPUT, transfer=False)
 
+        # The untar job is not clustered: in a cluster the sassena database
+        # would not be ready until the whole cluster has run
         untarjob.profile("globus", "maxwalltime", "1")
         untarjob.profile("globus", "count", "1")
+        untarjob.profile("globus", "jobtype", "single")
 
         dax.addJob(untarjob)
+        self.untarjob = untarjob
+        if self.memo is not None:
+            self.memoize(dax, [untarjob], prune=False)
+
+        # The signal files of every point, and the jobs that write them, for
+        # the job that collects them into one store
+        self.store_points = []
+        self.store_parents = []
+        self.store_size = 0
+
+        # For each point of the parameter sweep
+        for point, configs in self.point_configs():
+            self.generate_pipeline(dax, point, configs)
+            if self.streaming:
+                with PROFILE.phase("dax_write"):
+                    dax.flush()
+
+        if self.aggregate_fqt:
+            self.fqt_store_job(dax)
 
-        # For each temperature that was listed in the config file
-        for temperature in self.temperatures:
-
-            # Equilibrate files
-            eq_conf = File("equilibrate_%s.conf" % temperature)
-            eq_coord = File("equilibrate_%s.restart.coord" % temperature)
-            eq_xsc = File("equilibrate_%s.restart.xsc" % temperature)
-            eq_vel = File("equilibrate_%s.restart.vel" % temperature)
-
-            # Production files
-            prod_conf = File("production_%s.conf" % temperature)
-            prod_dcd = File("production_%s.dcd" % temperature)
-
-            # Ptraj files
-            ptraj_conf = File("ptraj_%s.conf" % temperature)
-            ptraj_fit = File("ptraj_%s.fit" % temperature)
-            ptraj_dcd = File("ptraj_%s.dcd" % temperature)
-
-            # Sassena incoherent files
-            incoherent_conf = File("sassenaInc_%s.xml" % temperature)
-            fqt_incoherent = File("fqt_inc_%s.hd5" % temperature)
-
-            # Sassena coherent files
-            coherent_conf = File("sassenaCoh_%s.xml" % temperature)
-            fqt_coherent = File("fqt_coh_%s.hd5" % temperature)
-
-            # Generate configuration files for this temperature pipeline
-            self.generate_eq_conf(temperature)
-            self.generate_prod_conf(temperature)
-            self.generate_ptraj_conf(temperature)
-            self.generate_incoherent_conf(temperature)
-            self.generate_coherent_conf(temperature)
-
-            # Equilibrate job
-            eqjob = Job("namd", node_label="namd_eq_%s" % temperature)
-            if self.is_synthetic_workflow:
-                eqjob.addArguments("-p", eq_conf)
-                eqjob.addArguments("-a", "namd_eq_%s" % temperature)
-                eqjob.addArguments("-i", eq_conf.name, structure.name, coordinates.name,
-                    parameters.name, extended_system.name)
-
-                task_label = "namd-eq"
-
-                for output_file in [ "eq_coord", "eq_xsc", "eq_vel" ]:
-                    eqjob.addArguments(self.keg_params.output_file(task_label, output_file, eval(output_file).name))
-
-                self.keg_params.add_keg_params(eqjob, task_label)
-            else:
-                eqjob.addArguments(eq_conf)
-
-            eqjob.uses(eq_conf, link=Link.INPUT)
-            eqjob.uses(structure, link=Link.INPUT)
-            eqjob.uses(coordinates, link=Link.INPUT)
-            eqjob.uses(parameters, link=Link.INPUT)
-            eqjob.uses(extended_system, link=Link.INPUT)
-            eqjob.uses(eq_coord, link=Link.OUTPUT, transfer=False)
-            eqjob.uses(eq_xsc, link=Link.OUTPUT, transfer=False)
-            eqjob.uses(eq_vel, link=Link.OUTPUT, transfer=False)
-            if self.is_synthetic_workflow:
-                eqjob.profile("globus", "maxwalltime", "1")
-                eqjob.profile("globus", "count", "8")
-            else:
-                eqjob.profile("globus", "maxwalltime", self.getconf("equilibrate_maxwalltime"))
-                eqjob.profile("globus", "count", self.getconf("equilibrate_cores"))
-            dax.addJob(eqjob)
-
-            # Production job
-            prodjob = Job("namd", node_label="namd_prod_%s" % temperature)
-
-            if self.is_synthetic_workflow:
-                prodjob.addArguments("-p", prod_conf)
-                prodjob.addArguments("-a", "namd_prod_%s" % temperature)
-                prodjob.addArguments("-i", prod_conf.name, structure.name, coordinates.name,
-                    parameters.name, eq_coord.name, eq_xsc.name, eq_vel.name)
-
-                task_label = "namd-prod"
-                prodjob.addArguments(self.keg_params.output_file(task_label, "prod_dcd", prod_dcd.name))
-                self.keg_params.add_keg_params(prodjob, task_label)
-            else:
-                prodjob.addArguments(prod_conf)
-
-            prodjob.uses(prod_conf, link=Link.INPUT)
-            prodjob.uses(structure, link=Link.INPUT)
-            prodjob.uses(coordinates, link=Link.INPUT)
-            prodjob.uses(parameters, link=Link.INPUT)
-            prodjob.uses(eq_coord, link=Link.INPUT)
-            prodjob.uses(eq_xsc, link=Link.INPUT)
-            prodjob.uses(eq_vel, link=Link.INPUT)
-            prodjob.uses(prod_dcd, link=Link.OUTPUT, transfer=True)
-
-            if self.is_synthetic_workflow:
-                prodjob.profile("globus", "maxwalltime", "6")
-                prodjob.profile("globus", "count", "8")
+        # Write the DAX file
+        with PROFILE.phase("dax_write"):
+            if self.streaming:
+                dax.close()
             else:
-                prodjob.profile("globus", "maxwalltime", self.getconf("production_maxwalltime"))
-                prodjob.profile("globus", "count", self.getconf("production_cores"))
-
-            dax.addJob(prodjob)
-            dax.depends(prodjob, eqjob)
-
-            # ptraj job
-            ptrajjob = Job(namespace="amber", name="ptraj", node_label="amber_ptraj_%s" % temperature)
-
-            if self.is_synthetic_workflow:
-                ptrajjob.addArguments("-p", topfile)
-                ptrajjob.addArguments("-a", "amber_ptraj_%s" % temperature)
-                ptrajjob.addArguments("-i", topfile.name, ptraj_conf.name, prod_dcd.name)
-
-                task_label = "amber-ptraj"
-
-                for output_file in [ "ptraj_fit", "ptraj_dcd" ]:
-                    ptrajjob.addArguments(self.keg_params.output_file(task_label, output_file, eval(output_file).name))
-
-                self.keg_params.add_keg_params(ptrajjob, task_label)
+                dax.writeXMLFile(self.daxfile)
+        PROFILE.wrote(os.path.getsize(self.daxfile))
+
+        # plan.sh passes this to pegasus-plan --cluster
+        clusterfile = os.path.join(self.outdir, "clustering")
+        if self.clustering != "none":
+            f = open(clusterfile, "w")
+            try:
+                f.write("%s\n" % self.clustering)
+            finally:
+                f.close()
+        elif os.path.isfile(clusterfile):
+            os.unlink(clusterfile)
+
+    def sweep_points(self):
+        """Return the sweep points in the order their pipelines are generated:
+        sweep order, or with chained equilibration an order where each point
+        comes after the point it starts from"""
+        if self.eq_seeds is not None:
+            return iter(self.eq_order)
+        return self.sweep.points()
+
+    def point_configs(self):
+        """Generate the config files for every sweep point and yield each point
+        with its configs, in sweep order. With more than one job the files are
+        rendered and written by a pool of worker processes while the caller
+        builds the DAX."""
+        if self.jobs <= 1:
+            for point in self.sweep_points():
+                yield point, self.generate_point_configs(point)
+            return
+
+        # Structures are shared between points, so write them before forking
+        if self.generate_structures:
+            for charge in self.sweep.values["charge"]:
+                self.generate_psf(charge)
+
+        pool = multiprocessing.Pool(self.jobs, _init_worker, (self,))
+        try:
+            results = pool.imap(_generate_point_configs, self.sweep_points(), chunksize=16)
+            for point, configs, replicas, files, points, profile in results:
+                PROFILE.merge(profile)
+                self.replicas.update(replicas)
+                self.manifest.files.update(files)
+                self.manifest.points.update(points)
+                yield point, configs
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def cluster_short_job(self, job, wave, cores):
+        """Bundle the short 'job', which needs 'cores' cores, into the
+        pegasus-mpi-cluster job of 'wave'. Pegasus merges the profiles of the
+        constituent jobs into the clustered job, so the globus profiles set
+        here size the whole cluster: cluster_cores cores for as long as it
+        takes to run the ptraj tasks of the wave on them."""
+        job.profile("pegasus", "job.aggregator", "mpiexec")
+        job.profile("pegasus", "pmc_request_cpus", cores)
+
+        if self.clustering == "label":
+            job.profile("pegasus", "label", "short_%d" % wave)
+            tasks = min(self.cluster_size, len(self.sweep) - wave * self.cluster_size)
+        else:
+            job.profile("pegasus", "clusters.size", str(self.cluster_size))
+            tasks = self.cluster_size
+
+        slots = max(1, self.cluster_cores // int(self.getconf("ptraj_cores")))
+        rounds = (tasks + slots - 1) // slots
+        walltime = rounds * int(self.getconf("ptraj_maxwalltime"))
+
+        job.profile("globus", "maxwalltime", str(walltime))
+        job.profile("globus", "count", str(self.cluster_cores))
+        job.profile("globus", "jobtype", "mpi")
+
+    def work(self, steps):
+        "Return the amount of work of a job that processes 'steps' steps or frames of the structure"
+        if self.natoms is None:
+            return None
+        return int(steps) * self.natoms
+
+    def warm_walltime(self):
+        """Return the maxwalltime of a chained equilibration: the
+        equilibrate_maxwalltime scaled to its steps by default"""
+        if self.is_synthetic_workflow or self.config.has_option("simulation", "equilibrate_warm_maxwalltime"):
+            return self.getconf("equilibrate_warm_maxwalltime", default="1")
+        walltime = int(self.getconf("equilibrate_maxwalltime"))
+        steps = int(self.equilibrate_warm_steps)
+        return str(max(1, (walltime * steps + int(self.equilibrate_steps) - 1) // int(self.equilibrate_steps)))
+
+    def set_job_size(self, job, synthetic_walltime, stage, kind=None, work=None, jobtype="mpi", walltime=None,
+            cores=None):
+        """Set the globus profiles that size 'job' using the config keys for
+        'stage' ('walltime' and 'cores' override them), or the runtime model
+        for jobs of 'kind' if there is one. The kind and 'work' are recorded
+        in the job metadata so that the runtimes of this workflow can be used
+        to size later ones."""
+        if work is not None:
+            job.metadata("sns.stage", kind)
+            job.metadata("sns.work", str(work))
+        if self.is_synthetic_workflow and synthetic_walltime is not None:
+            job.profile("globus", "maxwalltime", synthetic_walltime)
+            job.profile("globus", "count", "8")
+        else:
+            if walltime is None:
+                walltime = self.getconf("%s_maxwalltime" % stage)
+            if cores is None:
+                cores = self.getconf("%s_cores" % stage)
+            if self.sizer is not None:
+                walltime, cores = self.sizer.size(kind, work, walltime, cores,
+                    scalable=(jobtype == "mpi"))
+            job.profile("globus", "maxwalltime", walltime)
+            job.profile("globus", "count", cores)
+        job.profile("globus", "jobtype", jobtype)
+
+    def production_job(self, dax, point, label, conf, env, structure, restart, dcd, outputs, steps,
+            walltime=None):
+        """Add a NAMD production job for sweep 'point' to 'dax' that continues
+        from the 'restart' files and writes the trajectory 'dcd' and the
+        restart files 'outputs', and return it. If there are no 'outputs' the
+        trajectory is the final one and the retention policy applies to it.
+        A synthetic job emulates its 'steps' share of the point's production
+        time and trajectory size."""
+        job = Job("namd", node_label=label)
 
+        if self.is_synthetic_workflow:
+            job.addArguments("-p", conf)
+            job.addArguments("-a", label)
+            job.addArguments("-i", conf.name, structure.name, self.coordinates_file.name,
+                self.parameters_file.name, *[f.name for f in restart])
+
+            task_label = "namd-prod"
+            share = float(steps) / int(point.production_steps)
+            job.addArguments(self.keg_params.output_file(task_label, "prod_dcd", dcd.name, point.index, share))
+            for output_file in outputs:
+                job.addArguments(self.keg_params.output_file(task_label, "prod_restart", output_file.name, point.index))
+            self.keg_params.add_keg_params(job, task_label, point.index, share)
+        else:
+            job.addArguments(conf)
+
+        job.uses(conf, link=Link.INPUT)
+        job.uses(structure, link=Link.INPUT)
+        job.uses(self.coordinates_file, link=Link.INPUT)
+        job.uses(self.parameters_file, link=Link.INPUT)
+        for f in restart:
+            job.uses(f, link=Link.INPUT)
+        if outputs:
+            job.uses(dcd, link=Link.OUTPUT, transfer=False)
+        else:
+            frames = int(steps) // int(self.production_output)
+            job.uses(dcd, link=Link.OUTPUT, **self.trajectory_flags("prod_dcd", frames, dcd.name))
+        for f in outputs:
+            job.uses(f, link=Link.OUTPUT, transfer=False)
+        self.set_job_size(job, "6", "production", "namd_prod", self.work(steps), walltime=walltime)
+        for var, value in sorted(env.items()):
+            job.profile("env", var, value)
+
+        self.add_job(dax, job)
+        return job
+
+    def production_chain(self, dax, point, segments, structure, restart, prod_dcd):
+        """Add a production segment job for each of 'segments', each starting
+        from the restart files of the one before (the first from 'restart'),
+        and a catdcd job that joins their trajectories into 'prod_dcd'.
+        Return the catdcd job."""
+        tag = point.tag
+        total = int(point.production_steps)
+        segment_dcds = []
+        for k, segment in enumerate(segments):
+            outputname = "production_%s_seg%d" % (tag, k + 1)
+            dcd = File("%s.dcd" % outputname)
+            outputs = restart_files(outputname)
+
+            # Each segment gets its share of the production walltime
+            if self.config.has_option("simulation", "production_segment_maxwalltime"):
+                walltime = self.getconf("production_segment_maxwalltime")
             else:
-                ptrajjob.addArguments(topfile)
-                ptrajjob.setStdin(ptraj_conf)
+                walltime = str(-(-int(self.getconf("production_maxwalltime")) * segment["steps"] // total))
 
-            ptrajjob.uses(topfile, link=Link.INPUT)
-            ptrajjob.uses(ptraj_conf, link=Link.INPUT)
-            ptrajjob.uses(prod_dcd, link=Link.INPUT)
-            ptrajjob.uses(ptraj_fit, link=Link.OUTPUT, transfer=True)
-            ptrajjob.uses(ptraj_dcd, link=Link.OUTPUT, transfer=True)
-            ptrajjob.profile("globus", "maxwalltime", self.getconf("ptraj_maxwalltime"))
-            ptrajjob.profile("globus", "count", self.getconf("ptraj_cores"))
-            dax.addJob(ptrajjob)
-            dax.depends(ptrajjob, prodjob)
-
-            # sassena incoherent job
-            incojob = Job("sassena", node_label="sassena_inc_%s" % temperature)
-            if self.is_synthetic_workflow:
-                incojob.addArguments("-p", "--config", incoherent_conf)
-                incojob.addArguments("-a", "sassena_inc_%s" % temperature)
-                incojob.addArguments("-i", incoherent_conf.name, ptraj_dcd.name, incoherent_db.name, coordinates.name)
-
-                task_label = "sassena-inc"
-
-                incojob.addArguments(self.keg_params.output_file(task_label, "fqt_incoherent", fqt_incoherent.name))
-
-                self.keg_params.add_keg_params(incojob, task_label)
-            else:
-                incojob.addArguments("--config", incoherent_conf)
+            job = self.production_job(dax, point, "namd_prod_%s_seg%d" % (tag, k + 1),
+                File(segment["conf"]), segment["env"], structure, restart, dcd, outputs,
+                segment["steps"], walltime=walltime)
+            segment_dcds.append(dcd)
+            restart = outputs
 
-            incojob.uses(incoherent_conf, link=Link.INPUT)
-            incojob.uses(ptraj_dcd, link=Link.INPUT)
-            incojob.uses(incoherent_db, link=Link.INPUT)
-            incojob.uses(coordinates, link=Link.INPUT)
-            incojob.uses(fqt_incoherent, link=Link.OUTPUT, transfer=True)
+        catjob = Job("catdcd", node_label="catdcd_%s" % tag)
+        if self.is_synthetic_workflow:
+            catjob.addArguments("-a", "catdcd_%s" % tag)
+            catjob.addArguments("-i", *[f.name for f in segment_dcds])
+            catjob.addArguments(self.keg_params.output_file("namd-prod", "prod_dcd", prod_dcd.name, point.index))
+            self.keg_params.add_keg_params(catjob, "catdcd", point.index)
+        else:
+            catjob.addArguments("-o", prod_dcd, *segment_dcds)
+
+        for f in segment_dcds:
+            catjob.uses(f, link=Link.INPUT)
+        frames = int(point.production_steps) // int(self.production_output)
+        catjob.uses(prod_dcd, link=Link.OUTPUT, **self.trajectory_flags("prod_dcd", frames, prod_dcd.name))
+        catjob.profile("globus", "maxwalltime", self.getconf("catdcd_maxwalltime", default="10"))
+        catjob.profile("globus", "count", "1")
+        catjob.profile("globus", "jobtype", "single")
+
+        self.add_job(dax, catjob)
+        return catjob
+
+    def sassena_job(self, dax, point, kind, label, conf, trajectory, db, fqt, flags, work,
+            walltime=None, cores=None, shard=None):
+        """Add a sassena job of 'kind' ("inc" or "coh") for sweep 'point' to
+        'dax' that reads 'conf' and writes the signal file 'fqt' with the
+        uses() 'flags', and return it. A synthetic job for the 'shard' of the
+        scan emulates its share of the work, and a signal file for its share
+        of the q vectors."""
+        job = Job("sassena", node_label=label)
+        if self.is_synthetic_workflow:
+            job.addArguments("-p", "--config", conf)
+            job.addArguments("-a", label)
+            job.addArguments("-i", conf.name, trajectory.name, db.name, self.coordinates_file.name)
 
-            if self.is_synthetic_workflow:
-                incojob.profile("globus", "maxwalltime", "6")
-                incojob.profile("globus", "count", "8")
-            else:
-                incojob.profile("globus", "maxwalltime", self.getconf("sassena_maxwalltime"))
-                incojob.profile("globus", "count", self.getconf("sassena_cores"))
+            task_label = "sassena-%s" % kind
 
-            dax.addJob(incojob)
-            dax.depends(incojob, ptrajjob)
-            dax.depends(incojob, untarjob)
+            work_share = size_share = 1.0
+            if shard is not None:
+                work_share = shard["work"]
+                size_share = float(shard["qpoints"]) / int(self.sassena_scan["qpoints"])
+            job.addArguments(self.keg_params.output_file(task_label, SASSENA_OUTPUTS[kind], fqt.name, point.index,
+                size_share))
 
-            # sassena coherent job
-            cojob = Job("sassena", node_label="sassena_coh_%s" % temperature)
-            if self.is_synthetic_workflow:
-                cojob.addArguments("-p", "--config", coherent_conf)
-                cojob.addArguments("-a", "sassena_coh_%s" % temperature)
-                cojob.addArguments("-i", coherent_conf.name, ptraj_dcd.name, coherent_db.name, coordinates.name)
+            self.keg_params.add_keg_params(job, task_label, point.index, work_share)
+        else:
+            job.addArguments("--config", conf)
+
+        job.uses(conf, link=Link.INPUT)
+        job.uses(trajectory, link=Link.INPUT)
+        job.uses(db, link=Link.INPUT)
+        job.uses(self.coordinates_file, link=Link.INPUT)
+        job.uses(fqt, link=Link.OUTPUT, **flags)
+        self.set_job_size(job, "6", "sassena", "sassena_%s" % kind, work, walltime=walltime, cores=cores)
+
+        self.add_job(dax, job)
+        return job
+
+    def sassena(self, dax, point, kind, configs, trajectory, db, frames):
+        """Add the sassena jobs of 'kind' ("inc" or "coh") for sweep 'point'
+        to 'dax': one job, or a job for each shard of the scan and a
+        sassenamerge job that combines their signal files. Return the job
+        that writes the signal file of the point, and the file."""
+        tag = point.tag
+        fqt = File("fqt_%s_%s.hd5" % (kind, tag))
+        conf_key = SASSENA_CONFIGS[kind]
+        work = self.work(frames)
+        if conf_key + "_conf" in configs:
+            job = self.sassena_job(dax, point, kind, "sassena_%s_%s" % (kind, tag), File(configs[conf_key + "_conf"]),
+                trajectory, db, fqt, self.retention.flags("fqt", self.output_size("fqt", frames), fqt.name), work)
+            return job, fqt
+
+        # Shards get a share of the sassena cores and the full walltime by
+        # default, as they compute a share of the scan
+        shards = configs[conf_key + "_shards"]
+        cores = self.getconf("sassena_shard_cores",
+            default=str(max(1, int(self.getconf("sassena_cores")) // len(shards))))
+        walltime = self.getconf("sassena_shard_maxwalltime", default=self.getconf("sassena_maxwalltime"))
+
+        shard_files = []
+        for k, conf in enumerate(shards):
+            shard_fqt = File("fqt_%s_%s_shard%d.hd5" % (kind, tag, k))
+            shard_work = None if work is None else int(work * self.sassena_shards[k]["work"])
+            self.sassena_job(dax, point, kind, "sassena_%s_%s_shard%d" % (kind, tag, k),
+                File(conf), trajectory, db, shard_fqt, {"transfer": False}, shard_work,
+                walltime=walltime, cores=cores, shard=self.sassena_shards[k])
+            shard_files.append(shard_fqt)
+
+        label = "sassena_%s_merge_%s" % (kind, tag)
+        mergejob = Job("sassenamerge", node_label=label)
+        weights = ",".join(shard["resolution"] for shard in self.sassena_shards)
+        if self.is_synthetic_workflow:
+            mergejob.addArguments("-a", label)
+            mergejob.addArguments("-i", *[f.name for f in shard_files])
+            mergejob.addArguments(self.keg_params.output_file("sassena-%s" % kind, SASSENA_OUTPUTS[kind],
+                fqt.name, point.index))
+            self.keg_params.add_keg_params(mergejob, "sassena-merge", point.index)
+        else:
+            mergejob.addArguments("-o", fqt, "-w", weights, *shard_files)
+
+        for f in shard_files:
+            mergejob.uses(f, link=Link.INPUT)
+        mergejob.uses(fqt, link=Link.OUTPUT, **self.retention.flags("fqt", self.output_size("fqt", frames), fqt.name))
+        mergejob.profile("globus", "maxwalltime", self.getconf("sassenamerge_maxwalltime", default="10"))
+        mergejob.profile("globus", "count", "1")
+        mergejob.profile("globus", "jobtype", "single")
+
+        self.add_job(dax, mergejob)
+        return mergejob, fqt
+
+    def fqt_store_job(self, dax):
+        """Add the job that collects the signal files of every sweep point
+        into one HDF5 store, sliced by q vector across the sweep, and write
+        the index of the points that it reads"""
+        index = File("fqt_points.txt")
+        dimensions = [name for name, single, plural in DIMENSIONS]
+        path = self.write_file(index.name, write_index(dimensions, self.store_points))
+        self.add_replica(index.name, path)
+
+        store = File("fqt_store.hd5")
+        signals = [File(name) for tag, values, files in self.store_points for name in sorted(files.values())]
+        job = Job("fqtstore", node_label="fqtstore")
+        if self.is_synthetic_workflow:
+            job.addArguments("-a", "fqtstore")
+            job.addArguments("-i", index.name, *[f.name for f in signals])
+            job.addArguments(self.keg_params.output_file("fqtstore", "fqt_store", store.name))
+            self.keg_params.add_keg_params(job, "fqtstore")
+        else:
+            job.addArguments("-c", self.getconf("fqt_store_chunk", default="64"), "-o", store, index)
+
+        job.uses(index, link=Link.INPUT)
+        for f in signals:
+            job.uses(f, link=Link.INPUT)
+        job.uses(store, link=Link.OUTPUT, **self.retention.flags("fqt_store", self.store_size, store.name))
+        job.profile("globus", "maxwalltime", self.getconf("fqtstore_maxwalltime", default="30"))
+        job.profile("globus", "count", "1")
+        job.profile("globus", "jobtype", "single")
+
+        dax.addJob(job)
+        if self.memo is not None and not self.memoize(dax, [job]):
+            return
+        for parent in self.store_parents:
+            if parent not in self.memo_pruned:
+                dax.depends(job, parent)
+
+    def trajectory_flags(self, kind, frames, name):
+        """Return the uses() flags of the trajectory 'name' of class 'kind'
+        with 'frames' frames. The retention policy applies to the packed file of a
+        compressed trajectory instead."""
+        if kind in self.compress:
+            return {"transfer": False}
+        return self.retention.flags(kind, self.output_size(kind, frames), name)
+
+    def pack_job(self, dax, point, kind, dcd, frames):
+        """Add a dcdpack job that compresses the trajectory 'dcd' of class
+        'kind' to 'dax', and return the packed file. Its projected size is
+        estimated from the frames it keeps and the precision."""
+        name = dcd.name[:-len(".dcd")]
+        packed = File("%s.dcdz" % name)
+        label = "dcdpack_%s" % name
+        job = Job("dcdpack", node_label=label)
+        if self.is_synthetic_workflow:
+            job.addArguments("-a", label)
+            job.addArguments("-i", dcd.name)
+            job.addArguments(self.keg_params.output_file("dcdpack", kind, packed.name, point.index))
+            self.keg_params.add_keg_params(job, "dcdpack", point.index)
+        else:
+            job.addArguments("pack", "-p", self.getconf("compress_precision", default="0.001"),
+                "-s", self.getconf("compress_stride", default="1"), dcd, packed)
+
+        stride = int(self.getconf("compress_stride", default="1"))
+        size = None
+        if self.natoms is not None:
+            size = dcdpack_size(self.natoms, -(-frames // stride),
+                float(self.getconf("compress_precision", default="0.001")))
+        job.uses(dcd, link=Link.INPUT)
+        job.uses(packed, link=Link.OUTPUT, **self.retention.flags(kind, size, packed.name))
+        job.profile("globus", "maxwalltime", self.getconf("dcdpack_maxwalltime", default="10"))
+        job.profile("globus", "count", "1")
+        job.profile("globus", "jobtype", "single")
+        self.add_job(dax, job)
+        return packed
+
+    def unpack_job(self, dax, point, packed):
+        "Add a job that unpacks the fitted trajectory of 'point' from 'packed' and return the DCD"
+        unpacked = File(self.sassena_trajectory(point))
+        label = "dcdunpack_%s" % point.tag
+        job = Job("dcdpack", node_label=label)
+        if self.is_synthetic_workflow:
+            job.addArguments("-a", label)
+            job.addArguments("-i", packed.name)
+            job.addArguments(self.keg_params.output_file("amber-ptraj", "ptraj_dcd", unpacked.name, point.index))
+            self.keg_params.add_keg_params(job, "dcdunpack", point.index)
+        else:
+            job.addArguments("unpack", packed, unpacked)
+
+        job.uses(packed, link=Link.INPUT)
+        job.uses(unpacked, link=Link.OUTPUT, transfer=False)
+        job.profile("globus", "maxwalltime", self.getconf("dcdpack_maxwalltime", default="10"))
+        job.profile("globus", "count", "1")
+        job.profile("globus", "jobtype", "single")
+        self.add_job(dax, job)
+        return unpacked
+
+    def add_job(self, dax, job):
+        "Add 'job' to 'dax' as part of the current pipeline"
+        dax.addJob(job)
+        self.pipeline_jobs.append(job)
+
+    def memo_input_key(self, name):
+        "Return the content key of the input file 'name', or None if it has none"
+        if name in self.memo_outputs:
+            return self.memo_outputs[name]["key"]
+        if name in self.manifest.files:
+            return self.manifest.files[name]
+        if name not in self.memo_inputs:
+            url = self.replicas.get(name)
+            path = url[len("file://"):] if url else os.path.join(self.input_dir, name)
+            self.memo_inputs[name] = self.hashes.digest(path) if os.path.isfile(path) else None
+        return self.memo_inputs[name]
+
+    def memoize(self, dax, jobs, prune=True, needed=()):
+        """Compute the keys of the outputs of 'jobs', in order. With 'prune',
+        the jobs whose outputs are all in the memo cache are removed from
+        'dax' and their outputs are registered from the cache instead. Then
+        the jobs whose outputs are only read by removed jobs are removed as
+        well, unless one of the outputs is retained or 'needed' by a job that
+        is not in 'jobs'. Return the jobs that are left."""
+        kept = []
+        for job in jobs:
+            inputs, outputs = job_files(job)
+            keys = dict((name, self.memo_input_key(name)) for name in inputs)
+            key = None if None in keys.values() else job_key(job, keys)
+            cached = {}
+            for name in outputs:
+                self.memo_outputs[name] = {"key": key and output_key(key, name), "job": job.node_label}
+                if key is not None:
+                    cached[name] = self.memo.lookup(self.memo_outputs[name]["key"])
+            if prune and outputs and len(cached) == len(outputs) and all(cached.values()):
+                self.remove_job(dax, job)
+                for name, path in sorted(cached.items()):
+                    self.add_replica(name, path)
+                continue
+            kept.append(job)
+        if not prune:
+            return kept
+
+        # Going backwards, so that the jobs feeding a removed job are seen
+        # after it (e.g. the equilibration of a production that was removed)
+        readers = {}
+        for job in jobs:
+            for name in job_files(job)[0]:
+                readers.setdefault(name, []).append(job.id)
+        for job in reversed(kept):
+            outputs = job_files(job)[1]
+            if outputs and all(readers.get(name) and self.memo_pruned.issuperset(readers[name])
+                    and not self.retention.retained(name) and name not in needed for name in outputs):
+                self.remove_job(dax, job)
+                self.memo_unneeded.add(job.id)
+        return [job for job in kept if job.id not in self.memo_pruned]
+
+    def remove_job(self, dax, job):
+        "Remove 'job' from 'dax' and leave its outputs out of the projected volumes"
+        dax.removeJob(job)
+        self.memo_pruned.add(job.id)
+        for name in job_files(job)[1]:
+            self.retention.discount(name)
+            self.unproduced.add(name)
+
+    def add_dependencies(self, dax, jobs):
+        """Add the edges between 'jobs' and the untar job that follow from the
+        files they read and write, leaving out the edges implied by others"""
+        for parent, child in transitive_reduction(file_edges([self.untarjob] + jobs, job_files)):
+            dax.depends(child, parent)
+
+    @PROFILE.timed()
+    def generate_pipeline(self, dax, point, configs):
+        """Add the jobs for the pipeline of sweep 'point' to 'dax', using the
+        config files returned by generate_point_configs()"""
+        tag = point.tag
+        frames = int(point.production_steps) // int(self.production_output)
+        self.pipeline_jobs = []
+
+        structure = File(configs["structure"])
+        coordinates = self.coordinates_file
+        parameters = self.parameters_file
+        extended_system = self.extended_system_file
+        topfile = self.topfile_file
+
+        # Equilibrate files
+        eq_conf = File(configs["eq_conf"])
+        eq_coord, eq_xsc, eq_vel = restart_files("equilibrate_%s" % tag)
+
+        # Production files
+        prod_dcd = File("production_%s.dcd" % tag)
+
+        # Ptraj files
+        ptraj_conf = File(configs["ptraj_conf"]) if "ptraj_conf" in configs else None
+        ptraj_fit = File("ptraj_%s.fit" % tag)
+        ptraj_dcd = File("ptraj_%s.dcd" % tag)
+
+        # Equilibrate job, which starts from the extended system or from the
+        # restart files of the point it is chained to
+        seed = self.eq_seeds.get(tag) if self.eq_seeds is not None else None
+        eq_steps = self.equilibrate_steps
+        eq_start = [extended_system]
+        if seed is not None:
+            eq_steps = self.equilibrate_warm_steps
+            eq_start = restart_files("equilibrate_%s" % seed)
+
+        eqjob = Job("namd", node_label="namd_eq_%s" % tag)
+        if self.is_synthetic_workflow:
+            eqjob.addArguments("-p", eq_conf)
+            eqjob.addArguments("-a", "namd_eq_%s" % tag)
+            eqjob.addArguments("-i", eq_conf.name, structure.name, coordinates.name,
+                parameters.name, *[f.name for f in eq_start])
 
-                task_label = "sassena-coh"
+            task_label = "namd-eq"
 
-                cojob.addArguments(self.keg_params.output_file(task_label, "fqt_coherent", fqt_coherent.name))
+            for label, output_file in [ ("eq_coord", eq_coord), ("eq_xsc", eq_xsc), ("eq_vel", eq_vel) ]:
+                eqjob.addArguments(self.keg_params.output_file(task_label, label, output_file.name, point.index))
 
-                self.keg_params.add_keg_params(cojob, task_label)
+            self.keg_params.add_keg_params(eqjob, task_label, point.index)
+        else:
+            eqjob.addArguments(eq_conf)
+
+        eqjob.uses(eq_conf, link=Link.INPUT)
+        eqjob.uses(structure, link=Link.INPUT)
+        eqjob.uses(coordinates, link=Link.INPUT)
+        eqjob.uses(parameters, link=Link.INPUT)
+        for f in eq_start:
+            eqjob.uses(f, link=Link.INPUT)
+        # The restart files are staged out for the memo cache
+        eqjob.uses(eq_coord, link=Link.OUTPUT, transfer=self.memo is not None)
+        eqjob.uses(eq_xsc, link=Link.OUTPUT, transfer=self.memo is not None)
+        eqjob.uses(eq_vel, link=Link.OUTPUT, transfer=self.memo is not None)
+        self.set_job_size(eqjob, "1", "equilibrate", "namd_eq", self.work(eq_steps),
+            walltime=self.warm_walltime() if seed is not None else None)
+        for var, value in sorted(configs["eq_env"].items()):
+            eqjob.profile("env", var, value)
+        self.add_job(dax, eqjob)
+
+        # Production job, or chain of production segment jobs followed by a
+        # job that joins their trajectories
+        if "prod_segments" not in configs:
+            self.production_job(dax, point, "namd_prod_%s" % tag, File(configs["prod_conf"]),
+                configs["prod_env"], structure, [eq_coord, eq_xsc, eq_vel], prod_dcd, [],
+                point.production_steps)
+        else:
+            self.production_chain(dax, point, configs["prod_segments"], structure,
+                [eq_coord, eq_xsc, eq_vel], prod_dcd)
+
+        # ptraj job, which fits the trajectory to its first frame with
+        # cpptraj or with rmsfit.py
+        if self.ptraj_engine == "rmsfit":
+            kind = "rmsfit"
+            ptrajjob = Job("rmsfit", node_label="%s_%s" % (kind, tag))
+        else:
+            kind = "amber_ptraj"
+            ptrajjob = Job(namespace="amber", name="ptraj", node_label="%s_%s" % (kind, tag))
+        label = ptrajjob.node_label
 
+        if self.is_synthetic_workflow:
+            if self.ptraj_engine == "rmsfit":
+                ptrajjob.addArguments("-a", label)
+                ptrajjob.addArguments("-i", prod_dcd.name)
             else:
-                cojob.addArguments("--config", coherent_conf)
+                ptrajjob.addArguments("-p", topfile)
+                ptrajjob.addArguments("-a", label)
+                ptrajjob.addArguments("-i", topfile.name, ptraj_conf.name, prod_dcd.name)
 
-            cojob.uses(coherent_conf, link=Link.INPUT)
-            cojob.uses(ptraj_dcd, link=Link.INPUT)
-            cojob.uses(coherent_db, link=Link.INPUT)
-            cojob.uses(coordinates, link=Link.INPUT)
-            cojob.uses(fqt_coherent, link=Link.OUTPUT, transfer=True)
+            task_label = "amber-ptraj"
 
-            if self.is_synthetic_workflow:
-                cojob.profile("globus", "maxwalltime", "6")
-                cojob.profile("globus", "count", "8")
-            else:
-                cojob.profile("globus", "maxwalltime", self.getconf("sassena_maxwalltime"))
-                cojob.profile("globus", "count", self.getconf("sassena_cores"))
+            for label, output_file in [ ("ptraj_fit", ptraj_fit), ("ptraj_dcd", ptraj_dcd) ]:
+                ptrajjob.addArguments(self.keg_params.output_file(task_label, label, output_file.name, point.index))
 
-            dax.addJob(cojob)
-            dax.depends(cojob, prodjob)
-            dax.depends(cojob, untarjob)
+            self.keg_params.add_keg_params(ptrajjob, task_label, point.index)
 
-        # Write the DAX file
-        dax.writeXMLFile(self.daxfile)
+        elif self.ptraj_engine == "rmsfit":
+            ptrajjob.addArguments("-j", self.getconf("ptraj_cores"), prod_dcd, ptraj_dcd, ptraj_fit)
+        else:
+            ptrajjob.addArguments(topfile)
+            ptrajjob.setStdin(ptraj_conf)
 
+        if self.ptraj_engine != "rmsfit":
+            ptrajjob.uses(topfile, link=Link.INPUT)
+            ptrajjob.uses(ptraj_conf, link=Link.INPUT)
+        ptrajjob.uses(prod_dcd, link=Link.INPUT)
+        ptrajjob.uses(ptraj_fit, link=Link.OUTPUT, **self.retention.flags("ptraj_fit",
+            self.output_size("ptraj_fit", frames), ptraj_fit.name))
+        ptrajjob.uses(ptraj_dcd, link=Link.OUTPUT, **self.trajectory_flags("ptraj_dcd", frames, ptraj_dcd.name))
+        if self.clustering != "none":
+            self.cluster_short_job(ptrajjob, point.index // self.cluster_size, self.getconf("ptraj_cores"))
+        else:
+            self.set_job_size(ptrajjob, None, "ptraj", kind, self.work(frames), jobtype="single")
+        self.add_job(dax, ptrajjob)
+
+        # Compressed copies of the trajectories
+        if "prod_dcd" in self.compress:
+            self.pack_job(dax, point, "prod_dcd", prod_dcd, frames)
+        trajectory = ptraj_dcd
+        if "ptraj_dcd" in self.compress:
+            packed = self.pack_job(dax, point, "ptraj_dcd", ptraj_dcd, frames)
+            if self.decompress_for_sassena:
+                trajectory = self.unpack_job(dax, point, packed)
+
+        # sassena jobs
+        signals = {}
+        for kind, db in [("inc", self.incoherent_db_file), ("coh", self.coherent_db_file)]:
+            job, fqt = self.sassena(dax, point, kind, configs, trajectory, db, frames)
+            signals[SASSENA_CONFIGS[kind]] = fqt.name
+            if self.aggregate_fqt:
+                self.store_parents.append(job.id)
+                self.store_size += self.output_size("fqt", frames)
+        if self.aggregate_fqt:
+            self.store_points.append((point.tag, point._asdict(), signals))
+
+        if self.memo is not None:
+            # The restart files of a chained equilibration are read by the
+            # points that start from it, in later pipelines
+            needed = ()
+            if tag in self.eq_chained:
+                needed = [f.name for f in restart_files("equilibrate_%s" % tag)]
+            self.pipeline_jobs = self.memoize(dax, self.pipeline_jobs, needed=needed)
+
+        # The dependencies follow from the files the jobs read and write
+        self.add_dependencies(dax, self.pipeline_jobs)
+        self.pipeline_jobs = None
+
+        # A chained equilibration also waits for the one it starts from,
+        # which is in another pipeline
+        self.eq_jobs[tag] = eqjob.id
+        if seed is not None and eqjob.id not in self.memo_pruned and self.eq_jobs[seed] not in self.memo_pruned:
+            dax.depends(eqjob, self.eq_jobs[seed])
+
+    def output_size(self, kind, frames):
+        """Return the projected size in bytes of an output of file class
+        'kind' with 'frames' frames, or None if it is not known"""
+        if kind == "fqt":
+            return fqt_size(int(self.sassena_scan["qpoints"]), frames)
+        if kind == "ptraj_fit":
+            return rms_size(frames)
+        if self.natoms is None:
+            return None
+        return dcd_size(self.natoms, frames)
+
+    def data_volumes(self):
+        """Return (description, number of files, total bytes) for the
+        trajectories and sassena signal files the workflow will produce"""
+        if self.natoms is None:
+            return []
+        dcd = [0, 0]
+        fqt = [0, 0]
+        qvectors = int(self.sassena_scan["qpoints"])
+        for point in self.sweep.points():
+            frames = int(point.production_steps) // int(self.production_output)
+            for name in ("production_%s.dcd" % point.tag, "ptraj_%s.dcd" % point.tag):
+                if name not in self.unproduced:
+                    dcd[0] += 1
+                    dcd[1] += dcd_size(self.natoms, frames)
+            for kind in SASSENA_CONFIGS:
+                if "fqt_%s_%s.hd5" % (kind, point.tag) not in self.unproduced:
+                    fqt[0] += 1
+                    fqt[1] += fqt_size(qvectors, frames)
+        files, size, unknown = self.retention.volumes["stage-out"]
+        return [("DCD data", dcd[0], dcd[1]), ("HDF5 data", fqt[0], fqt[1]), ("Stage-out", files, size)]
+
+    @PROFILE.timed()
     def generate_workflow(self):
 
         # Generate dax
@@ -401,28 +1382,84 @@ class RefinementWorkflow(object):
         # Generate the replica catalog
         self.generate_replica_catalog()
 
-def main():
-    if len(sys.argv) < 3:
-        raise Exception("Usage: %s --synthetic CONFIGFILE OUTDIR" % sys.argv[0])
+        # Record the keys of the outputs for 'memo.py record'
+        if self.memo is not None:
+            self.save_memo_keys()
+
+        # Record what was generated for the next incremental run
+        self.save_manifest()
+
+        # Report what the retention policy does with the outputs
+        for line in self.retention.summary():
+            print "Outputs %s" % line
+
+    def save_memo_keys(self):
+        "Write the key of every output that has one, and how many jobs were taken from the memo cache"
+        outputs = dict((name, entry) for name, entry in self.memo_outputs.items() if entry["key"] is not None)
+        self.write_file(KEYS_FILE, json.dumps({"outputs": outputs}, indent=1, sort_keys=True))
+        print "Memo cache: %d jobs reused from %s, %d jobs no longer needed" % (
+            len(self.memo_pruned) - len(self.memo_unneeded), self.memo.root, len(self.memo_unneeded))
+
+    @PROFILE.timed()
+    def save_manifest(self):
+        """Remove the files of the previous run that are no longer part of the
+        workflow, save the manifest, and report which pipelines changed"""
+        if self.previous is not None:
+            for name in self.previous.files:
+                path = os.path.join(self.outdir, name)
+                if name not in self.manifest.files and os.path.isfile(path):
+                    os.unlink(path)
+
+        self.manifest.save(self.manifest_file)
+        PROFILE.wrote(os.path.getsize(self.manifest_file))
+
+        if self.previous is not None:
+            statuses = self.manifest.statuses()
+            statuses["removed"] = sorted(t for t in self.previous.points if t not in self.manifest.points)
+            print "Pipelines: %d new, %d changed, %d unchanged, %d removed" % tuple(
+                len(statuses.get(s, [])) for s in ("new", "changed", "unchanged", "removed"))
+            for status in ("new", "changed", "removed"):
+                if statuses.get(status):
+                    print "  %-8s %s" % (status + ":", ", ".join(statuses[status]))
 
-    is_synthetic_workflow = (sys.argv[1] == "--synthetic")
-
-    if is_synthetic_workflow:
-        configfile = sys.argv[2]
-        outdir = sys.argv[3]
-    else:
-        configfile = sys.argv[1]
-        outdir = sys.argv[2]
+def main():
+    parser = OptionParser(usage="%prog [options] CONFIGFILE OUTDIR")
+    parser.add_option("--synthetic", action="store_true", dest="synthetic", default=False,
+        help="Generate a synthetic (pegasus-keg) version of the workflow")
+    parser.add_option("--stream", action="store_true", dest="stream", default=False,
+        help="Write the DAX incrementally to keep memory bounded for large sweeps")
+    parser.add_option("--incremental", action="store_true", dest="incremental", default=False,
+        help="Update an existing OUTDIR, rewriting only the files whose inputs changed")
+    parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs", default=1,
+        help="Number of processes used to generate config files [default: %default]")
+    parser.add_option("--seed", action="store", type="int", dest="seed", default=None,
+        help="Seed for the random values of a synthetic workflow, to make it reproducible")
+    parser.add_option("--profile", action="store_true", dest="profile",
+        default=os.environ.get("SNS_PROFILE", "") not in ("", "0"),
+        help="Write the time spent in each phase and the files written to OUTDIR/profile.json "
+            "(also enabled by SNS_PROFILE=1)")
+    parser.add_option("--cprofile", action="store_true", dest="cprofile",
+        default=os.environ.get("SNS_PROFILE", "") == "cprofile",
+        help="Also write a cProfile dump to OUTDIR/profile.pstats (also enabled by SNS_PROFILE=cprofile)")
+    parser.add_option("--estimate", action="store_true", dest="estimate", default=False,
+        help="Simulate the generated workflow and report its makespan, core-hours and data volume")
+    options, args = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("Specify CONFIGFILE and OUTDIR")
+
+    configfile, outdir = args
 
     if not os.path.isfile(configfile):
         raise Exception("No such file: %s" % configfile)
 
-    if os.path.isdir(outdir):
-        raise Exception("Directory exists: %s" % outdir)
+    if os.path.isdir(outdir) and not options.incremental:
+        raise Exception("Directory exists: %s (use --incremental to update it)" % outdir)
 
     # Create the output directory
     outdir = os.path.abspath(outdir)
-    os.makedirs(outdir)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
 
     # Read the config file
     config = ConfigParser()
@@ -431,10 +1468,28 @@ def main():
     # Save a copy of the config file
     shutil.copy(configfile, outdir)
 
+    PROFILE.enabled = options.profile or options.cprofile
+    profiler = None
+    if options.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     # Generate the workflow in outdir based on the config file
-    workflow = RefinementWorkflow(outdir, config, is_synthetic_workflow)
+    with PROFILE.phase("setup"):
+        workflow = RefinementWorkflow(outdir, config, options.synthetic, streaming=options.stream,
+            jobs=options.jobs, incremental=options.incremental, seed=options.seed)
     workflow.generate_workflow()
 
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(outdir, "profile.pstats"))
+    if PROFILE.enabled:
+        PROFILE.save(os.path.join(outdir, "profile.json"), points=len(workflow.sweep),
+            jobs=options.jobs, streaming=options.stream, synthetic=options.synthetic)
+
+    if options.estimate:
+        Estimator(config).report(workflow.daxfile, workflow.data_volumes())
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import errno
+import hashlib
+import socket
+import signal
+import httplib
+import tempfile
+import threading
+import traceback
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from collections import OrderedDict
+from cStringIO import StringIO
+from optparse import OptionParser
+from ConfigParser import ConfigParser
+from daxgen import RefinementWorkflow, TEMPLATES, TEMPLATE_DIR, DEFAULT_HASH_CACHE, template_digests
+from hashcache import HashCache
+from sweep import DIMENSIONS
+import psfgen
+
+__all__ = ["GenerationService", "generate", "submit"]
+
+# A request is a JSON object, POSTed to /generate:
+#
+#   config       the path of a config file
+#   settings     {section: {option: value}} set on top of the config file
+#   sweep        {option: value or list of values} for the sweep options of
+#                [simulation], e.g. {"temperatures": [280, 290, 300]}
+#   outdir       the workflow directory, relative to the --root of the
+#                service and within it; by default a new directory there
+#   synthetic, stream, incremental, seed
+#                as the daxgen.py options; the mock inputs of a synthetic
+#                workflow are written to OUTDIR/inputs unless the config
+#                sets input_dir
+#
+# The reply has the workflow directory, its DAX and replica catalog, the
+# number of sweep points, the seconds generation took and what daxgen
+# printed, or an "error". GET /status reports the requests served.
+DEFAULT_PORT = 8765
+
+# Seconds a request waits for its worker. A worker that dies (e.g. killed
+# for running out of memory) never replies; the pool replaces it, and the
+# request gets an error after this long.
+DEFAULT_TIMEOUT = 600
+
+# The number of (keg sections, seed) pairs whose keg distributions a
+# worker keeps
+KEG_CACHE_SIZE = 16
+
+# Each worker process keeps the compiled templates, the parsed PSF template,
+# the config files it has read, the atom counts of structure files, the
+# hash caches and the keg distributions of seeded synthetic requests
+# between requests. The templates are reloaded when one of them changes on
+# disk, and a config or structure file when its modification time or size
+# changes.
+_root = None
+_templates = None
+_configs = {}
+_atoms = {}
+_hashes = {}
+_kegs = OrderedDict()
+
+def _init_worker(root):
+    global _root
+    _root = root
+    # The service stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def hash_cache(config):
+    "Return the HashCache of the hash_cache of 'config', loading it on first use"
+    path = DEFAULT_HASH_CACHE
+    if config.has_option("simulation", "hash_cache"):
+        path = config.get("simulation", "hash_cache")
+    hashes = _hashes.get(path)
+    if hashes is None:
+        hashes = _hashes[path] = HashCache(path)
+    if config.has_option("simulation", "rc_threads"):
+        hashes.threads = config.getint("simulation", "rc_threads")
+    return hashes
+
+def load_templates(hashes):
+    """Compile every template and parse the PSF template, unless they are
+    loaded and have not changed since. Return the digests of the templates."""
+    global _templates
+    digests = template_digests(hashes)
+    if digests != _templates:
+        TEMPLATES.clear()
+        psfgen.clear()
+        for name in sorted(digests):
+            if name == "charge.xml":
+                psfgen.load(os.path.join(TEMPLATE_DIR, name))
+            else:
+                TEMPLATES.get(name)
+        _templates = digests
+    return digests
+
+def read_config(path):
+    """Return a new ConfigParser of the config file 'path', which is only
+    read again if it changed. Each request changes its own copy."""
+    st = os.stat(path)
+    entry = _configs.get(path)
+    if entry is None or entry[:2] != (st.st_mtime, st.st_size):
+        f = open(path)
+        try:
+            entry = _configs[path] = (st.st_mtime, st.st_size, f.read())
+        finally:
+            f.close()
+    config = ConfigParser()
+    config.readfp(StringIO(entry[2]), path)
+    return config
+
+def count_atoms(path):
+    "Return psfgen.count_atoms(path), which is only counted again if the file changed"
+    st = os.stat(path)
+    entry = _atoms.get(path)
+    if entry is None or entry[:2] != (st.st_mtime, st.st_size):
+        entry = _atoms[path] = (st.st_mtime, st.st_size, psfgen.count_atoms(path))
+    return entry[2]
+
+def keg_distributions(config, seed):
+    """Return the dict that keeps the keg distributions of 'config' with
+    'seed', shared by the requests with the same keg sections and seed, or
+    None if there is no seed"""
+    if seed is None:
+        return None
+    sections = [(section, sorted(config.items(section, raw=True)))
+        for section in sorted(config.sections()) if section.startswith("keg-")]
+    key = (hashlib.sha256(repr(sections)).hexdigest(), seed)
+    distributions = _kegs.pop(key, None)
+    if distributions is None:
+        distributions = {}
+        if len(_kegs) >= KEG_CACHE_SIZE:
+            _kegs.popitem(last=False)
+    _kegs[key] = distributions
+    return distributions
+
+def format_value(value):
+    "Return the config file text of a JSON value; lists become comma-separated lists"
+    if isinstance(value, list):
+        return ",".join(format_value(v) for v in value)
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+def build_config(request):
+    "Return the ConfigParser of 'request': its config file with its settings and sweep applied"
+    if request.get("config"):
+        path = os.path.abspath(request["config"])
+        if not os.path.isfile(path):
+            raise Exception("No such file: %s" % request["config"])
+        config = read_config(path)
+    else:
+        config = ConfigParser()
+
+    for section, options in sorted(request.get("settings", {}).items()):
+        if not config.has_section(section):
+            config.add_section(section)
+        for option, value in sorted(options.items()):
+            config.set(section, option, format_value(value))
+
+    sweep = request.get("sweep", {})
+    if sweep and not config.has_section("simulation"):
+        config.add_section("simulation")
+    for option, value in sorted(sweep.items()):
+        names = [d[1:] for d in DIMENSIONS if option in d[1:]]
+        if option == "sweep":
+            names = [(option,)]
+        if not names:
+            raise Exception("Not a sweep option: %s" % option)
+        # The value replaces the dimension in either of its spellings
+        for name in names[0]:
+            config.remove_option("simulation", name)
+        config.set("simulation", option, format_value(value))
+    return config
+
+def make_outdir(request):
+    "Create the workflow directory of 'request' and return its absolute path"
+    incremental = request.get("incremental", False)
+    if not request.get("outdir"):
+        if incremental:
+            raise Exception("An incremental request needs an outdir")
+        return tempfile.mkdtemp(prefix=time.strftime("wf-%Y%m%d-%H%M%S-"), dir=_root)
+    root = os.path.realpath(_root)
+    outdir = os.path.realpath(os.path.join(root, request["outdir"]))
+    if not outdir.startswith(os.path.join(root, "")):
+        raise Exception("Not a directory under %s: %s" % (_root, request["outdir"]))
+    try:
+        os.makedirs(outdir)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+        if not incremental:
+            raise Exception("Directory exists: %s (use incremental to update it)" % request["outdir"])
+    return outdir
+
+def generate(request):
+    """Generate the workflow of 'request' in this process and return the
+    reply. Errors are returned in the reply rather than raised, so that the
+    worker survives them."""
+    start = time.time()
+    output = StringIO()
+    sys.stdout = output
+    try:
+        try:
+            config = build_config(request)
+            outdir = make_outdir(request)
+            # Concurrent synthetic requests would overwrite each other's mock
+            # inputs in a shared directory, so each writes its own
+            if request.get("synthetic") and not config.has_option("simulation", "input_dir"):
+                if not config.has_section("simulation"):
+                    config.add_section("simulation")
+                config.set("simulation", "input_dir", os.path.join(outdir, "inputs"))
+            name = os.path.basename(request["config"]) if request.get("config") else "workflow.cfg"
+            f = open(os.path.join(outdir, name), "w")
+            try:
+                config.write(f)
+            finally:
+                f.close()
+
+            hashes = hash_cache(config)
+            templates = load_templates(hashes)
+            workflow = RefinementWorkflow(outdir, config, request.get("synthetic", False),
+                streaming=request.get("stream", False), incremental=request.get("incremental", False),
+                seed=request.get("seed"), hashes=hashes, templates=templates,
+                keg_distributions=keg_distributions(config, request.get("seed")), count_atoms=count_atoms)
+            workflow.generate_workflow()
+        except Exception, e:
+            traceback.print_exc(file=output)
+            return {"error": str(e), "output": output.getvalue()}
+    finally:
+        sys.stdout = sys.__stdout__
+
+    return {
+        "outdir": outdir,
+        "dax": workflow.daxfile,
+        "rc": os.path.join(outdir, "rc.txt"),
+        "points": len(workflow.sweep),
+        "seconds": round(time.time() - start, 3),
+        "output": output.getvalue()
+    }
+
+class GenerationService(object):
+    """Generates workflows in a pool of 'workers' processes that keep their
+    templates and caches loaded between requests. Workflow directories are
+    relative to 'root'. A request that gets no reply from its worker within
+    'timeout' seconds fails."""
+
+    def __init__(self, workers=2, root=".", timeout=DEFAULT_TIMEOUT):
+        global _root
+        self.root = _root = os.path.abspath(root)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.active = 0
+        self.served = 0
+        self.failed = 0
+        self.started = time.time()
+
+        # Load the templates before forking so every worker starts warm
+        load_templates(hash_cache(ConfigParser()))
+        self.pool = multiprocessing.Pool(workers, _init_worker, (self.root,))
+
+    def generate(self, request):
+        "Generate the workflow of 'request' in a worker and return the reply"
+        with self.lock:
+            self.active += 1
+        try:
+            reply = self.pool.apply_async(generate, (request,)).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            reply = {"error": "No reply from the worker within %d s (it may have died)" % self.timeout}
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.served += 1
+        if "error" in reply:
+            with self.lock:
+                self.failed += 1
+        return reply
+
+    def status(self):
+        with self.lock:
+            return {"workers": self.workers, "active": self.active, "served": self.served,
+                "failed": self.failed, "uptime": round(time.time() - self.started, 1), "root": self.root}
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/status":
+            return self.reply(404, {"error": "Not found: %s" % self.path})
+        self.reply(200, self.server.service.status())
+
+    def do_POST(self):
+        if self.path != "/generate":
+            return self.reply(404, {"error": "Not found: %s" % self.path})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", "0"))))
+        except ValueError, e:
+            return self.reply(400, {"error": "Invalid request: %s" % e})
+        if not isinstance(request, dict):
+            return self.reply(400, {"error": "A request is a JSON object"})
+        reply = self.server.service.generate(request)
+        self.reply(400 if "error" in reply else 200, reply)
+
+    def reply(self, code, data):
+        body = json.dumps(data, indent=1, sort_keys=True) + "\n"
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.quiet:
+            return
+        # Clients of a UNIX socket have no address
+        address = self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+        sys.stderr.write("%s - - [%s] %s\n" % (address, self.log_date_time_string(), format % args))
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(service, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT, quiet=False):
+    "Return a server for 'service' on the UNIX socket 'socket_path', or on 'host':'port'"
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            try:
+                UnixHTTPConnection(socket_path).connect()
+            except socket.error:
+                os.unlink(socket_path)
+            else:
+                raise Exception("A service is already listening on %s" % socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = HTTPServer((host, port), RequestHandler)
+    server.service = service
+    server.quiet = quiet
+    return server
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    "An HTTPConnection to a server on a UNIX socket"
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+def call(method, path, body=None, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT):
+    "Send a request to a running service and return the decoded reply"
+    if socket_path is not None:
+        conn = UnixHTTPConnection(socket_path)
+    else:
+        conn = httplib.HTTPConnection(host, port)
+    try:
+        conn.request(method, path, body, {"Content-Type": "application/json"})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+def submit(request, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT):
+    "Send the generation 'request' to a running service and return its reply"
+    return call("POST", "/generate", json.dumps(request), socket_path, host, port)
+
+def main():
+    parser = OptionParser(usage="%prog [options] serve\n       %prog [options] submit REQUEST_FILE\n"
+        "       %prog [options] status")
+    parser.add_option("-s", "--socket", action="store", dest="socket", default=None,
+        help="Listen on (or connect to) this UNIX socket instead of TCP")
+    parser.add_option("--host", action="store", dest="host", default="127.0.0.1",
+        help="Address to listen on or connect to [default: %default]")
+    parser.add_option("-p", "--port", action="store", type="int", dest="port", default=DEFAULT_PORT,
+        help="TCP port [default: %default]")
+    parser.add_option("-w", "--workers", action="store", type="int", dest="workers",
+        default=multiprocessing.cpu_count(), help="Number of worker processes [default: %default]")
+    parser.add_option("-r", "--root", action="store", dest="root", default=".",
+        help="Directory that workflow directories are relative to [default: %default]")
+    parser.add_option("-t", "--timeout", action="store", type="int", dest="timeout", default=DEFAULT_TIMEOUT,
+        help="Seconds a request waits for its worker [default: %default]")
+    parser.add_option("-q", "--quiet", action="store_true", dest="quiet", default=False,
+        help="Do not log requests")
+    options, args = parser.parse_args()
+
+    if not args or args[0] not in ("serve", "submit", "status") or (args[0] == "submit") != (len(args) == 2) \
+            or len(args) > 2:
+        parser.error("Specify serve, submit REQUEST_FILE or status")
+
+    address = dict(socket_path=options.socket, host=options.host, port=options.port)
+    if args[0] == "submit":
+        # The request is read from a file, or from stdin with -
+        f = sys.stdin if args[1] == "-" else open(args[1])
+        try:
+            request = json.load(f)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        reply = submit(request, **address)
+        print json.dumps(reply, indent=1, sort_keys=True)
+        if "error" in reply:
+            sys.exit(1)
+        return
+    if args[0] == "status":
+        print json.dumps(call("GET", "/status", **address), indent=1, sort_keys=True)
+        return
+
+    service = GenerationService(options.workers, options.root, options.timeout)
+    server = make_server(service, quiet=options.quiet, **address)
+    print "Serving %d workers on %s" % (options.workers,
+        options.socket or "http://%s:%d" % (options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if options.socket is not None and os.path.exists(options.socket):
+            os.unlink(options.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import codecs
+import shutil
+import tempfile
+from Pegasus.DAX3 import ADAG, AbstractJob, Element
+
+__all__ = ["StreamingADAG"]
+
+class StreamingADAG(object):
+    """A write-only ADAG that serializes jobs as the workflow is built.
+
+    Jobs and dependencies are buffered until flush() is called, and are then
+    written to 'filename' and dropped, so memory use depends on the size of a
+    pipeline and not on the size of the workflow. Dependencies are spooled to
+    a temporary file and appended by close(). The output is the same as
+    ADAG.writeXMLFile() would produce, provided that every dependency is
+    added before its child job is flushed.
+    """
+
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.sequence = 1
+        self.jobs = []
+        self.children = {}
+
+        # Let DAX3 write the preamble so that it matches the installed version
+        header = ADAG(name).toXML()
+        footer = "</adag>\n"
+        if not header.endswith(footer):
+            raise Exception("Unexpected DAX preamble")
+
+        self.out = codecs.open(filename, "w", "utf-8")
+        self.out.write(header[:-len(footer)])
+        self.footer = footer
+
+        fd, self.edgefile = tempfile.mkstemp(prefix=".edges-", dir=os.path.dirname(filename))
+        os.close(fd)
+        self.edges = codecs.open(self.edgefile, "w", "utf-8")
+
+    def nextJobID(self):
+        "Get an autogenerated ID for the next job"
+        jobid = "ID%07d" % self.sequence
+        self.sequence += 1
+        return jobid
+
+    def addJob(self, job):
+        "Add a job; it is written out on the next flush()"
+        if job.id is None:
+            job.id = self.nextJobID()
+        self.jobs.append(job)
+
+    def removeJob(self, job):
+        "Remove a job that has not been flushed yet"
+        if job not in self.jobs:
+            raise Exception("Job not found or already flushed: %s" % job.id)
+        self.jobs.remove(job)
+
+    def depends(self, child, parent, edge_label=None):
+        "Add a dependency; 'child' must not have been flushed yet"
+        if isinstance(child, AbstractJob):
+            child = child.id
+        if isinstance(parent, AbstractJob):
+            parent = parent.id
+        parents = self.children.setdefault(child, [])
+        if (parent, edge_label) in parents:
+            raise Exception("Duplicate dependency %s -> %s" % (parent, child))
+        parents.append((parent, edge_label))
+
+    def flush(self):
+        "Write out all the jobs and dependencies added since the last flush"
+        pending = set(job.id for job in self.jobs)
+        for child in self.children:
+            if child not in pending:
+                raise Exception("Dependency added after job was flushed: %s" % child)
+
+        for job in sorted(self.jobs, key=lambda j: j.id):
+            self.out.write("\t")
+            job.toXML().write(stream=self.out, level=1)
+            self.out.write("\n")
+
+        for child in sorted(self.children.keys()):
+            self.edges.write("\t")
+            c = Element("child", [("ref", child)])
+            for parent, edge_label in sorted(self.children[child]):
+                c.element(Element("parent", [("ref", parent), ("edge-label", edge_label)]))
+            c.write(stream=self.edges, level=1)
+            self.edges.write("\n")
+
+        self.jobs = []
+        self.children = {}
+
+    def close(self):
+        "Flush remaining jobs, append the dependencies and finish the file"
+        self.flush()
+        self.edges.close()
+        edges = open(self.edgefile, "rb")
+        try:
+            self.out.flush()
+            shutil.copyfileobj(edges, self.out.stream)
+        finally:
+            edges.close()
+            os.unlink(self.edgefile)
+        self.out.write(self.footer)
+        self.out.close()
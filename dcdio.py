@@ -0,0 +1,170 @@
+import os
+import numpy
+
+__all__ = ["DCDFile", "DCDError", "write_header", "create_dcd"]
+
+# CHARMM/NAMD DCD files are Fortran unformatted files: every record is
+# preceded and followed by its length as a 4-byte integer. The header is an
+# 84-byte record of "CORD" and 20 control integers, a title record and a
+# record with the number of atoms. Each frame is an optional unit cell
+# record of six doubles, then the x, y and z coordinates as three records of
+# 4-byte floats.
+
+# Indexes into the control integers
+NSET = 0
+ISTART = 1
+NSAVC = 2
+NAMNF = 8
+DELTA = 9
+HAS_CELL = 10
+VERSION = 19
+
+class DCDError(Exception):
+    pass
+
+def frame_dtype(natoms, has_cell, order="<"):
+    "Return the numpy record type of a frame"
+    fields = []
+    if has_cell:
+        fields += [("cell_start", order + "i4"), ("cell", order + "f8", (6,)), ("cell_end", order + "i4")]
+    for axis in "xyz":
+        fields += [(axis + "_start", order + "i4"), (axis, order + "f4", (natoms,)), (axis + "_end", order + "i4")]
+    return numpy.dtype(fields)
+
+class DCDFile(object):
+    """A DCD trajectory whose frames are memory-mapped.
+
+    The header is read when the file is opened. The number of frames is
+    taken from the size of the file, as the count in the header is not
+    always updated by the writer. Frames are read with coordinates(), which
+    returns an array of shape (frames, atoms, 3), and cells().
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self.read_header(f)
+        finally:
+            f.close()
+
+        self.dtype = frame_dtype(self.natoms, self.has_cell, self.order)
+        size = os.path.getsize(path) - self.header_size
+        self.nframes = size // self.dtype.itemsize
+        if size % self.dtype.itemsize:
+            raise DCDError("%s: truncated frame after %d frames" % (path, self.nframes))
+        self.frames = numpy.memmap(path, dtype=self.dtype, mode=mode, offset=self.header_size,
+            shape=(self.nframes,)) if self.nframes else numpy.zeros(0, dtype=self.dtype)
+
+    def read_header(self, f):
+        data = f.read(4)
+        for order in ("<", ">"):
+            if numpy.frombuffer(data, dtype=order + "i4")[0] == 84:
+                self.order = order
+                break
+        else:
+            raise DCDError("%s is not a DCD file" % self.path)
+
+        def record(length=None):
+            "Read a record; if 'length' is given its leading length was already read"
+            n = numpy.frombuffer(f.read(4), dtype=self.order + "i4")[0] if length is None else length
+            body = f.read(n)
+            end = numpy.frombuffer(f.read(4), dtype=self.order + "i4")[0]
+            if end != n or len(body) != n:
+                raise DCDError("%s: bad record in header" % self.path)
+            return body
+
+        header = record(84)
+        if header[:4] != b"CORD":
+            raise DCDError("%s is not a coordinate DCD file" % self.path)
+        self.control = numpy.frombuffer(header[4:], dtype=self.order + "i4").copy()
+        if self.control[NAMNF] != 0:
+            raise DCDError("%s has fixed atoms, which are not supported" % self.path)
+        self.delta = numpy.frombuffer(header[4 + 4 * DELTA:8 + 4 * DELTA], dtype=self.order + "f4")[0]
+        self.has_cell = self.control[HAS_CELL] != 0
+
+        title = record()
+        ntitle = numpy.frombuffer(title[:4], dtype=self.order + "i4")[0]
+        self.title = [title[4 + 80 * i:84 + 80 * i] for i in range(ntitle)]
+
+        self.natoms = numpy.frombuffer(record(), dtype=self.order + "i4")[0]
+        self.header_size = f.tell()
+
+    def header(self):
+        "Return the header fields of write_header() that describe this file"
+        return {"control": self.control, "delta": self.delta, "title": self.title,
+            "has_cell": self.has_cell, "order": self.order}
+
+    def coordinates(self, start=0, stop=None, step=1):
+        """Return the coordinates of every 'step'th frame from 'start' to
+        'stop' as a (frames, atoms, 3) float32 array"""
+        block = self.frames[start:stop:step]
+        return numpy.stack([block["x"], block["y"], block["z"]], axis=-1)
+
+    def cells(self, start=0, stop=None, step=1):
+        """Return the unit cells of every 'step'th frame from 'start' to
+        'stop', or None if the file has none"""
+        if not self.has_cell:
+            return None
+        return numpy.array(self.frames[start:stop:step]["cell"])
+
+    def set_frames(self, start, coordinates, cells=None):
+        """Write 'coordinates' (frames, atoms, 3) and 'cells' to the frames
+        from 'start' of a file opened with mode "r+" """
+        n = len(coordinates)
+        block = numpy.zeros(n, dtype=self.dtype)
+        size = 4 * self.natoms
+        for i, axis in enumerate("xyz"):
+            block[axis + "_start"] = size
+            block[axis] = coordinates[:, :, i]
+            block[axis + "_end"] = size
+        if self.has_cell:
+            block["cell_start"] = 48
+            block["cell"] = cells
+            block["cell_end"] = 48
+        self.frames[start:start + n] = block
+
+    def flush(self):
+        if isinstance(self.frames, numpy.memmap):
+            self.frames.flush()
+
+def write_header(f, natoms, nframes, control=None, delta=None, title=(), has_cell=False, order="<"):
+    "Write a DCD header to the file object 'f'"
+    if control is None:
+        control = numpy.zeros(20, dtype=order + "i4")
+        control[ISTART] = 0
+        control[NSAVC] = 1
+        control[VERSION] = 24
+    control = numpy.array(control, dtype=order + "i4")
+    control[NSET] = nframes
+    control[NAMNF] = 0
+    control[HAS_CELL] = 1 if has_cell else 0
+
+    header = numpy.zeros(21, dtype=order + "i4")
+    header[1:] = control
+    raw = bytearray(header.tobytes())
+    raw[:4] = b"CORD"
+    if delta is not None:
+        raw[4 + 4 * DELTA:8 + 4 * DELTA] = numpy.array([delta], dtype=order + "f4").tobytes()
+
+    def record(body):
+        n = numpy.array([len(body)], dtype=order + "i4").tobytes()
+        f.write(n + bytes(body) + n)
+
+    record(raw)
+    lines = [line.ljust(80)[:80] for line in title]
+    record(numpy.array([len(lines)], dtype=order + "i4").tobytes() + b"".join(lines))
+    record(numpy.array([natoms], dtype=order + "i4").tobytes())
+
+def create_dcd(path, natoms, nframes, **header):
+    """Create a DCD file at 'path' for 'nframes' frames of 'natoms' atoms
+    with the 'header' fields of write_header() (e.g. DCDFile.header() of
+    another file), and return it opened for writing with set_frames(). The
+    frames are allocated but not written."""
+    f = open(path, "wb")
+    try:
+        write_header(f, natoms, nframes, **header)
+        f.truncate(f.tell() + nframes * frame_dtype(natoms, header.get("has_cell", False)).itemsize)
+    finally:
+        f.close()
+    return DCDFile(path, mode="r+")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import zlib
+import json
+import struct
+import base64
+import numpy
+from optparse import OptionParser
+from dcdio import DCDFile, create_dcd, NSAVC
+
+__all__ = ["pack", "unpack", "encode_block", "decode_block"]
+
+# A packed trajectory is MAGIC, the length of a JSON header and the header,
+# then chunks of up to 'chunk' frames. Each chunk is its number of frames
+# and the length of its data, followed by the zlib-compressed data: the
+# coordinates, quantized to multiples of 'precision' and stored as the
+# difference from the previous frame (or as float32 if the precision is
+# 0), with the bytes of each value split into planes, then the unit cells.
+MAGIC = b"DCDPACK1"
+CHUNK_HEADER = struct.Struct("<II")
+
+DEFAULT_PRECISION = 0.001
+DEFAULT_CHUNK = 64
+
+def shuffle(values):
+    "Return the bytes of the 4-byte 'values' grouped by byte position, which compresses better"
+    return values.view(numpy.uint8).reshape(-1, 4).T.tobytes()
+
+def unshuffle(data, dtype):
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(4, -1).T.copy().view(dtype).ravel()
+
+def encode_block(coordinates, cells, precision, level=6):
+    "Return the compressed data of a chunk of 'coordinates' (frames, atoms, 3) and 'cells'"
+    if precision:
+        scaled = numpy.round(coordinates / precision)
+        if len(scaled) and numpy.abs(scaled).max() >= 2 ** 31:
+            raise Exception("Coordinates are too large for a precision of %g" % precision)
+        values = scaled.astype("<i4")
+        values[1:] -= values[:-1].copy()
+    else:
+        values = numpy.ascontiguousarray(coordinates, dtype="<f4")
+    data = shuffle(values)
+    if cells is not None:
+        data += numpy.ascontiguousarray(cells, dtype="<f8").tobytes()
+    return zlib.compress(data, level)
+
+def decode_block(data, nframes, natoms, has_cell, precision):
+    "Return the coordinates and cells of a chunk compressed by encode_block()"
+    data = zlib.decompress(data)
+    size = nframes * natoms * 3 * 4
+    if precision:
+        values = unshuffle(data[:size], "<i4").reshape(nframes, natoms, 3)
+        coordinates = (numpy.cumsum(values, axis=0, dtype=numpy.int64) * precision).astype(numpy.float32)
+    else:
+        coordinates = unshuffle(data[:size], "<f4").reshape(nframes, natoms, 3)
+    cells = None
+    if has_cell:
+        cells = numpy.frombuffer(data[size:], dtype="<f8").reshape(nframes, 6)
+    return coordinates, cells
+
+def pack(input, output, precision=DEFAULT_PRECISION, stride=1, chunk=DEFAULT_CHUNK, level=6):
+    """Compress every 'stride'th frame of the DCD 'input' to 'output', 'chunk'
+    frames at a time. Coordinates are rounded to multiples of 'precision'
+    (0 keeps them exactly). Return the number of bytes written."""
+    source = DCDFile(input)
+    header = source.header()
+    control = numpy.array(header["control"])
+    control[NSAVC] *= stride
+    meta = {
+        "natoms": int(source.natoms),
+        "nframes": -(-source.nframes // stride),
+        "precision": precision,
+        "stride": stride,
+        "control": [int(c) for c in control],
+        "delta": float(source.delta),
+        "title": [base64.b64encode(line) for line in header["title"]],
+        "has_cell": bool(source.has_cell),
+        "order": source.order
+    }
+    text = json.dumps(meta, sort_keys=True).encode("ascii")
+
+    f = open(output, "wb")
+    try:
+        f.write(MAGIC + struct.pack("<I", len(text)) + text)
+        step = chunk * stride
+        for start in range(0, source.nframes, step):
+            stop = min(start + step, source.nframes)
+            coordinates = source.coordinates(start, stop, stride)
+            data = encode_block(coordinates, source.cells(start, stop, stride), precision, level)
+            f.write(CHUNK_HEADER.pack(len(coordinates), len(data)) + data)
+        return f.tell()
+    finally:
+        f.close()
+
+def unpack(input, output):
+    "Write the DCD compressed in 'input' to 'output'. Return the number of frames."
+    f = open(input, "rb")
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("%s is not a packed trajectory" % input)
+        length, = struct.unpack("<I", f.read(4))
+        meta = json.loads(f.read(length).decode("ascii"))
+        target = create_dcd(output, meta["natoms"], meta["nframes"], control=meta["control"],
+            delta=meta["delta"], title=[base64.b64decode(line) for line in meta["title"]],
+            has_cell=meta["has_cell"], order=str(meta["order"]))
+        frame = 0
+        while frame < meta["nframes"]:
+            nframes, size = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+            coordinates, cells = decode_block(f.read(size), nframes, meta["natoms"], meta["has_cell"],
+                meta["precision"])
+            target.set_frames(frame, coordinates, cells)
+            frame += nframes
+        target.flush()
+        return frame
+    finally:
+        f.close()
+
+def main():
+    parser = OptionParser(usage="%prog pack [options] DCD PACKED\n       %prog unpack PACKED DCD")
+    parser.add_option("-p", "--precision", action="store", type="float", dest="precision",
+        default=DEFAULT_PRECISION, help="Round coordinates to multiples of this (0: keep them exactly) [default: %default]")
+    parser.add_option("-s", "--stride", action="store", type="int", dest="stride", default=1,
+        help="Keep every STRIDEth frame [default: %default]")
+    parser.add_option("-c", "--chunk", action="store", type="int", dest="chunk", default=DEFAULT_CHUNK,
+        help="Frames compressed at a time [default: %default]")
+    parser.add_option("-l", "--level", action="store", type="int", dest="level", default=6,
+        help="zlib compression level [default: %default]")
+    options, args = parser.parse_args()
+
+    if len(args) != 3 or args[0] not in ("pack", "unpack"):
+        parser.error("Specify pack DCD PACKED or unpack PACKED DCD")
+
+    if args[0] == "pack":
+        size = pack(args[1], args[2], options.precision, options.stride, options.chunk, options.level)
+        print "Packed %s into %d bytes" % (args[1], size)
+    else:
+        frames = unpack(args[1], args[2])
+        print "Unpacked %d frames to %s" % (frames, args[2])
+
+if __name__ == '__main__':
+    main()
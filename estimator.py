@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+import sys
+import ast
+import math
+import heapq
+import numpy
+from optparse import OptionParser
+from ConfigParser import ConfigParser
+from xml.etree import ElementTree
+from sizes import format_bytes
+
+__all__ = ["SimJob", "Estimator", "load_dax", "topological_order", "dcd_size", "dcdpack_size", "fqt_size",
+    "rms_size"]
+
+DAX_NAMESPACE = "{http://pegasus.isi.edu/schema/DAX}"
+
+def dcd_size(natoms, frames):
+    """Return the size in bytes of a DCD trajectory with unit cell records.
+    The header is 276 bytes, and each frame is a 56 byte unit cell record
+    and three Fortran records of 4-byte coordinates."""
+    return 276 + frames * (56 + 3 * (4 * natoms + 8))
+
+# The typical displacement of an atom between two saved frames, in
+# angstroms, which sets how many bits dcdpack.py needs for each quantized
+# coordinate difference
+FRAME_DISPLACEMENT = 0.5
+
+def dcdpack_size(natoms, frames, precision, displacement=FRAME_DISPLACEMENT):
+    """Return the approximate size in bytes of a trajectory packed by
+    dcdpack.py at 'precision'. Each coordinate difference takes about the
+    entropy of a normal distribution of width 'displacement' quantized to
+    'precision', plus 0.4 bytes of zlib and byte plane overhead (measured
+    on random walks); unquantized float32 coordinates barely compress."""
+    if precision > 0:
+        per_value = min(4.0, (math.log(displacement / precision, 2) + 2.05) / 8 + 0.4)
+    else:
+        per_value = 3.2
+    return 300 + int(frames * (3 * natoms * per_value + 48))
+
+def fqt_size(qvectors, frames):
+    """Return the approximate size in bytes of a sassena signal file with
+    fqt, fq0, fq and fq2 (complex doubles) for 'qvectors' q vectors"""
+    return qvectors * (16 * frames + 3 * 16 + 3 * 8)
+
+def rms_size(frames):
+    """Return the approximate size in bytes of a cpptraj RMSD data file: a
+    header line and a line with the frame number and RMSD for each frame"""
+    return 24 + 22 * frames
+
+class SimJob(object):
+    "A job (or a cluster of jobs) of a DAX as seen by the estimator"
+
+    def __init__(self, id, name, label, cores, walltime):
+        self.id = id
+        self.name = name
+        self.label = label
+        self.cores = cores
+        self.walltime = walltime
+        self.parents = set()
+        self.children = set()
+        self.profiles = {}
+        self.arguments = []
+        self.uses = []
+        self.members = 1
+
+def parse_arguments(elem):
+    "Return the words of a DAX <argument> element, with <file> elements replaced by their names"
+    if elem is None:
+        return []
+    text = [elem.text or ""]
+    for child in elem:
+        text.append(" %s " % child.get("name"))
+        text.append(child.tail or "")
+    return "".join(text).split()
+
+def load_dax(path):
+    "Return the jobs of the DAX in 'path' as a list of SimJob objects, in document order"
+    jobs = []
+    byid = {}
+    child = None
+    for event, elem in ElementTree.iterparse(path, events=("start", "end")):
+        tag = elem.tag[len(DAX_NAMESPACE):]
+        if event == "start":
+            if tag == "child":
+                child = byid[elem.get("ref")]
+            elif tag == "parent":
+                parent = byid[elem.get("ref")]
+                child.parents.add(parent)
+                parent.children.add(child)
+            continue
+        if tag == "job":
+            profiles = {}
+            for p in elem.findall(DAX_NAMESPACE + "profile"):
+                profiles[(p.get("namespace"), p.get("key"))] = p.text
+            name = elem.get("name")
+            if elem.get("namespace"):
+                name = "%s::%s" % (elem.get("namespace"), name)
+            job = SimJob(elem.get("id"), name, elem.get("node-label") or elem.get("id"),
+                int(profiles.get(("globus", "count"), "1")),
+                float(profiles.get(("globus", "maxwalltime"), "0")))
+            job.profiles = profiles
+            job.arguments = parse_arguments(elem.find(DAX_NAMESPACE + "argument"))
+            job.uses = [(u.get("file") or u.get("name"), u.get("link"))
+                for u in elem.findall(DAX_NAMESPACE + "uses")]
+            jobs.append(job)
+            byid[job.id] = job
+            elem.clear()
+    return jobs
+
+def merge_jobs(jobs, name, members):
+    "Replace 'members' in the graph of 'jobs' by a single clustered job"
+    first = members[0]
+    cluster = SimJob(first.id, first.name, name,
+        max(m.cores for m in members), max(m.walltime for m in members))
+    cluster.members = sum(m.members for m in members)
+    memberset = set(members)
+    for m in members:
+        for p in m.parents - memberset:
+            p.children.discard(m)
+            p.children.add(cluster)
+            cluster.parents.add(p)
+        for c in m.children - memberset:
+            c.parents.discard(m)
+            c.parents.add(cluster)
+            cluster.children.add(c)
+    return cluster
+
+def depths(jobs):
+    "Return {job: depth} where root jobs have depth 0"
+    result = {}
+    for job in topological_order(jobs):
+        result[job] = max([result[p] + 1 for p in job.parents] or [0])
+    return result
+
+def topological_order(jobs):
+    remaining = dict((job, len(job.parents)) for job in jobs)
+    order = [job for job in jobs if not job.parents]
+    i = 0
+    while i < len(order):
+        for c in sorted(order[i].children, key=lambda j: j.id):
+            remaining[c] -= 1
+            if remaining[c] == 0:
+                order.append(c)
+        i += 1
+    if len(order) != len(jobs):
+        raise Exception("The workflow has a cycle")
+    return order
+
+def apply_clustering(jobs):
+    """Merge the jobs that pegasus-plan --cluster would bundle: jobs with the
+    same pegasus label profile, and runs of up to clusters.size jobs of the
+    same transformation at the same depth"""
+    groups = {}
+    level = None
+    for job in jobs:
+        label = job.profiles.get(("pegasus", "label"))
+        size = job.profiles.get(("pegasus", "clusters.size"))
+        if label is not None:
+            groups.setdefault(("label", label), []).append(job)
+        elif size is not None:
+            if level is None:
+                level = depths(jobs)
+            groups.setdefault(("horizontal", job.name, level[job], int(size)), []).append(job)
+
+    clustered = set()
+    result = []
+    for key, members in sorted(groups.items()):
+        if key[0] == "label":
+            chunks = [members]
+        else:
+            size = key[3]
+            chunks = [members[i:i + size] for i in range(0, len(members), size)]
+        for n, chunk in enumerate(chunks):
+            clustered.update(chunk)
+            result.append(merge_jobs(jobs, "%s_%s" % (key[1], n) if key[0] != "label" else key[1], chunk))
+    return [job for job in jobs if job not in clustered] + result
+
+class Estimator(object):
+    """Discrete-event simulation of a workflow on a batch system.
+
+    The machine has 'nodes' nodes of 'cores_per_node' cores (0 nodes means
+    as many as needed), and jobs do not share nodes. A job is submitted when
+    its parents finish, waits in the queue for a time drawn from
+    'queue_wait' (minutes, as a numpy.random distribution in the format of
+    the keg sections), then starts as soon as enough nodes are free, and
+    runs for 'runtime_fraction' of its maxwalltime.
+    """
+
+    def __init__(self, config, section="estimate"):
+        def get(name, default):
+            if config.has_option(section, name):
+                return config.get(section, name)
+            if config.has_option("simulation", name):
+                return config.get("simulation", name)
+            return default
+        self.nodes = int(get("nodes", "0"))
+        self.cores_per_node = int(get("cores_per_node", "24"))
+        self.runtime_fraction = float(get("runtime_fraction", "1.0"))
+        self.queue_wait = None
+        if config.has_option(section, "queue_wait"):
+            self.queue_wait = ast.literal_eval(config.get(section, "queue_wait"))
+        self.trials = int(get("trials", "10" if self.queue_wait else "1"))
+        seed = get("seed", None)
+        self.random = numpy.random.RandomState(None if seed is None else int(seed))
+
+    def runtime(self, job):
+        return job.walltime * self.runtime_fraction
+
+    def nodes_for(self, job):
+        return max(1, -(-job.cores // self.cores_per_node))
+
+    def wait(self, count):
+        "Draw 'count' queue waits in minutes"
+        if self.queue_wait is None:
+            return numpy.zeros(count)
+        distribution = getattr(self.random, self.queue_wait["distribution"])
+        return numpy.maximum(0, distribution(*self.queue_wait["dist_params"], size=count))
+
+    def critical_path(self, jobs):
+        "Return the length in minutes and the jobs of the longest chain of runtimes"
+        finish = {}
+        via = {}
+        for job in topological_order(jobs):
+            parent = max(job.parents, key=lambda p: finish[p]) if job.parents else None
+            finish[job] = (finish[parent] if parent else 0) + self.runtime(job)
+            via[job] = parent
+        job = max(jobs, key=lambda j: finish[j])
+        length = finish[job]
+        path = []
+        while job is not None:
+            path.append(job)
+            job = via[job]
+        return length, path[::-1]
+
+    def simulate(self, jobs):
+        """Run the workflow once and return (makespan, peak cores, core-hours
+        charged for whole nodes)"""
+        free = self.nodes
+        waits = self.wait(len(jobs))
+        index = dict((job, i) for i, job in enumerate(jobs))
+        remaining = dict((job, len(job.parents)) for job in jobs)
+        events = []
+        queue = []
+        for job in jobs:
+            if not job.parents:
+                heapq.heappush(events, (waits[index[job]], 1, index[job]))
+
+        now = 0.0
+        cores = 0
+        peak = 0
+        charged = 0.0
+        while events:
+            now = events[0][0]
+            while events and events[0][0] == now:
+                t, kind, i = heapq.heappop(events)
+                job = jobs[i]
+                if kind == 0:
+                    free += self.nodes_for(job)
+                    cores -= job.cores
+                    for c in job.children:
+                        remaining[c] -= 1
+                        if remaining[c] == 0:
+                            heapq.heappush(events, (now + waits[index[c]], 1, index[c]))
+                else:
+                    queue.append(job)
+
+            # Start every queued job that fits, oldest first (backfilling)
+            waiting = []
+            for job in queue:
+                n = self.nodes_for(job)
+                if self.nodes and n > self.nodes:
+                    raise Exception("Job %s needs %d nodes but the machine has %d" % (job.label, n, self.nodes))
+                if self.nodes and n > free:
+                    waiting.append(job)
+                    continue
+                free -= n
+                cores += job.cores
+                runtime = self.runtime(job)
+                charged += n * self.cores_per_node * runtime / 60.0
+                heapq.heappush(events, (now + runtime, 0, index[job]))
+            queue = waiting
+            peak = max(peak, cores)
+
+        return now, peak, charged
+
+    def estimate(self, daxfile):
+        """Simulate the workflow in 'daxfile' 'trials' times and return a dict
+        with the results"""
+        jobs = apply_clustering(load_dax(daxfile))
+        length, path = self.critical_path(jobs)
+        makespans = []
+        peaks = []
+        charges = []
+        for trial in range(self.trials):
+            makespan, peak, charged = self.simulate(jobs)
+            makespans.append(makespan)
+            peaks.append(peak)
+            charges.append(charged)
+        return {
+            "jobs": len(jobs),
+            "makespan": makespans,
+            "peak_cores": max(peaks),
+            "core_hours": numpy.mean(charges),
+            "critical_path": (length, path)
+        }
+
+    def report(self, daxfile, volumes=(), out=sys.stdout):
+        "Print the estimate for 'daxfile' and the expected output data 'volumes'"
+        result = self.estimate(daxfile)
+        length, path = result["critical_path"]
+        makespans = result["makespan"]
+        machine = "%d nodes" % self.nodes if self.nodes else "unlimited nodes"
+        print >>out, "Estimate: %d jobs on %s of %d cores, %d trial(s)" % (
+            result["jobs"], machine, self.cores_per_node, self.trials)
+        if len(makespans) > 1:
+            print >>out, "  Makespan:        %.1f h (min %.1f h, max %.1f h)" % (
+                numpy.mean(makespans) / 60, min(makespans) / 60, max(makespans) / 60)
+        else:
+            print >>out, "  Makespan:        %.1f h" % (makespans[0] / 60)
+        print >>out, "  Critical path:   %.1f h of runtime over %d jobs: %s" % (
+            length / 60, len(path), " -> ".join(job.label for job in path))
+        print >>out, "  Peak cores:      %d" % result["peak_cores"]
+        print >>out, "  Core-hours:      %.0f (charged for whole nodes)" % result["core_hours"]
+        for description, count, size in volumes:
+            print >>out, "  %-16s %s in %d files" % (description + ":", format_bytes(size), count)
+        return result
+
+def main():
+    parser = OptionParser(usage="%prog [options] CONFIGFILE DAXFILE")
+    parser.add_option("-n", "--nodes", action="store", type="int", dest="nodes", default=None,
+        help="Number of nodes available to the workflow (overrides the config file)")
+    options, args = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("Specify CONFIGFILE and DAXFILE")
+
+    config = ConfigParser()
+    config.read(args[0])
+    estimator = Estimator(config)
+    if options.nodes is not None:
+        estimator.nodes = options.nodes
+    estimator.report(args[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+import numpy
+from optparse import OptionParser
+
+__all__ = ["read_index", "write_index", "write_store", "read_parameters", "read_q"]
+
+# The sassena signals of a sweep, in one HDF5 file:
+#
+#   parameters/<name>   the value of each sweep dimension at each point (P)
+#   parameters/tag      the tag of each point (P)
+#   <kind>/qvectors     the q vectors of the scan (Q x 3)
+#   <kind>/<dataset>    each dataset of the signal files with the sweep point
+#                       as the second axis (Q x P x ...), in chunks of one q
+#                       vector and up to 'chunk' points, so that reading a q
+#                       vector for the whole sweep reads a few whole chunks
+#   <kind>/length       the length of the time axis of each point (P), when
+#                       the points have different numbers of frames; shorter
+#                       signals are padded with NaN
+#
+# where <kind> is incoherent or coherent.
+KINDS = ["incoherent", "coherent"]
+DEFAULT_CHUNK = 64
+
+def read_index(path):
+    """Read the point index written by write_index(). Return the names of
+    the sweep dimensions and a list of (tag, {dimension: value}, {kind:
+    signal file}) for each point."""
+    f = open(path)
+    try:
+        columns = f.readline().rstrip("\n").split("\t")
+        if columns[0] != "tag":
+            raise Exception("%s is not a point index" % path)
+        dimensions = [c for c in columns[1:] if c not in KINDS]
+        points = []
+        for line in f:
+            fields = dict(zip(columns, line.rstrip("\n").split("\t")))
+            points.append((fields["tag"], dict((d, fields[d]) for d in dimensions),
+                dict((k, fields[k]) for k in KINDS if fields.get(k))))
+        return dimensions, points
+    finally:
+        f.close()
+
+def write_index(dimensions, points):
+    """Return the text of a point index for 'points', a list of (tag,
+    {dimension: value}, {kind: signal file})"""
+    kinds = [k for k in KINDS if any(k in files for tag, values, files in points)]
+    lines = ["\t".join(["tag"] + dimensions + kinds)]
+    for tag, values, files in points:
+        lines.append("\t".join([tag] + [str(values[d]) for d in dimensions] + [files.get(k, "") for k in kinds]))
+    return "\n".join(lines) + "\n"
+
+def signal_shapes(paths):
+    "Return the shape of each dataset of the signal files 'paths' and the q vectors they share"
+    import h5py
+    shapes = {}
+    qvectors = None
+    for path in paths:
+        f = h5py.File(path, "r")
+        try:
+            if qvectors is None:
+                qvectors = f["qvectors"][...]
+            elif not numpy.array_equal(f["qvectors"][...], qvectors):
+                raise Exception("%s does not have the q vectors of %s" % (path, paths[0]))
+            for name in f:
+                if name != "qvectors":
+                    shapes.setdefault(name, []).append(f[name].shape)
+        finally:
+            f.close()
+    return shapes, qvectors
+
+def write_store(output, dimensions, points, chunk=DEFAULT_CHUNK, level=4):
+    """Write the signal files of 'points' (see read_index()) to the store
+    'output'. The files are read 'chunk' points at a time, so that each
+    chunk of the store is compressed and written once."""
+    import h5py
+    out = h5py.File(output, "w")
+    try:
+        group = out.create_group("parameters")
+        for name in dimensions:
+            group.create_dataset(name, data=numpy.array([float(values[name]) for tag, values, files in points]))
+        group.create_dataset("tag", data=numpy.array([tag for tag, values, files in points], dtype="S"))
+        out.attrs["points"] = len(points)
+
+        for kind in KINDS:
+            paths = [files.get(kind) for tag, values, files in points]
+            if not any(paths):
+                continue
+            if not all(paths):
+                raise Exception("Some points have no %s signal" % kind)
+            write_kind(out.create_group(kind), paths, chunk, level)
+    finally:
+        out.close()
+
+def write_kind(group, paths, chunk, level):
+    import h5py
+    shapes, qvectors = signal_shapes(paths)
+    group.create_dataset("qvectors", data=qvectors)
+    n = len(paths)
+    block = max(1, min(chunk, n))
+
+    datasets = {}
+    for name, sizes in sorted(shapes.items()):
+        if len(sizes) != n or len(set(len(s) for s in sizes)) != 1 or len(set(s[0] for s in sizes)) != 1:
+            raise Exception("The %s datasets of the signal files do not match" % name)
+        shape = tuple(max(s[i] for s in sizes) for i in range(len(sizes[0])))
+        lengths = [s[1] for s in sizes] if len(shape) > 1 else []
+        if len(set(lengths)) > 1:
+            if name == "fqt":
+                group.create_dataset("length", data=numpy.array(lengths))
+            fill = numpy.nan
+        else:
+            fill = 0
+        datasets[name] = group.create_dataset(name, shape=(shape[0], n) + shape[1:], dtype="f8",
+            chunks=(1, block) + shape[1:], compression="gzip", compression_opts=level, shuffle=True,
+            fillvalue=fill)
+
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        data = dict((name, numpy.empty((dataset.shape[0], stop - start) + dataset.shape[2:]))
+            for name, dataset in datasets.items())
+        for i, path in enumerate(paths[start:stop]):
+            f = h5py.File(path, "r")
+            try:
+                for name, buf in data.items():
+                    values = f[name][...]
+                    buf[:, i] = datasets[name].fillvalue
+                    buf[(slice(None), i) + tuple(slice(0, s) for s in values.shape[1:])] = values
+            finally:
+                f.close()
+        for name, buf in data.items():
+            datasets[name][:, start:stop] = buf
+
+def read_parameters(path):
+    "Return the sweep parameters of the store 'path' as {name: array}"
+    import h5py
+    f = h5py.File(path, "r")
+    try:
+        return dict((name, f["parameters"][name][...]) for name in f["parameters"])
+    finally:
+        f.close()
+
+def read_q(path, kind, q, dataset="fqt"):
+    """Return 'dataset' of the q vector(s) 'q' (an index or a slice) for
+    every sweep point in the store 'path'. For an index the first axis is
+    the sweep point."""
+    import h5py
+    f = h5py.File(path, "r")
+    try:
+        return f[kind][dataset][q]
+    finally:
+        f.close()
+
+def main():
+    parser = OptionParser(usage="%prog [options] -o STORE INDEX")
+    parser.add_option("-o", "--output", action="store", dest="output", default=None,
+        help="HDF5 store to write")
+    parser.add_option("-c", "--chunk", action="store", type="int", dest="chunk", default=DEFAULT_CHUNK,
+        help="Sweep points per chunk [default: %default]")
+    parser.add_option("-l", "--level", action="store", type="int", dest="level", default=4,
+        help="gzip compression level [default: %default]")
+    options, args = parser.parse_args()
+
+    if options.output is None or len(args) != 1:
+        parser.error("Specify STORE and INDEX")
+
+    dimensions, points = read_index(args[0])
+    write_store(options.output, dimensions, points, options.chunk, options.level)
+    print "Stored %d points in %s" % (len(points), options.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import json
+import mmap
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+__all__ = ["hash_file", "HashCache"]
+
+# Hashed in blocks of this size; hashlib releases the GIL while it hashes a
+# block, so files can be hashed in threads
+BLOCK_SIZE = 1 << 24
+
+def hash_file(path, blocksize=BLOCK_SIZE):
+    "Return the SHA-256 hex digest of the file 'path', read through mmap"
+    h = hashlib.sha256()
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, blocksize):
+                    h.update(buffer(m, offset, blocksize))
+            finally:
+                m.close()
+    finally:
+        f.close()
+    return h.hexdigest()
+
+class HashCache(object):
+    """The size and SHA-256 digest of files, cached in a JSON file by path,
+    modification time and size so that unchanged files are not hashed
+    again. Missing entries are computed by a pool of 'threads' threads."""
+
+    def __init__(self, path, threads=4):
+        self.path = path
+        self.threads = threads
+        self.entries = {}
+        self.changed = False
+        if os.path.isfile(path):
+            f = open(path)
+            try:
+                self.entries = json.load(f)
+            finally:
+                f.close()
+
+    def stat(self, path):
+        "Return the cache key of 'path': its real path, mtime and size"
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return path, st.st_mtime, st.st_size
+
+    def lookup(self, paths, known=None):
+        """Return {path: (size, digest)} for the files 'paths'. The files in
+        'known' ({path: digest}) are only stat'ed; the others are hashed if
+        they are not in the cache or have changed."""
+        known = known or {}
+        stats = map(self.stat, paths)
+        missing = sorted(set(s for p, s in zip(paths, stats) if p not in known and not self.valid(s)))
+        digests = self.map(hash_file, [s[0] for s in missing])
+
+        for (path, mtime, size), digest in zip(missing, digests):
+            self.entries[path] = [mtime, size, digest]
+            self.changed = True
+        return dict((p, (s[2], known[p] if p in known else self.entries[s[0]][2])) for p, s in zip(paths, stats))
+
+    def map(self, function, items):
+        "Apply 'function' to 'items' in a pool of threads, or directly if there are few of them"
+        if self.threads <= 1 or len(items) <= 1:
+            return map(function, items)
+        pool = ThreadPool(min(self.threads, len(items)))
+        try:
+            results = pool.map(function, items)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    def valid(self, stat):
+        "Return whether the cache entry of a file with the key 'stat' is up to date"
+        entry = self.entries.get(stat[0])
+        return entry is not None and entry[0] == stat[1] and entry[1] == stat[2]
+
+    def digest(self, path):
+        "Return the digest of the file 'path'"
+        return self.lookup([path])[path][1]
+
+    def save(self):
+        "Write the cache if it has new entries"
+        if not self.changed:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        f = open(tmp, "w")
+        try:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+        self.changed = False
@@ -0,0 +1,193 @@
+import os
+import re
+import math
+import numpy
+from xml.etree import ElementTree
+
+__all__ = ["RuntimeModel", "JobSizer", "load_history"]
+
+DAX_NAMESPACE = "{http://pegasus.isi.edu/schema/DAX}"
+
+JOBID_RE = re.compile(r"(ID\d{7})")
+INVOCATION_RE = re.compile(r"<invocation\b([^>]*)>(.*?)</invocation>", re.S)
+MAINJOB_RE = re.compile(r"<mainjob\b([^>]*)>(.*?)</mainjob>", re.S)
+STATUS_RE = re.compile(r'<status\b[^>]*\braw="(-?\d+)"')
+ATTR_RE = re.compile(r'([\w:.-]+)="([^"]*)"')
+
+class RuntimeModel(object):
+    """Runtime of one stage as 'intercept + slope * work / cores' seconds.
+
+    'observations' is a list of (work, cores, seconds) from past runs. With
+    a single distinct value of work/cores the intercept is taken to be zero.
+    """
+
+    def __init__(self, stage, observations):
+        self.stage = stage
+        self.count = len(observations)
+        x = numpy.array([float(w) / c for w, c, s in observations])
+        y = numpy.array([float(s) for w, c, s in observations])
+
+        if len(numpy.unique(x)) > 1:
+            self.slope, self.intercept = numpy.polyfit(x, y, 1)
+        else:
+            self.slope, self.intercept = y.mean() / x.mean(), 0.0
+
+        # A fit dominated by noise can come out with a negative slope; then
+        # the best we can say is that the runtime does not depend on size
+        if self.slope < 0:
+            self.slope, self.intercept = 0.0, y.max()
+
+        predicted = self.intercept + self.slope * x
+        self.max_error = float(numpy.max(y - predicted)) if self.count else 0.0
+
+    def predict(self, work, cores):
+        "Return the predicted runtime in seconds"
+        return self.intercept + self.slope * float(work) / cores
+
+    def __str__(self):
+        return "%-12s %4d runs  runtime = %.1f + %.3g * work/cores s" % (
+            self.stage, self.count, self.intercept, self.slope)
+
+def parse_dax_jobs(daxfile):
+    "Return {job id: (stage, work, cores)} for the jobs of 'daxfile' that carry sizing metadata"
+    jobs = {}
+    for event, elem in ElementTree.iterparse(daxfile):
+        if elem.tag != DAX_NAMESPACE + "job":
+            continue
+        metadata = {}
+        cores = None
+        for child in elem:
+            if child.tag == DAX_NAMESPACE + "metadata":
+                metadata[child.get("key")] = child.text
+            elif child.tag == DAX_NAMESPACE + "profile":
+                if child.get("namespace") == "globus" and child.get("key") == "count":
+                    cores = int(child.text)
+        if "sns.stage" in metadata and "sns.work" in metadata and cores:
+            jobs[elem.get("id")] = (metadata["sns.stage"], int(metadata["sns.work"]), cores)
+        elem.clear()
+    return jobs
+
+def parse_kickstart(path):
+    "Return the runtime in seconds of the last successful invocation recorded in 'path', or None"
+    f = open(path)
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    runtime = None
+    for attrs, body in INVOCATION_RE.findall(text):
+        mainjob = MAINJOB_RE.search(body)
+        if mainjob is None:
+            continue
+        status = STATUS_RE.search(mainjob.group(2))
+        if status is None or status.group(1) != "0":
+            continue
+        duration = dict(ATTR_RE.findall(mainjob.group(1))).get("duration")
+        if duration is not None:
+            runtime = float(duration)
+    return runtime
+
+def parse_jobstate(path):
+    "Return {job id: runtime} for the jobs that succeeded according to a jobstate.log"
+    started = {}
+    finished = {}
+    succeeded = set()
+    f = open(path)
+    try:
+        for line in f:
+            cols = line.split()
+            if len(cols) < 3:
+                continue
+            m = JOBID_RE.search(cols[1])
+            if m is None:
+                continue
+            jobid = m.group(1)
+            if cols[2] == "EXECUTE":
+                started[jobid] = float(cols[0])
+            elif cols[2] == "JOB_TERMINATED":
+                finished[jobid] = float(cols[0])
+            elif cols[2] in ("JOB_SUCCESS", "POST_SCRIPT_SUCCESS"):
+                succeeded.add(jobid)
+    finally:
+        f.close()
+    return dict((j, finished[j] - started[j]) for j in succeeded
+        if j in started and j in finished)
+
+def load_history(history_dir):
+    """Collect {stage: [(work, cores, seconds), ...]} from the workflow
+    directories under 'history_dir'. Each directory containing a dax.xml is
+    a past run; its kickstart records (*.out, *.out.NNN) and jobstate.log
+    files are searched for below that directory and matched to the DAX jobs
+    by job ID."""
+    observations = {}
+    for root, dirs, files in os.walk(history_dir):
+        if "dax.xml" not in files:
+            continue
+        jobs = parse_dax_jobs(os.path.join(root, "dax.xml"))
+        runtimes = {}
+        jobstate = {}
+        for subroot, subdirs, subfiles in os.walk(root):
+            for name in subfiles:
+                path = os.path.join(subroot, name)
+                if name == "jobstate.log":
+                    jobstate.update(parse_jobstate(path))
+                elif re.search(r"\.out(\.\d+)?$", name):
+                    m = JOBID_RE.search(name)
+                    if m is None or m.group(1) not in jobs:
+                        continue
+                    runtime = parse_kickstart(path)
+                    if runtime is not None:
+                        runtimes[m.group(1)] = runtime
+        for jobid, runtime in jobstate.items():
+            runtimes.setdefault(jobid, runtime)
+        for jobid, runtime in runtimes.items():
+            if jobid in jobs:
+                stage, work, cores = jobs[jobid]
+                observations.setdefault(stage, []).append((work, cores, runtime))
+        # The submit directory of a run is below its dax.xml
+        dirs[:] = []
+    return observations
+
+class JobSizer(object):
+    """Chooses maxwalltime and count for jobs from runtime models.
+
+    The predicted runtime is padded by 'margin' (a fraction). For MPI jobs,
+    if the padded runtime exceeds 'max_walltime' minutes, the core count is
+    raised a node ('cores_per_node') at a time, up to 'max_cores'.
+    """
+
+    def __init__(self, models, margin=0.25, max_walltime=None, cores_per_node=24, max_cores=None):
+        self.models = models
+        self.margin = margin
+        self.max_walltime = max_walltime
+        self.cores_per_node = cores_per_node
+        self.max_cores = max_cores
+
+    @classmethod
+    def from_history(cls, history_dir, **kwargs):
+        observations = load_history(history_dir)
+        models = dict((stage, RuntimeModel(stage, obs)) for stage, obs in observations.items())
+        return cls(models, **kwargs)
+
+    def minutes(self, model, work, cores):
+        seconds = model.predict(work, cores) * (1 + self.margin)
+        return max(1, int(math.ceil(seconds / 60.0)))
+
+    def size(self, stage, work, walltime, cores, scalable=True):
+        """Return (maxwalltime, count) as strings for a job of 'stage' doing
+        'work', or the configured 'walltime' and 'cores' if there is no model"""
+        model = self.models.get(stage)
+        if model is None or work is None:
+            return walltime, cores
+
+        cores = int(cores)
+        minutes = self.minutes(model, work, cores)
+        # More cores cannot bring the walltime below the fixed part of the runtime
+        if scalable and self.max_walltime and self.minutes(model, 0, 1) > self.max_walltime:
+            scalable = False
+        while scalable and self.max_walltime and minutes > self.max_walltime:
+            if self.max_cores and cores + self.cores_per_node > self.max_cores:
+                break
+            cores += self.cores_per_node
+            minutes = self.minutes(model, work, cores)
+        return str(minutes), str(cores)
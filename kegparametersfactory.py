@@ -1,8 +1,52 @@
-import numpy
+import os
 import ast
+import struct
+import hashlib
+import numpy
 from Pegasus.DAX3 import *
-
-__ALL__ = ["KegParametersFactory"]
+from profiling import PROFILE
+from sizes import SIZE_UNITS
+
+__ALL__ = ["KegParametersFactory", "KegDistribution"]
+
+def stream_seed(seed, section, option):
+	"Return the RandomState seed of the stream for 'option' in 'section'"
+	key = hashlib.sha256("%d\0%s\0%s" % (seed, section, option)).digest()
+	return numpy.frombuffer(key, dtype=numpy.uint32)
+
+class KegDistribution:
+	"""A distribution from a keg section of the config file, parsed once.
+
+	Values are drawn in vectorized batches from a RandomState of its own, and
+	value i is always the i-th draw of that stream, so the value a job gets
+	depends only on the seed, the (section, option) and the job's index. It
+	keeps no other state, so factories for the same config and seed can share
+	it.
+	"""
+
+	def __init__(self, params, seed):
+		self.distribution = params['distribution']
+		self.dist_params = tuple(params['dist_params'])
+		self.size_unit = params.get('size_unit', '')
+		self.random = numpy.random.RandomState(seed)
+		self.sample = getattr(self.random, self.distribution)
+		self.values = numpy.empty(0, dtype=numpy.int64)
+
+	@PROFILE.timed("keg:draw")
+	def draw(self, count):
+		"Make sure that at least 'count' values have been drawn"
+		if count > len(self.values):
+			batch = self.sample(*self.dist_params, size=count - len(self.values))
+			self.values = numpy.concatenate((self.values, numpy.round(batch).astype(numpy.int64)))
+
+	def value(self, index, scale=1.0):
+		"""Return value 'index' multiplied by 'scale' (e.g. the share of a
+		job's work done by one of its segments)"""
+		if index >= len(self.values):
+			self.draw(max(index + 1, 2 * len(self.values)))
+		if scale != 1.0:
+			return int(round(self.values[index] * scale))
+		return int(self.values[index])
 
 class KegParametersFactory:
 	keg_parameters = {
@@ -11,36 +55,75 @@ class KegParametersFactory:
 		"memory": "-m"
 	}
 
-	def __init__(self, config):
+	def __init__(self, config, seed=None, size=1, distributions=None):
+		"""Read the keg-* sections of 'config'. 'seed' makes the drawn values
+		reproducible; without it a random seed is chosen (see self.seed). 'size'
+		is the number of values drawn up front for each parameter, normally the
+		number of sweep points. 'distributions' is a dict that keeps the parsed
+		distributions, which may be shared with other factories for the same
+		keg sections and seed."""
 		self.config = config
-		numpy.random.seed()
-
-	def output_file(self, task, filename, file_real_path=""):
+		if seed is None:
+			seed = struct.unpack("<I", os.urandom(4))[0]
+		self.seed = seed
+		self.size = size
+		if distributions is None:
+			distributions = {}
+		self.distributions = distributions
+		# The next value of each distribution for jobs without an index
+		self.next = {}
+
+	def distribution(self, section, option):
+		"""Return the KegDistribution of 'option' in 'section', or None if it is
+		not a distribution. Options are parsed when they are first used, so an
+		option that no job uses is never parsed."""
+		key = (section, option)
+		if key not in self.distributions:
+			with PROFILE.phase("keg:compile"):
+				dist = None
+				if option != "other_params" and self.config.has_option(section, option):
+					params = ast.literal_eval(self.config.get(section, option))
+					if isinstance(params, dict) and 'distribution' in params:
+						dist = KegDistribution(params, stream_seed(self.seed, section, option))
+						dist.draw(self.size)
+				self.distributions[key] = dist
+		return self.distributions[key]
+
+	def value(self, section, option, index=None, scale=1.0):
+		"""Return value 'index' of the distribution of 'option' in 'section', or
+		the next unused value if 'index' is None, multiplied by 'scale'. Return
+		None if the option is not a distribution."""
+		dist = self.distribution(section, option)
+		if dist is None:
+			return None
+		if index is None:
+			index = self.next.get((section, option), 0)
+			self.next[(section, option)] = index + 1
+		return dist.value(index, scale)
+
+	@PROFILE.timed("keg:output_file")
+	def output_file(self, task, filename, file_real_path="", index=None, scale=1.0):
 		if not file_real_path:
 			file_real_path = filename
 
-		if not self.config.has_option("keg-%s" % task, filename):
+		filesize = self.value("keg-%s" % task, filename, index, scale)
+		if filesize is None:
 			# print "We have not found option ", "keg-%s" % task, filename
 			return "-o {0}".format(file_real_path)
 
-		output_params = ast.literal_eval(self.config.get("keg-%s" % task, filename))
-		distribution = getattr(numpy.random, output_params['distribution'])
-		random_value = int(round( distribution(*output_params['dist_params']) ))
-
-		return "-o {filename}={filesize}{size_unit}".format(filename=file_real_path, filesize=random_value, 
-			size_unit=output_params['size_unit'])
+		return "-o {filename}={filesize}{size_unit}".format(filename=file_real_path, filesize=filesize, 
+			size_unit=self.distribution("keg-%s" % task, filename).size_unit)
 
+	@PROFILE.timed("keg:generate_input_file")
 	def generate_input_file(self, file_label, filepath):
-		if self.config.has_option("keg-input-files", file_label):
-			input_file_params = ast.literal_eval(self.config.get("keg-input-files", file_label))
-			distribution = getattr(numpy.random, input_file_params['distribution'])
-			random_size = int(round( distribution(*input_file_params['dist_params']) )) 
-			size_units = { "B": 1, "K": 1024, "M": 1024*1024, "G": 1024*1024*1024  }
+		dist = self.distribution("keg-input-files", file_label)
+		if dist is not None:
+			random_size = dist.value(0)
 
 			print "Writing file with random size ", filepath
 
 			f = open(filepath,"wb")
-			f.seek(random_size * size_units[input_file_params['size_unit']] - 1)
+			f.seek(random_size * SIZE_UNITS[dist.size_unit] - 1)
 			f.write("\0")
 			f.close()
 		else:
@@ -51,26 +134,27 @@ class KegParametersFactory:
 			f.write("\0")
 			f.close()
 
-	def performance_attr(self, task, param):
-		if not self.config.has_option("keg-%s" % task, param):
+	@PROFILE.timed("keg:performance_attr")
+	def performance_attr(self, task, param, index=None, scale=1.0):
+		value = self.value("keg-%s" % task, param, index, scale)
+		if value is None:
 			return ""
 
-		param_dict = ast.literal_eval(self.config.get("keg-%s" % task, param))
-		param_value = int(round( getattr(numpy.random, param_dict['distribution'])(*param_dict['dist_params']) ))
-
-		return "{0} {1}".format(KegParametersFactory.keg_parameters[param], param_value)
+		return "{0} {1}".format(KegParametersFactory.keg_parameters[param], value)
 
 	def other_params(self, task):
-		if not self.config.has_option("keg-%s" % task, "other_params"):
+		section = "keg-%s" % task
+		if not self.config.has_option(section, "other_params"):
 			return ""
+		return self.config.get(section, "other_params")
 
-		return self.config.get("keg-%s" % task, "other_params")
-
-	def add_keg_params(self, job, job_label=""):
+	def add_keg_params(self, job, job_label="", index=None, scale=1.0):
 	    """Generates pegasus(-mpi)-keg parameters based on the job object and config file:
 	    - output files: based on Job linking info
 	    - performance attributes: cpu_time, wall_time, memory
 	    - other parameters (anything you want)
+	    'index' selects the values drawn for the job (e.g. its sweep point),
+	    and the times are multiplied by 'scale'
 	    """
 
 	    if not job_label:
@@ -82,6 +166,6 @@ class KegParametersFactory:
 	    #     job.addArguments(self.output_file( job_label, output_file.name ))
 
 	    for performance_parameter in [ "cpu_time", "wall_time" ]:
-	        job.addArguments(self.performance_attr( job_label, performance_parameter ))
+	        job.addArguments(self.performance_attr( job_label, performance_parameter, index, scale ))
 
 	    job.addArguments(self.other_params(job_label))		
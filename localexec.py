@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import json
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+from estimator import load_dax
+from sizes import parse_size
+
+__all__ = ["KegTask", "LocalExecutor", "read_replica_catalog", "peak_concurrency"]
+
+# The options of pegasus-keg that the executor emulates, and those it accepts
+KEG_OPTIONS = set(["-a", "-T", "-t", "-i", "-o", "-p", "-m"])
+
+# By default the executor gives up when no job has finished for this many
+# seconds longer than the longest job takes, since a worker that died (e.g.
+# killed for running out of memory) never returns its job's result
+LOST_JOB_GRACE = 300
+
+def read_replica_catalog(path):
+    "Return {lfn: path} for the file:// entries of a replica catalog in file format"
+    replicas = {}
+    f = open(path)
+    try:
+        for line in f:
+            cols = line.split()
+            if len(cols) >= 2 and cols[1].startswith("file://"):
+                replicas[cols[0]] = cols[1][len("file://"):]
+    finally:
+        f.close()
+    return replicas
+
+class KegTask(object):
+    """What a pegasus-keg command line asks for: burn 'cpu_time' seconds of
+    CPU, sleep 'wall_time' seconds, check that the 'inputs' exist and create
+    the 'outputs' as (name, size) pairs"""
+
+    def __init__(self, id, label, arguments):
+        self.id = id
+        self.label = label
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.inputs = []
+        self.outputs = []
+
+        option = None
+        for word in arguments:
+            if word in KEG_OPTIONS:
+                option = word
+            elif option == "-T":
+                self.cpu_time = float(word)
+            elif option == "-t":
+                self.wall_time = float(word)
+            elif option == "-i":
+                self.inputs.append(word)
+            elif option == "-o":
+                name, sep, size = word.partition("=")
+                self.outputs.append((name, parse_size(size) if sep else 0))
+
+def burn(seconds):
+    "Use 'seconds' of CPU time"
+    end = time.clock() + seconds
+    x = 0
+    while time.clock() < end:
+        for i in xrange(10000):
+            x += i * i
+    return x
+
+def write_output(path, size, sparse):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+    f = open(path, "wb")
+    try:
+        if sparse:
+            f.truncate(size)
+        else:
+            block = "\0" * (1024 * 1024)
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+    finally:
+        f.close()
+
+def run_task(task, workdir, epoch, time_scale, sparse):
+    """Run 'task' in 'workdir' and return its timing record. Times are
+    seconds since 'epoch'; keg times are multiplied by 'time_scale'."""
+    record = {"id": task.id, "label": task.label, "start": time.time() - epoch,
+        "pid": os.getpid(), "status": "ok"}
+    cpu = time.clock()
+    try:
+        missing = [name for name in task.inputs if not os.path.exists(os.path.join(workdir, name))]
+        if missing:
+            raise Exception("missing inputs: %s" % " ".join(missing))
+        burn(task.cpu_time * time_scale)
+        time.sleep(task.wall_time * time_scale)
+        written = 0
+        for name, size in task.outputs:
+            write_output(os.path.join(workdir, name), size, sparse)
+            written += size
+        record["bytes_written"] = written
+    except Exception, e:
+        record["status"] = "failed"
+        record["error"] = str(e)
+    record["end"] = time.time() - epoch
+    record["duration"] = record["end"] - record["start"]
+    record["cpu"] = time.clock() - cpu
+    return record
+
+def peak_concurrency(records):
+    "Return the largest number of jobs that were running at the same time"
+    events = sorted([(r["start"], 1) for r in records] + [(r["end"], -1) for r in records])
+    peak = running = 0
+    for t, delta in events:
+        running += delta
+        peak = max(peak, running)
+    return peak
+
+def _run_task(args):
+    return run_task(*args)
+
+class LocalExecutor(object):
+    """Runs a synthetic (pegasus-keg) workflow on the local machine.
+
+    The DAX and replica catalog of a workflow directory are read, the input
+    files of the workflow are linked into 'workdir' from their replicas or
+    from 'input_dir' (like pegasus-plan --input-dir), and
+    each job is run as soon as its parents have finished, by a pool of 'jobs'
+    processes (or threads). The run fails if no job finishes for 'timeout'
+    seconds (by default LOST_JOB_GRACE plus the longest job's keg times).
+    """
+
+    def __init__(self, daxfile, rcfile, workdir, input_dir=None, jobs=None, threads=False,
+            time_scale=1.0, sparse=False, timeout=None):
+        self.jobs = load_dax(daxfile)
+        self.replicas = read_replica_catalog(rcfile)
+        self.input_dir = input_dir
+        self.workdir = workdir
+        self.pool_size = jobs or multiprocessing.cpu_count()
+        self.threads = threads
+        self.time_scale = time_scale
+        self.sparse = sparse
+        self.timeout = timeout
+
+    def stage_in(self):
+        "Link the workflow inputs that no job produces into the work dir"
+        produced = set()
+        for job in self.jobs:
+            produced.update(name for name, link in job.uses if link == "output")
+        for job in self.jobs:
+            for name, link in job.uses:
+                if link != "input" or name in produced:
+                    continue
+                source = self.replicas.get(name)
+                if source is None and self.input_dir is not None:
+                    source = os.path.join(self.input_dir, name)
+                path = os.path.join(self.workdir, name)
+                if source is not None and os.path.exists(source) and not os.path.lexists(path):
+                    os.symlink(os.path.abspath(source), path)
+
+    def run(self):
+        "Run the workflow and return the list of timing records, in completion order"
+        if not os.path.isdir(self.workdir):
+            os.makedirs(self.workdir)
+        self.stage_in()
+
+        if self.threads:
+            pool = ThreadPool(self.pool_size)
+        else:
+            pool = multiprocessing.Pool(self.pool_size)
+
+        tasks = dict((job.id, KegTask(job.id, job.label, job.arguments)) for job in self.jobs)
+        timeout = self.timeout
+        if timeout is None:
+            timeout = LOST_JOB_GRACE + self.time_scale * max([t.cpu_time + t.wall_time
+                for t in tasks.values()] or [0])
+
+        epoch = time.time()
+        done = Queue.Queue()
+        remaining = dict((job, len(job.parents)) for job in self.jobs)
+        ready = [job for job in self.jobs if not job.parents]
+        byid = dict((job.id, job) for job in self.jobs)
+        submitted = {}
+        pending = set()
+        running = 0
+        records = []
+        try:
+            while ready or running:
+                for job in ready:
+                    submitted[job.id] = time.time() - epoch
+                    pool.apply_async(_run_task,
+                        ((tasks[job.id], self.workdir, epoch, self.time_scale, self.sparse),),
+                        callback=done.put)
+                    pending.add(job.id)
+                    running += 1
+                ready = []
+
+                try:
+                    record = done.get(timeout=timeout)
+                except Queue.Empty:
+                    raise Exception("No job finished within %g s, a worker may have died (running: %s)" % (
+                        timeout, ", ".join(sorted(byid[id].label for id in pending))))
+                pending.discard(record["id"])
+                running -= 1
+                record["ready"] = submitted[record["id"]]
+                records.append(record)
+                if record["status"] != "ok":
+                    print >>sys.stderr, "Job %s failed: %s" % (record["label"], record["error"])
+                    continue
+                for child in byid[record["id"]].children:
+                    remaining[child] -= 1
+                    if remaining[child] == 0:
+                        ready.append(child)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return records
+
+def main():
+    parser = OptionParser(usage="%prog [options] WORKFLOW_DIR")
+    parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs", default=None,
+        help="Number of jobs to run at once [default: number of CPUs]")
+    parser.add_option("--threads", action="store_true", dest="threads", default=False,
+        help="Run jobs in threads instead of processes (-T CPU time is then shared)")
+    parser.add_option("-i", "--input-dir", action="store", dest="input_dir",
+        default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "inputs"),
+        help="Directory of the workflow input files, as passed to pegasus-plan [default: %default]")
+    parser.add_option("-w", "--work-dir", action="store", dest="workdir", default=None,
+        help="Directory where the jobs run [default: WORKFLOW_DIR/local]")
+    parser.add_option("-s", "--time-scale", action="store", type="float", dest="time_scale", default=1.0,
+        help="Multiply the keg CPU and wall times by this factor [default: %default]")
+    parser.add_option("--sparse", action="store_true", dest="sparse", default=False,
+        help="Create outputs as sparse files instead of writing their data")
+    parser.add_option("--timeout", action="store", type="float", dest="timeout", default=None,
+        help="Give up if no job finishes for this many seconds [default: %d plus the longest job]" %
+            LOST_JOB_GRACE)
+    parser.add_option("--timings", action="store", dest="timings", default=None,
+        help="File for the per-job timing records [default: WORK_DIR/timings.json]")
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Specify WORKFLOW_DIR")
+
+    wfdir = args[0]
+    workdir = options.workdir or os.path.join(wfdir, "local")
+    executor = LocalExecutor(os.path.join(wfdir, "dax.xml"), os.path.join(wfdir, "rc.txt"), workdir,
+        input_dir=options.input_dir, jobs=options.jobs, threads=options.threads, time_scale=options.time_scale, sparse=options.sparse,
+        timeout=options.timeout)
+    records = executor.run()
+
+    timings = options.timings or os.path.join(workdir, "timings.json")
+    f = open(timings, "w")
+    try:
+        json.dump(records, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+    failed = [r for r in records if r["status"] != "ok"]
+    makespan = max([r["end"] for r in records] or [0])
+    print "Ran %d of %d jobs (%d failed) in %.1f s, at most %d at once, %d bytes written" % (
+        len(records), len(executor.jobs), len(failed), makespan,
+        peak_concurrency(records),
+        sum(r.get("bytes_written", 0) for r in records))
+    print "Timing records: %s" % timings
+    if failed or len(records) != len(executor.jobs):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
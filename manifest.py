@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+
+__all__ = ["Manifest", "digest", "hash_config", "hash_directory"]
+
+def digest(data):
+    "Return the SHA-256 hex digest of 'data'"
+    return hashlib.sha256(data).hexdigest()
+
+def hash_config(config, exclude=(), section="simulation", extra=()):
+    """Hash every option of a ConfigParser object except the options of
+    'section' listed in 'exclude', plus any 'extra' values"""
+    h = hashlib.sha256()
+    for s in sorted(config.sections()):
+        for name, value in sorted(config.items(s, raw=True)):
+            if s == section and name in exclude:
+                continue
+            h.update("%s\0%s\0%s\n" % (s, name, value))
+    for value in extra:
+        h.update("%s\n" % (value,))
+    return h.hexdigest()
+
+def hash_directory(path):
+    "Return a dict with the digest of every file in directory 'path'"
+    digests = {}
+    for name in sorted(os.listdir(path)):
+        filename = os.path.join(path, name)
+        if os.path.isfile(filename):
+            f = open(filename, "rb")
+            try:
+                digests[name] = digest(f.read())
+            finally:
+                f.close()
+    return digests
+
+class Manifest(object):
+    """Records what was generated in a workflow directory.
+
+    'settings' is the hash of the configuration shared by all points,
+    'templates' maps template names to digests, 'files' maps generated file
+    names to digests, and 'points' maps point tags to the key of the inputs
+    the point was generated from, the configs its jobs use, its replica
+    entries and its status in the run that wrote the manifest.
+    """
+
+    def __init__(self, settings, templates):
+        self.settings = settings
+        self.templates = templates
+        self.files = {}
+        self.points = {}
+
+    @classmethod
+    def load(cls, path):
+        "Read the manifest in 'path', or return None if there is none"
+        if not os.path.isfile(path):
+            return None
+        f = open(path)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        manifest = cls(data["settings"], data["templates"])
+        manifest.files = data["files"]
+        manifest.points = data["points"]
+        return manifest
+
+    def save(self, path):
+        data = {
+            "settings": self.settings,
+            "templates": self.templates,
+            "files": self.files,
+            "points": self.points
+        }
+        tmp = path + ".tmp"
+        f = open(tmp, "w")
+        try:
+            json.dump(data, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    def point_key(self, point, extra=()):
+        """Return the key of everything the files of sweep 'point' are
+        generated from, plus any 'extra' values"""
+        h = hashlib.sha256()
+        h.update(self.settings)
+        for name, value in sorted(self.templates.items()):
+            h.update("%s\0%s\n" % (name, value))
+        for name in point._fields:
+            if name != "index":
+                h.update("%s\0%s\n" % (name, getattr(point, name)))
+        for value in extra:
+            h.update("%s\n" % (value,))
+        return h.hexdigest()
+
+    def statuses(self):
+        "Return a dict mapping each status to the sorted tags of the points that have it"
+        result = {}
+        for tag, entry in self.points.items():
+            result.setdefault(entry["status"], []).append(tag)
+        for tags in result.values():
+            tags.sort()
+        return result
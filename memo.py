@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import os
+import json
+import shutil
+import hashlib
+from optparse import OptionParser
+
+__all__ = ["MemoCache", "job_key", "output_key"]
+
+# The record of the keys of a workflow's outputs that daxgen.py writes in
+# the workflow directory, for 'memo.py record'
+KEYS_FILE = "memo.json"
+
+def job_key(job, input_keys):
+    """Return the key of a DAX3 'job' whose input files have the keys
+    'input_keys' ({name: key}): a digest of its transformation, arguments,
+    environment and inputs. Jobs with the same key produce the same
+    outputs."""
+    h = hashlib.sha256()
+    h.update("%s::%s:%s\n" % (job.namespace, job.name, job.version))
+    h.update(" ".join(getattr(arg, "name", arg) for arg in job.arguments) + "\n")
+    for stream in (job.stdin, job.stdout, job.stderr):
+        h.update("%s\n" % (getattr(stream, "name", stream),))
+    for profile in sorted((p.key, p.value) for p in job.profiles if p.namespace == "env"):
+        h.update("env %s=%s\n" % profile)
+    for name, key in sorted(input_keys.items()):
+        h.update("input %s %s\n" % (name, key))
+    return h.hexdigest()
+
+def output_key(key, name):
+    "Return the key of the output 'name' of the job with 'key'"
+    return hashlib.sha256("%s\0%s" % (key, name)).hexdigest()
+
+class MemoCache(object):
+    """The outputs of earlier workflows, by output key.
+
+    root/index.json maps the key of each recorded output to the path of the
+    file, which is either where the workflow staged it out or a copy in
+    root/<first two hex digits>/<key>. Outputs whose file no longer exists
+    are not found.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_file = os.path.join(root, "index.json")
+        self.index = {}
+        if os.path.isfile(self.index_file):
+            f = open(self.index_file)
+            try:
+                self.index = json.load(f)
+            finally:
+                f.close()
+
+    def lookup(self, key):
+        "Return the path of the output with 'key', or None if it is not cached"
+        entry = self.index.get(key)
+        if entry is None or not os.path.isfile(entry["path"]):
+            return None
+        return entry["path"]
+
+    def record(self, key, path, label=None, copy=False):
+        "Record the file 'path' as the output with 'key', copying it into the cache if 'copy'"
+        path = os.path.abspath(path)
+        if copy:
+            target = os.path.join(self.root, key[:2], key)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(path, target + ".tmp")
+            os.rename(target + ".tmp", target)
+            path = target
+        self.index[key] = {"path": path, "job": label}
+
+    def save(self):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        tmp = self.index_file + ".tmp"
+        f = open(tmp, "w")
+        try:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, self.index_file)
+
+def record_outputs(cache, wfdir, outdir, copy=False):
+    """Record the outputs of the workflow in 'wfdir' that were staged out to
+    'outdir' in 'cache'. Return the number of outputs recorded."""
+    f = open(os.path.join(wfdir, KEYS_FILE))
+    try:
+        outputs = json.load(f)["outputs"]
+    finally:
+        f.close()
+    count = 0
+    for name, entry in sorted(outputs.items()):
+        path = os.path.join(outdir, name)
+        if os.path.isfile(path) and cache.lookup(entry["key"]) is None:
+            cache.record(entry["key"], path, entry["job"], copy)
+            count += 1
+    cache.save()
+    return count
+
+def main():
+    parser = OptionParser(usage="%prog record [options] CACHE_DIR WORKFLOW_DIR OUTPUT_DIR")
+    parser.add_option("-c", "--copy", action="store_true", dest="copy", default=False,
+        help="Copy the outputs into CACHE_DIR instead of recording where they are")
+    options, args = parser.parse_args()
+
+    if len(args) != 4 or args[0] != "record":
+        parser.error("Specify record CACHE_DIR WORKFLOW_DIR OUTPUT_DIR")
+
+    cache = MemoCache(args[1])
+    count = record_outputs(cache, args[2], args[3], options.copy)
+    print "Recorded %d outputs in %s (%d in total)" % (count, args[1], len(cache.index))
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,12 @@ RC=$WORKFLOW_DIR/rc.txt
 SC=$DIR/sites.xml
 PP=$DIR/pegasus.properties
 
+# daxgen.py writes this file when short jobs are clustered
+CLUSTER=
+if [ -f "$WORKFLOW_DIR/clustering" ]; then
+    CLUSTER="--cluster $(cat $WORKFLOW_DIR/clustering)"
+fi
+
 echo "Planning workflow..."
 pegasus-plan \
     -Dpegasus.metrics.app=sns \
@@ -39,5 +45,5 @@ pegasus-plan \
     --input-dir $INPUT_DIR \
     --sites $SITE \
     --output-site $OUTPUT_SITE \
-    --cleanup leaf
+    --cleanup leaf $CLUSTER
 
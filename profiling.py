@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import resource
+import functools
+
+__all__ = ["Profiler", "PROFILE"]
+
+class Phase(object):
+    "Context manager that adds the time spent in its block to a phase of a Profiler"
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.time() - self.start)
+        return False
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class Profiler(object):
+    """Collects the time spent in named phases and the files and bytes
+    written while a workflow is generated.
+
+    Phases nest, so the time of a phase includes the phases it calls. Nothing
+    is recorded unless 'enabled' is set, and the disabled cost is one
+    attribute check per instrumented call.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.start = time.time()
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, name, seconds, calls=1):
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [calls, seconds]
+        else:
+            entry[0] += calls
+            entry[1] += seconds
+
+    def phase(self, name):
+        "Return a context manager that times its block as phase 'name'"
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def timed(self, name=None):
+        "Decorator that times each call of a function as phase 'name' (default: the function name)"
+        def decorator(func):
+            phase = name or func.__name__
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add(phase, time.time() - start)
+            return wrapper
+        return decorator
+
+    def wrote(self, nbytes, files=1):
+        "Record that 'files' files with 'nbytes' bytes in total were written"
+        if self.enabled:
+            self.files += files
+            self.bytes += nbytes
+
+    def take(self):
+        """Return what was recorded since the last reset and reset, so that a
+        worker process can hand its counts to the parent"""
+        if not self.enabled:
+            return None
+        data = (self.phases, self.files, self.bytes)
+        self.reset()
+        return data
+
+    def merge(self, data):
+        "Add the counts returned by take() in another process"
+        if data is None:
+            return
+        phases, files, nbytes = data
+        for name, (calls, seconds) in phases.items():
+            self.add(name, seconds, calls)
+        self.files += files
+        self.bytes += nbytes
+
+    def report(self, **extra):
+        "Return the profile as a dict; 'extra' items are added to it"
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        data = {
+            "command": sys.argv,
+            "wall": time.time() - self.start,
+            "cpu": self_usage.ru_utime + self_usage.ru_stime,
+            "cpu_children": children.ru_utime + children.ru_stime,
+            "max_rss_kb": self_usage.ru_maxrss,
+            "max_rss_children_kb": children.ru_maxrss,
+            "files_written": self.files,
+            "bytes_written": self.bytes,
+            "phases": dict((name, {"calls": calls, "seconds": seconds})
+                for name, (calls, seconds) in self.phases.items())
+        }
+        data.update(extra)
+        return data
+
+    def save(self, path, **extra):
+        "Write the profile to 'path' as JSON"
+        f = open(path, "w")
+        try:
+            json.dump(self.report(**extra), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+# The profiler of the generator in this process
+PROFILE = Profiler()
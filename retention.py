@@ -0,0 +1,115 @@
+from sizes import parse_size, format_bytes
+
+__all__ = ["RetentionPolicy", "FILE_CLASSES", "POLICIES"]
+
+# The classes of workflow outputs that a policy can be set for
+FILE_CLASSES = {
+    "prod_dcd": "production trajectories",
+    "ptraj_fit": "ptraj RMS fits",
+    "ptraj_dcd": "fitted trajectories",
+    "fqt": "sassena signal files",
+    "fqt_store": "signal stores of the whole sweep",
+}
+
+# The uses() flags of each policy. stage-out only sets transfer, so that
+# the default policy gives the same DAX as before policies existed.
+POLICIES = {
+    "stage-out": {"transfer": True},
+    "keep": {"transfer": False, "register": True},
+    "discard": {"transfer": False, "register": False},
+}
+
+class RetentionPolicy(object):
+    """What happens to each class of workflow output, from the [retention]
+    section of the config file.
+
+    stage-out transfers the file to the output site, keep leaves it in the
+    scratch directory and registers it in the replica catalog, and discard
+    leaves it to be cleaned up. A class can have a size threshold
+    ('<class>_max_size', e.g. 2G): larger files get the '<class>_oversize'
+    policy (default: keep) instead. The policy of every file is counted so
+    that the projected volume of each policy can be reported; a file that
+    the workflow turns out not to produce can be discounted again.
+    """
+
+    def __init__(self, config, section="retention"):
+        self.policies = {}
+        self.max_sizes = {}
+        self.oversize = {}
+        for kind in FILE_CLASSES:
+            self.policies[kind] = self.get(config, section, kind, "stage-out")
+            self.oversize[kind] = self.get(config, section, "%s_oversize" % kind, "keep")
+            if config.has_option(section, "%s_max_size" % kind):
+                self.max_sizes[kind] = parse_size(config.get(section, "%s_max_size" % kind))
+        if config.has_section(section):
+            for option in config.options(section):
+                kind = option
+                for suffix in ("_max_size", "_oversize"):
+                    if option.endswith(suffix):
+                        kind = option[:-len(suffix)]
+                if kind not in FILE_CLASSES:
+                    raise Exception("Unknown file class in [%s]: %s" % (section, option))
+        self.reset()
+
+    def get(self, config, section, option, default):
+        if not config.has_option(section, option):
+            return default
+        policy = config.get(section, option).strip()
+        if policy not in POLICIES:
+            raise Exception("Invalid retention policy for %s: %s (use %s)" % (
+                option, policy, ", ".join(sorted(POLICIES))))
+        return policy
+
+    def reset(self):
+        # {policy: [files, bytes, files of unknown size]}
+        self.volumes = dict((policy, [0, 0, 0]) for policy in POLICIES)
+        # {file name: (policy, size)}
+        self.files = {}
+
+    def policy(self, kind, size=None):
+        "Return the policy for a file of class 'kind' that is 'size' bytes (None if unknown)"
+        max_size = self.max_sizes.get(kind)
+        if max_size is not None and size is not None and size > max_size:
+            return self.oversize[kind]
+        return self.policies[kind]
+
+    def flags(self, kind, size=None, name=None):
+        """Return the uses() flags for the file 'name' of class 'kind' that is
+        'size' bytes, and count it in the projected volumes"""
+        policy = self.policy(kind, size)
+        self.count(policy, size, 1)
+        if name is not None:
+            self.files[name] = (policy, size)
+        return POLICIES[policy]
+
+    def count(self, policy, size, files):
+        volume = self.volumes[policy]
+        volume[0] += files
+        if size is None:
+            volume[2] += files
+        else:
+            volume[1] += files * size
+
+    def discount(self, name):
+        "Leave the file 'name' out of the projected volumes, if it was counted"
+        entry = self.files.pop(name, None)
+        if entry is not None:
+            self.count(entry[0], entry[1], -1)
+
+    def retained(self, name):
+        "Return True if the file 'name' is staged out or kept"
+        entry = self.files.get(name)
+        return entry is not None and entry[0] != "discard"
+
+    def summary(self):
+        "Return a line for each policy that files were given"
+        lines = []
+        for policy in ("stage-out", "keep", "discard"):
+            files, size, unknown = self.volumes[policy]
+            if not files:
+                continue
+            line = "%-10s %s in %d files" % (policy + ":", format_bytes(size), files)
+            if unknown:
+                line += " (%d of unknown size)" % unknown
+            lines.append(line)
+        return lines
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+import multiprocessing
+import numpy
+from optparse import OptionParser
+from dcdio import DCDFile, create_dcd
+
+__all__ = ["kabsch_fit", "fit_block", "fit_trajectory", "write_rms"]
+
+# Frames fitted at a time; a block of 256 frames of 100000 atoms is about
+# 600 MB in double precision
+DEFAULT_BLOCK = 256
+
+def kabsch_fit(coordinates, reference):
+    """Fit each frame of 'coordinates' (frames, atoms, 3) onto 'reference'
+    (atoms, 3) with the rotation and translation that minimize the RMSD
+    (Kabsch). Return the fitted coordinates and the RMSD of each frame."""
+    coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+    reference = numpy.asarray(reference, dtype=numpy.float64)
+    ref_center = reference.mean(axis=0)
+    ref = reference - ref_center
+    centers = coordinates.mean(axis=1)
+    moved = coordinates - centers[:, numpy.newaxis, :]
+
+    # Covariance of each frame with the reference, and the rotation that
+    # maps the frame onto the reference (without reflection)
+    covariance = numpy.einsum("fni,nj->fij", moved, ref)
+    u, s, vt = numpy.linalg.svd(covariance)
+    d = numpy.sign(numpy.linalg.det(numpy.matmul(u, vt)))
+    u[:, :, 2] *= d[:, numpy.newaxis]
+    rotation = numpy.matmul(u, vt)
+
+    fitted = numpy.matmul(moved, rotation)
+    rmsd = numpy.sqrt(((fitted - ref) ** 2).sum(axis=2).mean(axis=1))
+    return fitted + ref_center, rmsd
+
+def fit_block(args):
+    """Fit frames 'start' to 'stop' of the DCD 'input' onto 'reference' and
+    write them to the same frames of the DCD 'output', which must exist.
+    Return the RMSD of each frame."""
+    input, output, reference, start, stop, block = args
+    source = DCDFile(input)
+    target = DCDFile(output, mode="r+")
+    rmsd = []
+    for first in range(start, stop, block):
+        last = min(first + block, stop)
+        fitted, values = kabsch_fit(source.coordinates(first, last), reference)
+        target.set_frames(first, fitted.astype(numpy.float32), source.cells(first, last))
+        rmsd.append(values)
+    target.flush()
+    return numpy.concatenate(rmsd) if rmsd else numpy.zeros(0)
+
+def fit_trajectory(input, output, jobs=1, block=DEFAULT_BLOCK):
+    """Fit every frame of the DCD 'input' onto its first frame, as cpptraj
+    'rms first' does, and write the fitted trajectory to 'output'. With more
+    than one job, contiguous ranges of frames are fitted by a pool of
+    processes that each write their frames of the output in place. Return
+    the RMSD of each frame."""
+    source = DCDFile(input)
+    create_dcd(output, source.natoms, source.nframes, **source.header())
+    if source.nframes == 0:
+        return numpy.zeros(0)
+    reference = source.coordinates(0, 1)[0].astype(numpy.float64)
+
+    jobs = max(1, min(jobs, source.nframes))
+    chunk = -(-source.nframes // jobs)
+    tasks = [(input, output, reference, start, min(start + chunk, source.nframes), block)
+        for start in range(0, source.nframes, chunk)]
+    if jobs == 1:
+        results = [fit_block(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(fit_block, tasks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return numpy.concatenate(results)
+
+def write_rms(path, rmsd, time=1.0):
+    "Write the RMSD of each frame in the format of a cpptraj data file"
+    f = open(path, "w")
+    try:
+        f.write("%-8s %12s\n" % ("#Frame", "RMSD_00001"))
+        for i, value in enumerate(rmsd):
+            f.write("%8g %12.4f\n" % ((i + 1) * time, value))
+    finally:
+        f.close()
+
+def main():
+    parser = OptionParser(usage="%prog [options] INPUT_DCD OUTPUT_DCD FIT_FILE")
+    parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs", default=1,
+        help="Number of processes [default: %default]")
+    parser.add_option("-b", "--block", action="store", type="int", dest="block", default=DEFAULT_BLOCK,
+        help="Frames fitted at a time by each process [default: %default]")
+    parser.add_option("-t", "--time", action="store", type="float", dest="time", default=1.0,
+        help="Time between frames in the fit file [default: %default]")
+    options, args = parser.parse_args()
+
+    if len(args) != 3:
+        parser.error("Specify INPUT_DCD, OUTPUT_DCD and FIT_FILE")
+
+    rmsd = fit_trajectory(args[0], args[1], options.jobs, options.block)
+    write_rms(args[2], rmsd, options.time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import sys
+import numpy
+from optparse import OptionParser
+
+__all__ = ["merge_signals", "read_signal", "write_signal", "merge_files"]
+
+def merge_signals(signals, weights=None):
+    """Merge sassena signals computed for parts of a q vector scan.
+
+    Each signal is a dict of arrays with a "qvectors" array (N x 3) and the
+    fqt, fq0, fq and fq2 arrays, whose first axis follows the q vectors. The
+    q vectors of all signals are combined in the order they are first seen.
+    Signals for the same q vector (shards of the orientation average) are
+    averaged, weighted by 'weights' (e.g. the number of orientation vectors
+    of each shard; default: equal weights).
+    """
+    if not signals:
+        raise Exception("No signals to merge")
+    if weights is None:
+        weights = [1.0] * len(signals)
+    if len(weights) != len(signals):
+        raise Exception("Got %d weights for %d signals" % (len(weights), len(signals)))
+    datasets = sorted(name for name in signals[0] if name != "qvectors")
+    for signal in signals[1:]:
+        if sorted(name for name in signal if name != "qvectors") != datasets:
+            raise Exception("The signals do not have the same datasets")
+
+    # Row of each q vector in the merged signal
+    rows = {}
+    qvectors = []
+    indexes = []
+    for signal in signals:
+        index = numpy.empty(len(signal["qvectors"]), dtype=int)
+        for i, q in enumerate(signal["qvectors"]):
+            key = tuple(q)
+            if key not in rows:
+                rows[key] = len(qvectors)
+                qvectors.append(q)
+            index[i] = rows[key]
+        indexes.append(index)
+
+    n = len(qvectors)
+    total = numpy.zeros(n)
+    for index, weight in zip(indexes, weights):
+        numpy.add.at(total, index, weight)
+
+    merged = {"qvectors": numpy.array(qvectors)}
+    for name in datasets:
+        first = signals[0][name]
+        data = numpy.zeros((n,) + first.shape[1:], dtype=numpy.float64)
+        for signal, index, weight in zip(signals, indexes, weights):
+            numpy.add.at(data, index, weight * signal[name])
+        scale = total.reshape((n,) + (1,) * (data.ndim - 1))
+        merged[name] = (data / scale).astype(first.dtype)
+    return merged
+
+def read_signal(path):
+    "Return the datasets of the sassena signal file 'path' and its attributes"
+    import h5py
+    f = h5py.File(path, "r")
+    try:
+        return dict((name, f[name][...]) for name in f), dict(f.attrs.items())
+    finally:
+        f.close()
+
+def write_signal(path, signal, attrs=None):
+    "Write 'signal' to 'path' in the layout of a sassena signal file"
+    import h5py
+    f = h5py.File(path, "w")
+    try:
+        for name, data in sorted(attrs.items() if attrs else []):
+            f.attrs[name] = data
+        for name, data in sorted(signal.items()):
+            f.create_dataset(name, data=data)
+    finally:
+        f.close()
+
+def merge_files(output, inputs, weights=None):
+    "Merge the sassena signal files 'inputs' into 'output'"
+    signals = []
+    attrs = None
+    for path in inputs:
+        signal, signal_attrs = read_signal(path)
+        signals.append(signal)
+        if attrs is None:
+            attrs = signal_attrs
+    write_signal(output, merge_signals(signals, weights), attrs)
+
+def main():
+    parser = OptionParser(usage="%prog [options] -o OUTPUT INPUT...")
+    parser.add_option("-o", "--output", action="store", dest="output", default=None,
+        help="Merged signal file")
+    parser.add_option("-w", "--weights", action="store", dest="weights", default=None,
+        help="Comma-separated weight of each input in orientation averages [default: equal]")
+    options, args = parser.parse_args()
+
+    if options.output is None or len(args) == 0:
+        parser.error("Specify OUTPUT and at least one INPUT")
+
+    weights = None
+    if options.weights:
+        weights = [float(w) for w in options.weights.split(",")]
+        if len(weights) != len(args):
+            parser.error("Specify one weight for each INPUT")
+
+    merge_files(options.output, args, weights)
+
+if __name__ == '__main__':
+    main()
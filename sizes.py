@@ -0,0 +1,17 @@
+__all__ = ["SIZE_UNITS", "parse_size", "format_bytes"]
+
+# The units of keg and config file sizes like 512K or 2G
+SIZE_UNITS = {"B": 1, "K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+def parse_size(text):
+    "Return the number of bytes in a size like 512K"
+    if text[-1:].upper() in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1:].upper()])
+    return int(float(text))
+
+def format_bytes(n):
+    "Return 'n' bytes in the largest unit that keeps the number above 1, e.g. 1.5 GB"
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return "%.1f %s" % (n, unit)
+        n /= 1024.0
@@ -0,0 +1,141 @@
+import itertools
+from collections import namedtuple
+
+__all__ = ["SweepPoint", "ParameterSweep", "warm_start_order"]
+
+# The dimensions a refinement campaign can be swept over. Each entry is
+# (name, single-value option, list option). production_steps uses the same
+# option for both: it is swept when it contains more than one value.
+DIMENSIONS = [
+    ("temperature", "temperature", "temperatures"),
+    ("charge", "charge", "charges"),
+    ("pressure", "pressure", "pressures"),
+    ("production_steps", "production_steps", "production_steps"),
+]
+
+SweepPoint = namedtuple("SweepPoint",
+    ["index", "tag", "temperature", "charge", "pressure", "production_steps"])
+
+def split_values(value):
+    "Split a comma-separated config value into a list of stripped strings"
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+class ParameterSweep(object):
+    """The set of sweep points described by the [simulation] section.
+
+    Every dimension can be given as a single value or as a comma-separated
+    list. With 'sweep = product' (the default) the points are the Cartesian
+    product of all the lists; with 'sweep = zip' the lists are paired up
+    element-wise, and single values are repeated for every point.
+    """
+
+    def __init__(self, config, section="simulation"):
+        self.values = {}
+        self.swept = []
+
+        for name, single, plural in DIMENSIONS:
+            if config.has_option(section, plural):
+                values = split_values(config.get(section, plural))
+                listed = plural != single or len(values) > 1
+            elif config.has_option(section, single):
+                values = split_values(config.get(section, single))
+                listed = len(values) > 1
+            else:
+                raise Exception("Missing option '%s' or '%s' in [%s]" % (single, plural, section))
+
+            if len(values) == 0:
+                raise Exception("No values for '%s' in [%s]" % (plural, section))
+
+            self.values[name] = values
+            if listed:
+                self.swept.append(name)
+
+        # The tag identifies a point in file names and job labels. It is made
+        # of the values of the swept dimensions only, so a temperature sweep
+        # still produces names like 'equilibrate_200.conf'.
+        if len(self.swept) == 0:
+            self.swept.append("temperature")
+
+        if config.has_option(section, "sweep"):
+            self.mode = config.get(section, "sweep").strip()
+        else:
+            self.mode = "product"
+
+        if self.mode not in ("product", "zip"):
+            raise Exception("Invalid sweep mode: %s" % self.mode)
+
+        if self.mode == "zip":
+            lengths = set(len(v) for v in self.values.values() if len(v) > 1)
+            if len(lengths) > 1:
+                raise Exception("All lists must have the same length when sweep = zip")
+
+    def is_swept(self, name):
+        return name in self.swept
+
+    def combinations(self):
+        names = [d[0] for d in DIMENSIONS]
+        columns = [self.values[n] for n in names]
+        if self.mode == "product":
+            return itertools.product(*columns)
+        size = max(len(c) for c in columns)
+        return itertools.izip(*[c if len(c) > 1 else c * size for c in columns])
+
+    def points(self):
+        "Generate a SweepPoint for every point in the sweep"
+        names = [d[0] for d in DIMENSIONS]
+        seen = set()
+        for index, values in enumerate(self.combinations()):
+            params = dict(zip(names, values))
+            tag = "_".join(params[n] for n in names if n in self.swept)
+            if tag in seen:
+                raise Exception("Duplicate sweep point: %s" % tag)
+            seen.add(tag)
+            yield SweepPoint(index=index, tag=tag, **params)
+
+    def __len__(self):
+        if self.mode == "zip":
+            return max(len(v) for v in self.values.values())
+        size = 1
+        for v in self.values.values():
+            size *= len(v)
+        return size
+
+def warm_start_order(points, max_length=0):
+    """Order 'points' for warm-started equilibration. The temperatures of
+    the points that only differ in temperature and production_steps are
+    sorted and cut into runs of at most 'max_length' temperatures (0: no
+    limit). The points at the middle temperature of each run start cold,
+    and the points at every other temperature start from the first point at
+    the neighbouring temperature on the side of the middle, so a run of n
+    temperatures equilibrates in (n + 1) // 2 steps. Return the points in an
+    order where each comes after the point it starts from, and a dict that
+    maps the tag of each point to the tag of that point (None for cold
+    starts)."""
+    groups = []
+    members = {}
+    for point in points:
+        key = (point.charge, point.pressure)
+        if key not in members:
+            members[key] = {}
+            groups.append(key)
+        members[key].setdefault(float(point.temperature), []).append(point)
+
+    order = []
+    seeds = {}
+    for key in groups:
+        temperatures = sorted(members[key])
+        size = max_length if max_length > 0 else len(temperatures)
+        for start in range(0, len(temperatures), size):
+            run = [members[key][t] for t in temperatures[start:start + size]]
+            middle = (len(run) - 1) // 2
+            steps = [(middle, None)]
+            for i in range(1, max(middle + 1, len(run) - middle)):
+                if middle - i >= 0:
+                    steps.append((middle - i, middle - i + 1))
+                if middle + i < len(run):
+                    steps.append((middle + i, middle + i - 1))
+            for at, seed in steps:
+                for point in run[at]:
+                    seeds[point.tag] = None if seed is None else run[seed][0].tag
+                    order.append(point)
+    return order, seeds
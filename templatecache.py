@@ -0,0 +1,90 @@
+import os
+import string
+
+__all__ = ["CompiledTemplate", "TemplateRegistry"]
+
+class CompiledTemplate(object):
+    """A str.format() template that has been split into literal and field segments.
+
+    'parts' holds the literal text with a None slot for every field, and
+    'fields' lists (slot, field name, conversion, format spec) for the slots.
+    Rendering fills in the slots of a copy of 'parts' and joins it, which is
+    equivalent to string.Formatter().format(text, **kwargs).
+    """
+
+    formatter = string.Formatter()
+
+    def __init__(self, name, text):
+        self.name = name
+        self.parts = []
+        self.fields = []
+        self.simple = True
+
+        for literal, field, spec, conversion in self.formatter.parse(text):
+            if literal:
+                self.parts.append(literal)
+            if field is None:
+                continue
+            if field == "" or field.isdigit():
+                raise Exception("Template %s uses positional fields" % name)
+            if spec or conversion or "." in field or "[" in field:
+                self.simple = False
+            self.fields.append((len(self.parts), field, conversion, spec))
+            self.parts.append(None)
+
+    def segments(self, kwargs):
+        "Return the list of rendered segments for 'kwargs'"
+        parts = self.parts[:]
+        if self.simple:
+            for slot, field, conversion, spec in self.fields:
+                value = kwargs[field]
+                parts[slot] = value if isinstance(value, basestring) else format(value)
+        else:
+            formatter = self.formatter
+            for slot, field, conversion, spec in self.fields:
+                value = formatter.get_field(field, (), kwargs)[0]
+                value = formatter.convert_field(value, conversion)
+                parts[slot] = formatter.format_field(value, spec or "")
+        return parts
+
+    def render(self, **kwargs):
+        "Return the template filled in with 'kwargs'"
+        return "".join(self.segments(kwargs))
+
+    def render_to(self, buf, **kwargs):
+        """Write the template filled in with 'kwargs' to 'buf' and return the
+        number of characters written. 'buf' is anything with a write() method,
+        e.g. a file or a cStringIO buffer used to batch several renders."""
+        data = "".join(self.segments(kwargs))
+        buf.write(data)
+        return len(data)
+
+class TemplateRegistry(object):
+    "Loads and compiles each template in 'template_dir' once"
+
+    def __init__(self, template_dir):
+        self.template_dir = template_dir
+        self.templates = {}
+
+    def get(self, name):
+        "Return the CompiledTemplate called 'name'"
+        template = self.templates.get(name)
+        if template is None:
+            f = open(os.path.join(self.template_dir, name))
+            try:
+                text = f.read()
+            finally:
+                f.close()
+            template = CompiledTemplate(name, text)
+            self.templates[name] = template
+        return template
+
+    def render(self, name, **kwargs):
+        return self.get(name).render(**kwargs)
+
+    def render_to(self, name, buf, **kwargs):
+        return self.get(name).render_to(buf, **kwargs)
+
+    def clear(self):
+        "Forget all compiled templates so they are reloaded on next use"
+        self.templates = {}